@@ -1,16 +1,31 @@
-from fastapi import APIRouter, Header,Request,Response,Depends
+from fastapi import APIRouter,Request,Response,Depends,Query,UploadFile,File
+from fastapi.responses import StreamingResponse, ORJSONResponse
 import utils.database as database
 from application.schema import *
 from passlib.context import CryptContext
 from application.authentication import LoginHandler
 from utils.exceptions import *
 import traceback
-from typing import Annotated
+import json
+from typing import Annotated, Optional, Literal
+from datetime import datetime
 from application.service import *
 from application.user_management import UserManagement
-from application.camera_management import CameraManagement
+from application.retention import audit_retention
+from utils.metrics import MetricsRoute
+from application.camera_cache import camera_list_cache, camera_scope, etag_matches
+from application.camera_management import CameraManagement, CAMERA_PAGE_SIZE, CAMERA_MAX_PAGE_SIZE, parse_camera_csv
 
-v1 = APIRouter()
+v1 = APIRouter(route_class=MetricsRoute)
+
+
+def listing_body(content):
+     '''
+     Encode a listing of plain column dicts with orjson, which handles dates and datetimes natively
+     Listings return ORJSONResponse directly instead of going through response_model validation and
+     jsonable_encoder, their models are declared under responses= for the OpenAPI schema
+     '''
+     return ORJSONResponse(content).body
 
 # Move to env variables later on 
 
@@ -30,7 +45,7 @@ async def login(data: UserLogin):
      
      try:
           login_handler = LoginHandler()
-          x = login_handler.login_user(data.email,data.password,data.refresh_token)
+          x = await login_handler.login_user(data.email,data.password,data.refresh_token)
           return {"responseData": x}
      except Error as e:
           # Pass through any custom raised errors as-is
@@ -42,27 +57,39 @@ async def login(data: UserLogin):
      
 
 @v1.get("/users/me", tags=["User login / Authentication management"])
-@LoginHandler.authenticate_user
-async def current_user(request: Request, token: str = Header(None)):
+async def current_user(request: Request, auth_data: dict = Depends(LoginHandler.authenticate)):
      '''
      Return information about the current logged in user
-     auth_data is being injected by login decorator
+     auth_data is resolved from the token by the authentication dependency
+     '''
+     return auth_data
+
+
+@v1.post("/logout", tags=["User login / Authentication management"])
+async def logout(request: Request, auth_data: dict = Depends(LoginHandler.authenticate)):
      '''
-     return current_user.auth_data
+     End the sessions of the current user and revoke the access token of the request
+     '''
+     try:
+         login_handler = LoginHandler()
+         return await login_handler.logout_user(auth_data, request.state.token_claims)
+     except Error as e:
+          # Pass through any custom raised errors as-is
+          raise
+     except Exception as e:
+          traceback.print_exc()
+          raise Error(500,"Something went wrong!")
 
 
-@v1.get("/users", tags=["User Management"])
-@LoginHandler.authenticate_user
-async def list_users(request: Request, token: str = Header(None)):
+@v1.get("/users", tags=["User Management"], response_class=ORJSONResponse, responses={200: {"model": UserListResponse}})
+async def list_users(request: Request, auth_data: dict = Depends(LoginHandler.requires("VIEW_ALL_USERS"))):
      '''
      List All users currently created in our database
      Can only be accessed by the superadmin OR users with "VIEW_ALL_USERS permission"
      '''
-     permission_required = "VIEW_ALL_USERS"
      try:
-         require_permissions(list_users.auth_data, permission_required)
          user_management = UserManagement()
-         return {"responseData": user_management.list_all_users()}
+         return ORJSONResponse({"responseData": await user_management.list_all_users()})
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -73,19 +100,15 @@ async def list_users(request: Request, token: str = Header(None)):
 
 
 @v1.post("/users", tags=["User Management"])
-@LoginHandler.authenticate_user
-async def create_user(data: CreateUser, request: Request, response: Response, token: str = Header(None),):
+async def create_user(data: CreateUser, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("CREATE_USER"))):
      '''
      Create a user in our database
      Can only be accessed by the superadmin OR users with "CREATE_USER permission"
      '''
-     permission_required = "CREATE_USER"
      try:
-         auth_data = create_user.auth_data
-         require_permissions(auth_data, permission_required)
          user_management = UserManagement()
          response.status_code = 201
-         return {"responseData":{"message":"User created!", "data":user_management.create_user(data,auth_data)}}
+         return {"responseData":{"message":"User created!", "data":await user_management.create_user(data,auth_data)}}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -96,20 +119,16 @@ async def create_user(data: CreateUser, request: Request, response: Response, to
 
 
 @v1.patch("/users", tags=["User Management"])
-@LoginHandler.authenticate_user
-async def edit_user(data: ModifyUser, request: Request, response: Response, token: str = Header(None),):
+async def edit_user(data: ModifyUser, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("EDIT_USER"))):
      '''
      Delete a user in our database
      Can only be accessed by the superadmin OR users with "EDIT_USER permission"
      '''
 
-     permission_required = "EDIT_USER"
      try:
-         auth_data = edit_user.auth_data
-         require_permissions(auth_data, permission_required)
          user_management = UserManagement()
          response.status_code = 200
-         return {"responseData":{"message":"User modified!", "data":user_management.modify_user(data,auth_data)}}
+         return {"responseData":{"message":"User modified!", "data":await user_management.modify_user(data,auth_data)}}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -120,20 +139,16 @@ async def edit_user(data: ModifyUser, request: Request, response: Response, toke
 
 
 @v1.delete("/users", tags=["User Management"])
-@LoginHandler.authenticate_user
-async def delete_user(data: DeleteUser, request: Request, response: Response, token: str = Header(None),):
+async def delete_user(data: DeleteUser, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("DELETE_USER"))):
      '''
      Delete a user in our database
      Can only be accessed by the superadmin OR users with "DELETE_USER permission"
      '''
 
-     permission_required = "DELETE_USER"
      try:
-         auth_data = delete_user.auth_data
-         require_permissions(auth_data, permission_required)
          user_management = UserManagement()
          response.status_code = 200
-         return {"responseData":{"message":"User deleted!", "data":user_management.delete_user(data,auth_data)}}
+         return {"responseData":{"message":"User deleted!", "data":await user_management.delete_user(data,auth_data)}}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -142,17 +157,89 @@ async def delete_user(data: DeleteUser, request: Request, response: Response, to
           # Handle anything exceptional that we have not encountered anywhere
           raise Error(status_code=500,details="Something went wrong!")
      
-@v1.get("/activity", tags=["Activity Logs"])
-@LoginHandler.authenticate_user
-async def list_activity_logs(request: Request, token: str = Header(None)):
+@v1.get("/activity", tags=["Activity Logs"], response_class=ORJSONResponse, responses={200: {"model": AuditLogListResponse}})
+async def list_activity_logs(request: Request, auth_data: dict = Depends(LoginHandler.requires("VIEW_ACTIVITY_LOGS")),
+                             limit: int = Query(ACTIVITY_PAGE_SIZE, ge=1, le=ACTIVITY_MAX_PAGE_SIZE),
+                             cursor: Optional[str] = None,
+                             user_id: Optional[int] = None,
+                             action: Optional[str] = None,
+                             entity_type: Optional[str] = None,
+                             entity_id: Optional[int] = None,
+                             since: Optional[datetime] = None,
+                             until: Optional[datetime] = None):
+     '''
+     List activity logs in our database, latest first
+     Results are paginated, pass next_cursor from the response as cursor to fetch the next page
+     Can only be accessed by the superadmin OR users with "VIEW_ACTIVITY_LOGS permission"
+     '''
+     try:
+         return ORJSONResponse({"responseData": await fetch_activity_logs(
+              limit=limit, cursor=cursor, user_id=user_id, action=action,
+              entity_type=entity_type, entity_id=entity_id, since=since, until=until
+         )})
+     except Error as e:
+          # Pass through any custom raised errors as-is
+          raise
+     except Exception as e:
+          traceback.print_exc()
+          # Handle anything exceptional that we have not encountered anywhere
+          raise Error(status_code=500,details="Something went wrong!")
+
+@v1.get("/activity/export", tags=["Activity Logs"])
+async def export_activity(request: Request, auth_data: dict = Depends(LoginHandler.requires("VIEW_ACTIVITY_LOGS")),
+                          format: Literal["ndjson", "csv"] = "ndjson",
+                          gzip: bool = False,
+                          user_id: Optional[int] = None,
+                          action: Optional[str] = None,
+                          entity_type: Optional[str] = None,
+                          entity_id: Optional[int] = None,
+                          since: Optional[datetime] = None,
+                          until: Optional[datetime] = None):
+     '''
+     Stream activity logs as NDJSON or CSV, oldest first, optionally gzip compressed
+     Accepts the same filters as the activity listing
+     Can only be accessed by the superadmin OR users with "VIEW_ACTIVITY_LOGS permission"
      '''
-     List all activity logs in our database
+     try:
+         filename = f"audit_logs.{format}"
+         media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+         if gzip:
+              filename += ".gz"
+              media_type = "application/gzip"
+         return StreamingResponse(
+              export_activity_logs(
+                   export_format=format, compress=gzip, user_id=user_id, action=action,
+                   entity_type=entity_type, entity_id=entity_id, since=since, until=until
+              ),
+              media_type=media_type,
+              headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+         )
+     except Error as e:
+          # Pass through any custom raised errors as-is
+          raise
+     except Exception as e:
+          traceback.print_exc()
+          # Handle anything exceptional that we have not encountered anywhere
+          raise Error(status_code=500,details="Something went wrong!")
+
+@v1.get("/activity/archive", tags=["Activity Logs"])
+async def list_archived_activity(request: Request, auth_data: dict = Depends(LoginHandler.requires("VIEW_ACTIVITY_LOGS")),
+                                 since: Optional[datetime] = None,
+                                 until: Optional[datetime] = None,
+                                 user_id: Optional[int] = None,
+                                 action: Optional[str] = None,
+                                 entity_type: Optional[str] = None,
+                                 entity_id: Optional[int] = None):
+     '''
+     Stream archived activity logs as NDJSON, only the archives overlapping since/until are read
      Can only be accessed by the superadmin OR users with "VIEW_ACTIVITY_LOGS permission"
      '''
-     permission_required = "VIEW_ACTIVITY_LOGS"
      try:
-         require_permissions(list_activity_logs.auth_data, permission_required)
-         return {"responseData": fetch_activity_logs()}
+         rows = audit_retention.read_archived_logs(
+              since=since, until=until, user_id=user_id, action=action, entity_type=entity_type, entity_id=entity_id
+         )
+         # A sync generator is iterated in the threadpool so reading the archives does not block the loop
+         return StreamingResponse((json.dumps(row) + "\n" for row in rows), media_type="application/x-ndjson")
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -161,20 +248,58 @@ async def list_activity_logs(request: Request, token: str = Header(None)):
           # Handle anything exceptional that we have not encountered anywhere
           raise Error(status_code=500,details="Something went wrong!")
 
-@v1.get("/camera", tags=["Camera Management"])
-@LoginHandler.authenticate_user
-async def get_cameras(request: Request, response: Response, token: str = Header(None),):
+@v1.get("/camera", tags=["Camera Management"], response_class=ORJSONResponse,
+        responses={200: {"model": CameraListResponse}, 304: {"description": "Not modified, the ETag still matches"}})
+async def get_cameras(request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("VIEW_CAMERA")),
+                      limit: int = Query(CAMERA_PAGE_SIZE, ge=1, le=CAMERA_MAX_PAGE_SIZE),
+                      cursor: Optional[int] = None,
+                      location: Optional[str] = None,
+                      name_prefix: Optional[str] = None,
+                      ip: Optional[str] = None,
+                      fields: Optional[str] = Query(None, description="Comma separated list of camera fields to return")):
      '''
      Fetch all cameras assigned to the user
      If the user is a superadmin then fetch all cameras in the system
+     Results are paginated, pass next_cursor from the response as cursor to fetch the next page
+     Responses carry an ETag, send it back as If-None-Match to get a 304 while nothing changed
+     Can only be accessed by the superadmin OR users with "VIEW_CAMERA permission"
+     '''
+     try:
+         field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+         params = {"limit": limit, "cursor": cursor, "location": location, "name_prefix": name_prefix, "ip": ip, "fields": field_list}
+         scope = camera_scope(auth_data)
+         etag = await camera_list_cache.etag(scope, params)
+         headers = {"ETag": etag, "Cache-Control": "private, no-cache"} if etag else {}
+         if etag_matches(request.headers.get("if-none-match"), etag):
+              return Response(status_code=304, headers=headers)
+
+         body = await camera_list_cache.get(scope, etag) if etag else None
+         if body is None:
+              camera_management = CameraManagement()
+              page = await camera_management.list_all_cameras(auth_data, **params)
+              body = listing_body({"responseData": page})
+              if etag:
+                   await camera_list_cache.set(scope, etag, body)
+         # The body is cached already encoded
+         return Response(content=body, media_type="application/json", headers=headers)
+     except Error as e:
+          # Pass through any custom raised errors as-is
+          raise
+     except Exception as e:
+          traceback.print_exc()
+          # Handle anything exceptional that we have not encountered anywhere
+          raise Error(status_code=500,details="Something went wrong!")
+
+@v1.get("/camera/status/summary", tags=["Camera Management"], response_model=CameraStatusSummaryResponse)
+async def get_camera_status_summary(request: Request, auth_data: dict = Depends(LoginHandler.requires("VIEW_CAMERA"))):
+     '''
+     Count the online, offline and not yet probed cameras of the user
+     A superadmin gets the counts of every camera as of the last poller round
      Can only be accessed by the superadmin OR users with "VIEW_CAMERA permission"
      '''
-     permission_required = "VIEW_CAMERA"
      try:
-         auth_data = get_cameras.auth_data
-         require_permissions(auth_data, permission_required)
          camera_management = CameraManagement()
-         return {"responseData": camera_management.list_all_cameras(auth_data)}
+         return {"responseData": await camera_management.camera_status_summary(auth_data)}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -184,20 +309,62 @@ async def get_cameras(request: Request, response: Response, token: str = Header(
           raise Error(status_code=500,details="Something went wrong!")
 
 @v1.post("/camera", tags=["Camera Management"])
-@LoginHandler.authenticate_user
-async def create_camera(data: CreateCamera, request: Request, response: Response, token: str = Header(None),):
+async def create_camera(data: CreateCamera, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("CREATE_CAMERA"))):
      '''
      Create a camera in our database
      This will also assign the camera to the user who created it by default (Superadmin in our case)
      Can only be accessed by the superadmin OR users with "CREATE_CAMERA permission"
      '''
-     permission_required = "CREATE_CAMERA"
      try:
-         auth_data = create_camera.auth_data
-         require_permissions(auth_data, permission_required)
          camera_management = CameraManagement()
          response.status_code = 201
-         return {"responseData":{"message":"Camera created!", "data":camera_management.create_camera(data,auth_data)}}
+         return {"responseData":{"message":"Camera created!", "data":await camera_management.create_camera(data,auth_data)}}
+     except Error as e:
+          # Pass through any custom raised errors as-is
+          raise
+     except Exception as e:
+          traceback.print_exc()
+          # Handle anything exceptional that we have not encountered anywhere
+          raise Error(status_code=500,details="Something went wrong!")
+
+
+@v1.post("/camera/bulk", tags=["Camera Management"])
+async def import_cameras(data: BulkCreateCamera, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("CREATE_CAMERA"))):
+     '''
+     Create many cameras at once, each one is assigned to the user who imported it
+     mode "atomic" creates nothing if any row fails, "best_effort" creates the valid rows and reports the rest
+     Can only be accessed by the superadmin OR users with "CREATE_CAMERA permission"
+     '''
+     try:
+         camera_management = CameraManagement()
+         response.status_code = 201
+         cameras = list(enumerate(data.cameras, start=1))
+         return {"responseData":{"message":"Cameras imported!", "data":await camera_management.import_cameras(cameras,auth_data,mode=data.mode)}}
+     except Error as e:
+          # Pass through any custom raised errors as-is
+          raise
+     except Exception as e:
+          traceback.print_exc()
+          # Handle anything exceptional that we have not encountered anywhere
+          raise Error(status_code=500,details="Something went wrong!")
+
+
+@v1.post("/camera/bulk/csv", tags=["Camera Management"])
+async def import_cameras_csv(request: Request, response: Response, file: UploadFile = File(...),
+                             mode: Literal["atomic", "best_effort"] = "atomic", auth_data: dict = Depends(LoginHandler.requires("CREATE_CAMERA"))):
+     '''
+     Same as /camera/bulk with a CSV upload with the columns device_name, device_ip, device_location
+     Can only be accessed by the superadmin OR users with "CREATE_CAMERA permission"
+     '''
+     try:
+         try:
+              text = (await file.read()).decode("utf-8-sig")
+         except UnicodeDecodeError:
+              raise Error(status_code=400, details="CSV file must be UTF-8 encoded!")
+         cameras, errors = parse_camera_csv(text)
+         camera_management = CameraManagement()
+         response.status_code = 201
+         return {"responseData":{"message":"Cameras imported!", "data":await camera_management.import_cameras(cameras,auth_data,mode=mode,errors=errors)}}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -208,19 +375,15 @@ async def create_camera(data: CreateCamera, request: Request, response: Response
 
 
 @v1.post("/camera/assign", tags=["Camera Management"])
-@LoginHandler.authenticate_user
-async def assign_camera(data: AssignCamera, request: Request, response: Response, token: str = Header(None),):
+async def assign_camera(data: AssignCamera, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("ASSIGN_CAMERA"))):
      '''
      Assign a camera to a user
      Can only be accessed by users with "ASSIGN_CAMERA permission"
      '''
-     permission_required = "ASSIGN_CAMERA"
      try:
-         auth_data = assign_camera.auth_data
-         require_permissions(auth_data, permission_required)
          camera_management = CameraManagement()
          response.status_code = 201
-         return {"responseData":{"message":"Camera assigned!", "data":camera_management.assign_camera(data,auth_data)}}
+         return {"responseData":{"message":"Camera assigned!", "data":await camera_management.assign_camera(data,auth_data)}}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -229,21 +392,55 @@ async def assign_camera(data: AssignCamera, request: Request, response: Response
           # Handle anything exceptional that we have not encountered anywhere
           raise Error(status_code=500,details="Something went wrong!")
      
+@v1.post("/camera/assign/bulk", tags=["Camera Management"])
+async def bulk_assign_cameras(data: BulkCameraAssignment, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("ASSIGN_CAMERA"))):
+     '''
+     Assign every given camera to every given user, pairs that are already assigned are skipped
+     Can only be accessed by users with "ASSIGN_CAMERA permission"
+     '''
+     try:
+         camera_management = CameraManagement()
+         response.status_code = 201
+         return {"responseData":{"message":"Cameras assigned!", "data":await camera_management.bulk_assign_cameras(data,auth_data)}}
+     except Error as e:
+          # Pass through any custom raised errors as-is
+          raise
+     except Exception as e:
+          traceback.print_exc()
+          # Handle anything exceptional that we have not encountered anywhere
+          raise Error(status_code=500,details="Something went wrong!")
+
+
+@v1.post("/camera/deassign/bulk", tags=["Camera Management"])
+async def bulk_deassign_cameras(data: BulkCameraAssignment, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("ASSIGN_CAMERA"))):
+     '''
+     Remove the assignments of every given camera from every given user
+     Can only be accessed by users with "ASSIGN_CAMERA" permission"
+     '''
+     try:
+         camera_management = CameraManagement()
+         response.status_code = 200
+         return {"responseData":{"message":"Cameras deassigned!", "data":await camera_management.bulk_deassign_cameras(data,auth_data)}}
+     except Error as e:
+          # Pass through any custom raised errors as-is
+          raise
+     except Exception as e:
+          traceback.print_exc()
+          # Handle anything exceptional that we have not encountered anywhere
+          raise Error(status_code=500,details="Something went wrong!")
+
+
 # delete camera
 @v1.delete("/camera", tags=["Camera Management"])
-@LoginHandler.authenticate_user
-async def delete_camera(data: DeleteCamera, request: Request, response: Response, token: str = Header(None),):
+async def delete_camera(data: DeleteCamera, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("DELETE_CAMERA"))):
      '''
      Delete a camera in our database
      Can only be accessed by the superadmin OR users with "DELETE_CAMERA permission"
      '''
-     permission_required = "DELETE_CAMERA"
      try:
-         auth_data = delete_camera.auth_data
-         require_permissions(auth_data, permission_required)
          camera_management = CameraManagement()
          response.status_code = 200
-         return {"responseData":{"message":"Camera deleted!", "data":camera_management.delete_camera(data,auth_data)}}
+         return {"responseData":{"message":"Camera deleted!", "data":await camera_management.delete_camera(data,auth_data)}}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -255,19 +452,15 @@ async def delete_camera(data: DeleteCamera, request: Request, response: Response
 
 # Edit camera
 @v1.patch("/camera", tags=["Camera Management"])
-@LoginHandler.authenticate_user
-async def edit_camera(data: ModifyCamera, request: Request, response: Response, token: str = Header(None),):
+async def edit_camera(data: ModifyCamera, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("EDIT_CAMERA"))):
      '''
      Edit a camera in our database
      Can only be accessed by users with "EDIT_CAMERA permission"
      '''
-     permission_required = "EDIT_CAMERA"
      try:
-         auth_data = edit_camera.auth_data
-         require_permissions(auth_data, permission_required)
          camera_management = CameraManagement()
          response.status_code = 200
-         return {"responseData":{"message":"Camera modified!", "data":camera_management.modify_camera(data,auth_data)}}
+         return {"responseData":{"message":"Camera modified!", "data":await camera_management.modify_camera(data,auth_data)}}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
@@ -278,19 +471,15 @@ async def edit_camera(data: ModifyCamera, request: Request, response: Response,
 
 # Deassign user from camera
 @v1.post("/camera/deassign", tags=["Camera Management"])
-@LoginHandler.authenticate_user
-async def deassign_camera(data: DeassignCamera, request: Request, response: Response, token: str = Header(None),):
+async def deassign_camera(data: DeassignCamera, request: Request, response: Response, auth_data: dict = Depends(LoginHandler.requires("ASSIGN_CAMERA"))):
      '''
      Deassign a camera from a user
      Can only be accessed by users with "ASSIGN_CAMERA" permission"
      '''
-     permission_required = "ASSIGN_CAMERA"
      try:
-         auth_data = deassign_camera.auth_data
-         require_permissions(auth_data, permission_required)
          camera_management = CameraManagement()
          response.status_code = 200
-         return {"responseData":{"message":"Camera deassigned!", "data":camera_management.deassign_camera(data,auth_data)}}
+         return {"responseData":{"message":"Camera deassigned!", "data":await camera_management.deassign_camera(data,auth_data)}}
      except Error as e:
           # Pass through any custom raised errors as-is
           raise
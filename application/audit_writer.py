@@ -0,0 +1,263 @@
+'''
+Buffered, batched writer for audit logs
+'''
+import utils.database as database
+from datetime import datetime
+import asyncio
+import glob
+import json
+import os
+import time
+from logger import logger
+from utils.metrics import metrics_sampler, AUDIT_QUEUE_DEPTH, AUDIT_FLUSH_LATENCY, AUDIT_BATCH_SIZE
+
+db = database.get_database()
+
+
+class AuditWriter():
+    '''
+    Audit rows are queued in process and written by a background task with multi-row inserts,
+    whenever batch_size rows are pending or flush_interval seconds have passed
+
+    With spill_dir set, batches which can not be written are appended to a local file
+    and replayed once the database is reachable again. A batch which can not be spilled either is dropped
+    and counted, the writer task keeps running. File access runs in a thread to keep the event loop free
+    '''
+    def __init__(self, config):
+        self.enabled = bool(config.get("enabled", False))
+        self.batch_size = int(config.get("batch_size", 500))
+        self.flush_interval = float(config.get("flush_interval", 1.0))
+        self.max_queue = int(config.get("max_queue", 10000))
+        self.spill_dir = config.get("spill_dir")
+        self._queue = None
+        self._task = None
+
+        self.flushed = 0
+        self.batches = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        '''
+        Flush everything still queued and stop the background task
+        '''
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, rows):
+        '''
+        Queue audit rows, waits for room when the queue is full
+        '''
+        for row in rows:
+            await self._queue.put(row)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is None:
+                break
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+
+        # Drain whatever is left on shutdown
+        batch = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not None:
+                batch.append(row)
+        if batch:
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        # Imported here since service imports this module
+        from .service import write_audit_rows
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            async with db.async_session() as conn:
+                await write_audit_rows(conn, batch)
+                await conn.commit()
+            self.flushed += len(batch)
+            self.batches += 1
+            outcome = "ok"
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} audit rows: {e}")
+            await self._spill(batch)
+            return
+        finally:
+            duration = time.perf_counter() - start
+            self.last_flush_seconds = duration
+            self.max_flush_seconds = max(self.max_flush_seconds, duration)
+            AUDIT_FLUSH_LATENCY.labels(outcome).observe(duration)
+            AUDIT_BATCH_SIZE.observe(len(batch))
+
+        if self.spill_dir:
+            try:
+                await self._replay_spilled()
+            except Exception:
+                # A failed replay must never end the writer task, the spill files stay for the next flush
+                logger.exception("Failed to replay spilled audit rows")
+
+    def _spill_path(self, pid=None):
+        return os.path.join(self.spill_dir, f"audit-spill-{pid or os.getpid()}.ndjson")
+
+    def _quarantine(self, lines, source):
+        '''
+        Keep spilled lines which can not be parsed aside instead of replaying them again and again
+        '''
+        with open(os.path.join(self.spill_dir, f"audit-quarantine-{os.getpid()}.ndjson"), "a") as quarantine_file:
+            quarantine_file.writelines(line if line.endswith("\n") else line + "\n" for line in lines)
+        logger.error(f"Quarantined {len(lines)} unreadable spilled audit rows of {source}")
+
+    async def _spill(self, batch):
+        '''
+        Append the batch to this worker's spill file, it is dropped when there is none or it can not be written
+        '''
+        if not self.spill_dir:
+            self.dropped += len(batch)
+            return
+        try:
+            await asyncio.to_thread(self._write_spill, batch)
+        except Exception as e:
+            # e.g. a full disk or a read-only volume
+            logger.error(f"Failed to spill {len(batch)} audit rows, they are dropped: {e}")
+            self.dropped += len(batch)
+            return
+        self.spilled += len(batch)
+
+    def _write_spill(self, batch):
+        with open(self._spill_path(), "a") as spill_file:
+            for row in batch:
+                spill_file.write(json.dumps({**row, "timestamp": row["timestamp"].isoformat()}) + "\n")
+            spill_file.flush()
+            os.fsync(spill_file.fileno())
+
+    def _claimable(self):
+        '''
+        Spill files this worker may replay: its own, and those of workers which are gone
+        Files of live workers are left alone since they may still be appending to them
+        '''
+        own_pid = os.getpid()
+        paths = []
+        for path in glob.glob(os.path.join(self.spill_dir, "audit-spill-*.ndjson*")):
+            # audit-spill-<pid>.ndjson, or audit-spill-<pid>.ndjson.<claiming pid>.replay left by a crash
+            parts = os.path.basename(path)[len("audit-spill-"):].split(".")
+            try:
+                owner = int(parts[-2]) if path.endswith(".replay") else int(parts[0])
+            except ValueError:
+                continue
+            if owner == own_pid or not process_alive(owner):
+                paths.append(path)
+        return paths
+
+    async def _replay_spilled(self):
+        '''
+        Write back rows spilled by this worker or by workers which are gone
+        A spill file is claimed with an atomic rename so only one worker replays it
+        '''
+        from .service import write_audit_rows
+
+        for path in await asyncio.to_thread(self._claimable):
+            claimed = f"{path.split('.ndjson')[0]}.ndjson.{os.getpid()}.replay"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            rows = await asyncio.to_thread(self._read_claimed, claimed)
+            if not rows:
+                os.remove(claimed)
+                continue
+            try:
+                async with db.async_session() as conn:
+                    await write_audit_rows(conn, rows)
+                    await conn.commit()
+            except Exception as e:
+                # Hand the rows back to this worker's own spill file, the claimed file stays if that fails too
+                logger.error(f"Failed to replay spilled audit rows from {claimed}: {e}")
+                try:
+                    await asyncio.to_thread(self._write_spill, rows)
+                except Exception as spill_error:
+                    logger.error(f"Spilled audit rows stay in {claimed}: {spill_error}")
+                    return
+                os.remove(claimed)
+                return
+            os.remove(claimed)
+            self.flushed += len(rows)
+            logger.info(f"Replayed {len(rows)} spilled audit rows")
+
+    def _read_claimed(self, claimed):
+        '''
+        Rows of a claimed spill file, unreadable lines are quarantined
+        '''
+        rows = []
+        bad_lines = []
+        with open(claimed) as spill_file:
+            for line in spill_file:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                    rows.append(row)
+                except (ValueError, KeyError, TypeError):
+                    # e.g. a partial last line of a worker which died while spilling
+                    bad_lines.append(line)
+        if bad_lines:
+            self._quarantine(bad_lines, claimed)
+        return rows
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+audit_writer = AuditWriter(json.loads(os.getenv('AUDIT_WRITER', '{}')))
+metrics_sampler.register(lambda: AUDIT_QUEUE_DEPTH.set(audit_writer.stats()["queue_depth"]))
@@ -1,110 +1,126 @@
-from passlib.context import CryptContext
 import jwt
 import utils.database as database
+from sqlalchemy import select
 from utils.exceptions import *
 from datetime import datetime,timedelta
-import redis
 import json
-from functools import wraps
 import os
 from logger import logger
+from utils.cache import get_redis
+from utils.hashing import hashing_pool
+from utils.metrics import REDIS_LATENCY, AUTH_LATENCY
+from .service import permission_cache, require_permissions
+from fastapi import Request, Header, Depends
+import time
+import uuid
+from utils.cache import subscriber
+from .service import token_revocations, ACCESS_TOKEN_EXPIRE_MINUTES
 
-config = json.loads(os.getenv('DB_CONNECTION_STRING', {}))
-
-db = database.DatabaseResource(config)
+db = database.get_database()
 
 
 SECRET_KEY = os.getenv('SECRET_KEY','')
 ALGORITHIM =  os.getenv('ALGORITHIM','HS256')
+# "session" looks every access token up in redis, "stateless" trusts the signed claims and
+# only checks the in memory revocation set (falls back to the lookup while pub/sub is down)
+AUTH_MODE = os.getenv('AUTH_MODE','session')
+STATELESS_EXCLUDED_CLAIMS = ("exp", "iat", "jti")
 
 class LoginHandler():
     def __init__(self):
         
         self.SECRET_KEY = SECRET_KEY
         self.ALGORITHM = ALGORITHIM
-        self.ACCESS_TOKEN_EXPIRE_MINUTES = 10
+        self.ACCESS_TOKEN_EXPIRE_MINUTES = ACCESS_TOKEN_EXPIRE_MINUTES
         self.REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 1 # 1 day
-        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto")
         self.conn = None
         self.redis_client = None
 
     def create_redis_client(self):
-        redis_client = redis.Redis(host='redis', port=6379,decode_responses=True)
+        # Shared pooled client, configured once from REDIS_CONNECTION_STRING
+        redis_client = get_redis()
         self.redis_client = redis_client
         return redis_client
 
     def create_access_token(self, data: dict):
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(minutes=self.ACCESS_TOKEN_EXPIRE_MINUTES)
-        to_encode.update({"exp": expire})
+        # jti identifies the token for revocation, iat (sub second) is compared to the user's not before time
+        to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex, "token_type": "access"})
         return jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
 
     def create_refresh_token(self, data: dict):
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(minutes=self.REFRESH_TOKEN_EXPIRE_MINUTES)
-        to_encode.update({"exp": expire})
+        to_encode.update({"exp": expire, "token_type": "refresh"})
         return jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
     
-    def hash_password(self,plain_password):
-        return self.context.hash(plain_password)
+    async def hash_password(self,plain_password):
+        # bcrypt runs in the hashing process pool so the event loop stays free
+        return await hashing_pool.hash(plain_password)
 
-    def verify_password(self,password_hashed: str, plain_password: str):
-        return self.context.verify(plain_password,password_hashed)
+    async def verify_password(self,password_hashed: str, plain_password: str):
+        return await hashing_pool.verify(password_hashed, plain_password)
     
     
-    def login_user(self, email, plain_password,refresh_token):
+    async def login_user(self, email, plain_password,refresh_token):
         # Initialize a DB session if one is not created
         if self.conn is None:
-            with db.session() as conn:
-                
-                existing_user = conn.query(database.User).filter(database.User.email == email).first()
-                if existing_user is None:
-                    logger.info(f"User with email {email} does not exist!")
-                    raise Error(status_code=400,details="User does not exist!")
-                
-                self.create_redis_client()
-                rc = self.redis_client
-                # If refresh token is provided. it will be used to validate the user
-
-                data = {"user_id": existing_user.id,"user_name": existing_user.name, "user_email": existing_user.email, "user_role": existing_user.roles[0].name, "user_rank": existing_user.roles[0].rank}
-                refresh_token_key = f"refresh_token:{existing_user.email}"
-                access_token_key = f"user_token:{existing_user.email}"
-                if refresh_token:
-                    try:
-                        payload = jwt.decode(refresh_token,SECRET_KEY,ALGORITHIM)
-                        if payload["user_email"] != email:
-                            raise Error(status_code=400,details="Invalid token/user")
-                        refresh_token_data = rc.get(f"refresh_token:{email}")
-                        if refresh_token_data is None:
-                            raise Error(status_code=401,details="Invalid refresh token!")
-                    except jwt.ExpiredSignatureError:
-                        logger.info(f"Refresh token for user {email} has expired!")
-                        raise Error(status_code=401, details="Token expired") 
-                    except Exception as e:
+            async with db.async_session() as conn:
+                existing_user = await database.user_with_role(conn, email=email)
+            # The connection is released before the (slow) password check
+            if existing_user is None:
+                logger.info(f"User with email {email} does not exist!")
+                raise Error(status_code=400,details="User does not exist!")
+            
+            self.create_redis_client()
+            rc = self.redis_client
+            # If refresh token is provided. it will be used to validate the user
+
+            data = {"user_id": existing_user.id,"user_name": existing_user.name, "user_email": existing_user.email, "user_role": existing_user.roles[0].name, "user_rank": existing_user.roles[0].rank}
+            # Effective permissions are carried in the session so authorization needs no DB lookup
+            data["user_permissions"] = sorted(await permission_cache.permissions_for_role(existing_user.roles[0].id))
+            refresh_token_key = f"refresh_token:{existing_user.email}"
+            access_token_key = f"user_token:{existing_user.email}"
+            if refresh_token:
+                try:
+                    payload = jwt.decode(refresh_token,SECRET_KEY,ALGORITHIM)
+                    # Access tokens are short lived, they must not be traded for new ones
+                    if payload.get("token_type") != "refresh":
                         raise Error(status_code=401,details="Invalid token!")
-                else:
-                    # Validate if the password matches the hash using passlib verify
-                    valid_password = self.verify_password(existing_user.hashed_password, plain_password)
-                    if not valid_password:
-                        raise Error(status_code=400,details="Incorrect password!")
-                    refresh_token = self.create_refresh_token(data)
-                    data["token_type"] = "refresh"
-                    data["token"] = refresh_token
-                    rc.setex(refresh_token_key,self.REFRESH_TOKEN_EXPIRE_MINUTES * 60, json.dumps(data))
+                    if payload["user_email"] != email:
+                        raise Error(status_code=400,details="Invalid token/user")
+                    refresh_token_data = await rc.get(f"refresh_token:{email}")
+                    if refresh_token_data is None:
+                        raise Error(status_code=401,details="Invalid refresh token!")
+                except jwt.ExpiredSignatureError:
+                    logger.info(f"Refresh token for user {email} has expired!")
+                    raise Error(status_code=401, details="Token expired") 
+                except Exception as e:
+                    raise Error(status_code=401,details="Invalid token!")
+            else:
+                # Validate if the password matches the hash using passlib verify
+                valid_password = await self.verify_password(existing_user.hashed_password, plain_password)
+                if not valid_password:
+                    raise Error(status_code=400,details="Incorrect password!")
+                refresh_token = self.create_refresh_token(data)
+                data["token_type"] = "refresh"
+                data["token"] = refresh_token
+                await rc.setex(refresh_token_key,self.REFRESH_TOKEN_EXPIRE_MINUTES * 60, json.dumps(data))
 
-                
-                data.pop("token", None)
-                user_token = self.create_access_token(data)
-                data["token_type"] = "access"
-                rc.setex(access_token_key,self.ACCESS_TOKEN_EXPIRE_MINUTES * 60,json.dumps(data))
-                
-                # remove token and token_type from data
-                data.pop("token", None)
-                data.pop("token_type", None)
-                
-                
-                
-                return {"message": "Login sucessful", "access_token": user_token,"refresh_token": refresh_token, "data": data}
+            
+            data.pop("token", None)
+            user_token = self.create_access_token(data)
+            data["token_type"] = "access"
+            await rc.setex(access_token_key,self.ACCESS_TOKEN_EXPIRE_MINUTES * 60,json.dumps(data))
+            
+            # remove token and token_type from data
+            data.pop("token", None)
+            data.pop("token_type", None)
+            
+            
+            
+            return {"message": "Login sucessful", "access_token": user_token,"refresh_token": refresh_token, "data": data}
 
 
 
@@ -113,17 +129,29 @@ class LoginHandler():
         pass
 
 
-    @classmethod
-    def authenticate_user(cls,func):
+    async def logout_user(self, auth_data, claims):
+        '''
+        Remove the user's sessions and revoke the access token used for the request
         '''
-        Decorator classmethod for authenticating all requests
+        rc = self.create_redis_client()
+        await rc.delete(f"user_token:{auth_data['user_email']}", f"refresh_token:{auth_data['user_email']}")
+        if claims.get("jti"):
+            await token_revocations.revoke_token(claims["jti"], claims["exp"])
+        logger.info(f"User {auth_data['user_email']} logged out")
+        return {"message": "Logout successful"}
+
+
+    @staticmethod
+    async def authenticate(request: Request, token: str = Header(None)):
         '''
-        @wraps(func)
-        async def wrapper(*args,**kwargs):
-            if 'request' not in kwargs:
-                raise Error(status_code=500,details="No request details found!")
-            request = kwargs["request"]
-            token = request.headers.get("token")
+        Dependency which resolves the session of the request token
+        The session is kept on request.state so every request carries its own identity,
+        FastAPI runs the dependency once per request however many dependencies use it
+        With AUTH_MODE stateless access tokens are validated without a redis round trip
+        '''
+        start = time.perf_counter()
+        outcome = "rejected"
+        try:
             if not token:
                 raise Error(status_code=401, details="Token not found!")
             
@@ -133,18 +161,29 @@ class LoginHandler():
                 raise Error(status_code=401, details="Token expired") 
             except Exception as e:
                 raise Error(status_code=401,details="Invalid token!")
-            
-            key = f"user_token:{payload['user_email']}"
+            # Refresh tokens live for a day, they are only accepted by the login refresh path
+            if payload.get("token_type") != "access":
+                raise Error(status_code=401,details="Invalid token!")
+            # A logged out token stays revoked even once the user logged in again and has a new session
+            if token_revocations.is_token_revoked(payload):
+                raise Error(status_code=401,details="Token revoked!")
+            request.state.token_claims = payload
+
+            # Revocations only reach this worker while it is subscribed, otherwise the session decides
+            if AUTH_MODE == "stateless" and subscriber.connected and payload.get("jti"):
+                if token_revocations.is_revoked(payload):
+                    raise Error(status_code=401,details="Token revoked!")
+                auth_data = {claim: value for claim, value in payload.items() if claim not in STATELESS_EXCLUDED_CLAIMS}
+                request.state.auth_data = auth_data
+                outcome = "ok"
+                logger.info(f"User {auth_data['user_email']} authenticated successfully!", extra={"sample": "auth_success"})
+                return auth_data
 
-            redis_connection_string = os.getenv('REDIS_CONNECTION_STRING', None)
-            if not redis_connection_string:
-                raise Error(status_code=500, details="Redis connection string not found in environment variables!")
-            
-            redis_connection_string = json.loads(redis_connection_string)
+            key = f"user_token:{payload['user_email']}"
 
-            rc = redis.Redis(host=redis_connection_string["host"], port=redis_connection_string["port"],decode_responses=True)
-            
-            cache_data = rc.get(key)
+            rc = get_redis()
+            with REDIS_LATENCY.labels("session_lookup").time():
+                cache_data = await rc.get(key)
             
             if cache_data is None:
                 raise Error(status_code=401,details="Invalid token!")
@@ -153,9 +192,28 @@ class LoginHandler():
                 if payload["user_email"] != cache_data["user_email"]:
                     raise Error(status_code=400,details="Invalid token/user")
             
-            wrapper.auth_data = cache_data
-            retval = await func(*args, **kwargs)
-            logger.info(f"User {cache_data['user_email']} authenticated successfully!")
-            return retval
-        return wrapper
+            request.state.auth_data = cache_data
+            outcome = "ok"
+            logger.info(f"User {cache_data['user_email']} authenticated successfully!", extra={"sample": "auth_success"})
+            return cache_data
+        finally:
+            AUTH_LATENCY.labels("authenticate", outcome).observe(time.perf_counter() - start)
+
+    @staticmethod
+    def requires(permission_required):
+        '''
+        Dependency factory for routes which need a permission, returns the caller's session
+        e.g. auth_data: dict = Depends(LoginHandler.requires("VIEW_CAMERA"))
+        '''
+        async def check_permission(auth_data: dict = Depends(LoginHandler.authenticate)):
+            start = time.perf_counter()
+            outcome = "denied"
+            try:
+                await require_permissions(auth_data, permission_required)
+                outcome = "ok"
+            finally:
+                AUTH_LATENCY.labels("authorize", outcome).observe(time.perf_counter() - start)
+            return auth_data
+        check_permission.permission_required = permission_required
+        return check_permission
     
\ No newline at end of file
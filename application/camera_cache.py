@@ -0,0 +1,99 @@
+'''
+Redis backed cache of camera listing responses
+
+Responses are cached per scope, "all" for superadmins who see every camera and "user:<id>" for everyone else.
+Every scope has a random version stamp which is replaced whenever a change affects the scope, the ETag of a
+response is derived from the version, the camera status generation (see camera_status) and the query parameters
+so conditional requests need one redis read.
+'''
+from utils.cache import get_redis
+from logger import logger
+from .camera_status import GENERATION_KEY
+import hashlib
+import json
+import os
+import uuid
+
+CAMERA_CACHE_TTL = int(os.getenv('CAMERA_CACHE_TTL', 300))
+SUPERADMIN_RANK = int(os.getenv('SUPERADMIN_RANK', 1))
+SCOPE_ALL = "all"
+
+
+def camera_scope(auth_data):
+    return SCOPE_ALL if auth_data['user_rank'] == SUPERADMIN_RANK else f"user:{auth_data['user_id']}"
+
+
+def user_scopes(user_ids):
+    return [f"user:{user_id}" for user_id in set(user_ids)]
+
+
+def etag_matches(if_none_match, etag):
+    '''
+    Check an If-None-Match header against an ETag, the header may list several tags
+    '''
+    if not if_none_match or etag is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class CameraListCache():
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def _version_key(self, scope):
+        return f"camera_list:version:{scope}"
+
+    def _body_key(self, scope, etag):
+        return f"camera_list:body:{scope}:{etag.strip(chr(34))}"
+
+    async def etag(self, scope, params):
+        '''
+        Strong ETag of the response for the scope and query parameters, None when redis is unavailable
+        '''
+        try:
+            rc = get_redis()
+            key = self._version_key(scope)
+            version, generation = await rc.mget(key, GENERATION_KEY)
+            if version is None:
+                # Version keys expire too, so changes made outside of the API show up after the TTL
+                version = uuid.uuid4().hex
+                if not await rc.set(key, version, nx=True, ex=self.ttl):
+                    version = await rc.get(key) or version
+        except Exception as e:
+            logger.warning(f"Camera list cache unavailable: {e}")
+            return None
+        digest = hashlib.sha1(f"{version}|{generation}|{json.dumps(params, sort_keys=True)}".encode()).hexdigest()
+        return f'"{digest}"'
+
+    async def get(self, scope, etag):
+        try:
+            return await get_redis().get(self._body_key(scope, etag))
+        except Exception as e:
+            logger.warning(f"Camera list cache unavailable: {e}")
+            return None
+
+    async def set(self, scope, etag, body):
+        try:
+            await get_redis().set(self._body_key(scope, etag), body, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Camera list cache unavailable: {e}")
+
+    async def invalidate(self, scopes):
+        '''
+        Give the scopes a new version, cached bodies of the old version are never read again and expire
+        Called after the change is committed so no response of the old data is cached under the new version
+        '''
+        if not scopes:
+            return
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for scope in set(scopes):
+                    pipe.set(self._version_key(scope), uuid.uuid4().hex, ex=self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            # The old version expires after the TTL at the latest
+            logger.error(f"Failed to invalidate camera list cache for {scopes}: {e}")
+
+
+camera_list_cache = CameraListCache(CAMERA_CACHE_TTL)
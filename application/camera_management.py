@@ -1,20 +1,89 @@
 from passlib.context import CryptContext
 import utils.database as database
+from sqlalchemy import select, insert, delete
 from utils.exceptions import *
 import json
 from functools import wraps
 from datetime import datetime
 from .authentication import LoginHandler
-from .service import audit_log
+from .service import audit_log, audit_row, commit_with_audit, chunked
 import os
+import csv
+import io
+from pydantic import ValidationError
 from logger import logger
+from .schema import CreateCamera
+from .camera_cache import camera_list_cache, user_scopes, SCOPE_ALL
+from .camera_status import camera_statuses, status_summary
 
-config = json.loads(os.getenv('DB_CONNECTION_STRING', {}))
-db = database.DatabaseResource(config)
+db = database.get_database()
 
 
 SUPERADMIN_RANK = int(os.getenv('SUPERADMIN_RANK', 1))
 
+BULK_IMPORT_MAX_ROWS = 5000
+# Request body cap of the bulk imports, checked before the body is parsed (see middleware.BodyLimit)
+BULK_IMPORT_MAX_BYTES = int(os.getenv('BULK_IMPORT_MAX_BYTES', BULK_IMPORT_MAX_ROWS * 1024))
+BULK_ASSIGNMENT_MAX_PAIRS = 100000
+
+CAMERA_PAGE_SIZE = 100
+CAMERA_MAX_PAGE_SIZE = 1000
+CAMERA_FIELDS = ["id", "device_name", "device_ip", "device_location", "created_by", "created_on", "updated_by", "updated_on", "probe_port", "probe_path"]
+# online, last_seen and latency_ms come from the status cache, not from a column
+STATUS_FIELD = "status"
+
+
+def camera_columns(fields=None):
+    '''
+    Resolve the requested fields into Camera columns, id is always included since it is the page cursor
+    '''
+    if not fields:
+        return [getattr(database.Camera, field) for field in CAMERA_FIELDS]
+    unknown = [field for field in fields if field not in CAMERA_FIELDS and field != STATUS_FIELD]
+    if unknown:
+        raise Error(status_code=400, details=f"Unknown camera fields: {', '.join(unknown)}")
+    return [database.Camera.id] + [getattr(database.Camera, field) for field in CAMERA_FIELDS if field in fields and field != "id"]
+
+
+def parse_camera_csv(text):
+    '''
+    Parse an uploaded CSV with the columns device_name, device_ip, device_location and optionally probe_port, probe_path
+    Returns the valid (row number, camera) pairs and the errors of the invalid rows
+    Stops at the first row over BULK_IMPORT_MAX_ROWS instead of validating the rest of the upload
+    '''
+    cameras = []
+    errors = []
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {"device_name", "device_ip", "device_location"} - set(reader.fieldnames or [])
+    if missing:
+        raise Error(status_code=400, details=f"Missing CSV columns: {', '.join(sorted(missing))}")
+    for row_number, row in enumerate(reader, start=1):
+        if row_number > BULK_IMPORT_MAX_ROWS:
+            raise Error(status_code=400, details=f"At most {BULK_IMPORT_MAX_ROWS} cameras can be imported at once!")
+        try:
+            cameras.append((row_number, CreateCamera(
+                device_name=(row["device_name"] or "").strip(),
+                device_ip=(row["device_ip"] or "").strip(),
+                device_location=(row["device_location"] or "").strip(),
+                probe_port=(row.get("probe_port") or "").strip() or None,
+                probe_path=(row.get("probe_path") or "").strip() or None
+            )))
+        except ValidationError as e:
+            errors.append({"row": row_number, "device_name": row.get("device_name"), "error": e.errors()[0]["msg"]})
+    return cameras, errors
+
+
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def outranked(assigner_rank, user_rank):
+    '''
+    Whether an assignment made by a user of assigner_rank is protected from a user of user_rank
+    Assignments made by a user without a role (assigner_rank None) are not protected
+    '''
+    return assigner_rank is not None and assigner_rank < user_rank
+
 class CameraManagement():
 
     def __init__(self):
@@ -23,41 +92,68 @@ class CameraManagement():
         '''
         pass
 
-    def list_all_cameras(self,auth_data):
+    async def list_all_cameras(self,auth_data,limit=CAMERA_PAGE_SIZE,cursor=None,location=None,name_prefix=None,ip=None,fields=None):
         '''
         List all cameras asssigned to the user
         If the user is a superadmin then list all cameras in the system
+        Results are keyset paginated on the camera id, pass back next_cursor to get the following page
         '''
-        with db.session() as conn:
-            user_data = conn.query(database.User).filter(database.User.id == auth_data['user_id']).first()
+        limit = min(limit, CAMERA_MAX_PAGE_SIZE)
+        query = select(*camera_columns(fields))
+        if location is not None:
+            query = query.filter(database.Camera.device_location == location)
+        if name_prefix is not None:
+            query = query.filter(database.Camera.device_name.like(escape_like(name_prefix) + "%", escape="\\"))
+        if ip is not None:
+            query = query.filter(database.Camera.device_ip == ip)
+        if cursor is not None:
+            query = query.filter(database.Camera.id > cursor)
+
+        async with db.async_session() as conn:
+            user_data = await database.user_with_role(conn, user_id=auth_data['user_id'])
             if not user_data:
                 raise Error(status_code=404, details="User not found!")
 
-            if user_data.roles[0].rank == SUPERADMIN_RANK:
-                # If the user is a superadmin, return all cameras
-                cameras = conn.query(database.Camera).all()
-                return cameras
-            else:
+            if user_data.roles[0].rank != SUPERADMIN_RANK:
                 # If the user is not a superadmin, return only cameras assigned to the user
                 # Fetch result in a joined query
-                cameras = conn.query(database.Camera).join(
+                query = query.join(
                     database.CameraAssignmentMap,
                     database.Camera.id == database.CameraAssignmentMap.camera_id
                 ).filter(
                     database.CameraAssignmentMap.user_id == user_data.id
-                ).all()
+                )
+
+            result = await conn.execute(query.order_by(database.Camera.id).limit(limit + 1))
+            rows = result.all()
 
-                return cameras
+        # One extra row is fetched to know if there is a next page
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        rows = rows[:limit]
+        statuses = await camera_statuses([row.id for row in rows]) if not fields or STATUS_FIELD in fields else {}
+        cameras = [{**row._mapping, **statuses.get(row.id, {})} for row in rows]
+        return {"items": cameras, "next_cursor": next_cursor}
+
+    async def camera_status_summary(self, auth_data):
+        '''
+        Reachability counts of the cameras the user can see, of every camera for superadmins
+        '''
+        if auth_data['user_rank'] == SUPERADMIN_RANK:
+            return await status_summary()
+        async with db.async_session() as conn:
+            result = await conn.execute(select(database.CameraAssignmentMap.camera_id).filter(database.CameraAssignmentMap.user_id == auth_data['user_id']))
+            camera_ids = result.scalars().all()
+        return await status_summary(camera_ids)
         
 
-    def create_camera(self, camera_data, auth_data):
+    async def create_camera(self, camera_data, auth_data):
         '''
         Create a new camera in the system
         This will also assign the camera to the user who created it by default (Superadmin in our case)
         '''
-        with db.session() as conn:
+        async with db.async_session() as conn:
             # Create a new camera object
-            existing_camera = conn.query(database.Camera).filter(database.Camera.device_name == camera_data.device_name).first()
+            existing_camera = await conn.scalar(select(database.Camera).filter(database.Camera.device_name == camera_data.device_name))
             if existing_camera:
                 logger.info(f"Camera with name {camera_data.device_name} already exists!")
                 raise Error(status_code=400, details="Camera with this name already exists!")
@@ -66,13 +162,15 @@ class CameraManagement():
                 device_name=camera_data.device_name,
                 device_ip=camera_data.device_ip,
                 device_location=camera_data.device_location,
+                probe_port=camera_data.probe_port,
+                probe_path=camera_data.probe_path,
                 created_by=auth_data['user_email'],
                 created_on=datetime.utcnow(),
                 updated_by=auth_data['user_email'],
                 updated_on=datetime.utcnow()
             )
             conn.add(new_camera)
-            conn.flush()
+            await conn.flush()
 
             # After creating a camera we assign the camera to the user who created it by default
             camera_assignment = database.CameraAssignmentMap(
@@ -86,7 +184,7 @@ class CameraManagement():
             )
             
             conn.add(camera_assignment)
-            conn.flush()
+            await conn.flush()
 
             # Create an audit log entry
             create_audit_entry = audit_log(
@@ -108,33 +206,141 @@ class CameraManagement():
                 conn=conn
             )
 
-            conn.add(create_audit_entry)
-            conn.add(assign_audit_entry)
-            conn.commit()
+            await commit_with_audit(conn, [create_audit_entry, assign_audit_entry])
+            await camera_list_cache.invalidate([SCOPE_ALL] + user_scopes([auth_data['user_id']]))
             
             return {"message": "Camera created successfully", "camera_id": new_camera.id, "camera_name": new_camera.device_name}
+
+    async def import_cameras(self, cameras, auth_data, mode="atomic", errors=None):
+        '''
+        Create many cameras at once, each one assigned to the importing user like create_camera
+        Name conflicts are checked with one set based query and rows are written with multi-row inserts
+        In atomic mode any row error aborts the import, in best_effort mode only the valid rows are created
+        errors can carry row errors found while parsing the input
+        '''
+        errors = list(errors or [])
+        if len(cameras) + len(errors) > BULK_IMPORT_MAX_ROWS:
+            raise Error(status_code=400, details=f"At most {BULK_IMPORT_MAX_ROWS} cameras can be imported at once!")
+
+        # Rows are (row number, camera), duplicates inside the upload are errors too
+        rows = []
+        seen = set()
+        for row_number, camera in cameras:
+            if camera.device_name in seen:
+                errors.append({"row": row_number, "device_name": camera.device_name, "error": "Duplicate camera name in upload"})
+                continue
+            seen.add(camera.device_name)
+            rows.append((row_number, camera))
+
+        async with db.async_session() as conn:
+            existing_names = set()
+            for names in chunked([camera.device_name for _, camera in rows]):
+                result = await conn.execute(select(database.Camera.device_name).filter(database.Camera.device_name.in_(names)))
+                existing_names.update(result.scalars().all())
+
+            valid_rows = []
+            for row_number, camera in rows:
+                if camera.device_name in existing_names:
+                    errors.append({"row": row_number, "device_name": camera.device_name, "error": "Camera with this name already exists"})
+                else:
+                    valid_rows.append(camera)
+            errors.sort(key=lambda error: error["row"])
+
+            if errors and mode == "atomic":
+                raise Error(status_code=400, details={"message": "Import aborted, no cameras were created", "errors": errors})
+            if not valid_rows:
+                return {"created": 0, "failed": len(errors), "errors": errors, "cameras": []}
+
+            now = datetime.utcnow()
+            camera_rows = [{
+                "device_name": camera.device_name,
+                "device_ip": camera.device_ip,
+                "device_location": camera.device_location,
+                "probe_port": camera.probe_port,
+                "probe_path": camera.probe_path,
+                "created_by": auth_data['user_email'],
+                "created_on": now,
+                "updated_by": auth_data['user_email'],
+                "updated_on": now
+            } for camera in valid_rows]
+            for chunk in chunked(camera_rows):
+                await conn.execute(insert(database.Camera).values(chunk))
+
+            # Multi-row inserts do not return every generated id, read them back by name
+            camera_ids = {}
+            for names in chunked([camera.device_name for camera in valid_rows]):
+                result = await conn.execute(select(database.Camera.device_name, database.Camera.id).filter(database.Camera.device_name.in_(names)))
+                camera_ids.update(result.all())
+
+            # Assign every new camera to the importing user by default
+            assignment_rows = [{
+                "camera_id": camera_ids[camera.device_name],
+                "user_id": auth_data['user_id'],
+                "assigned_by": auth_data['user_id'],
+                "created_by": auth_data['user_email'],
+                "created_on": now,
+                "updated_by": auth_data['user_email'],
+                "updated_on": now
+            } for camera in valid_rows]
+            for chunk in chunked(assignment_rows):
+                await conn.execute(insert(database.CameraAssignmentMap).values(chunk))
+
+            assignment_ids = {}
+            for ids in chunked(list(camera_ids.values())):
+                result = await conn.execute(select(database.CameraAssignmentMap.camera_id, database.CameraAssignmentMap.id).filter(
+                    database.CameraAssignmentMap.camera_id.in_(ids),
+                    database.CameraAssignmentMap.user_id == auth_data['user_id']
+                ))
+                assignment_ids.update(result.all())
+
+            audit_rows = []
+            for camera in valid_rows:
+                camera_id = camera_ids[camera.device_name]
+                audit_rows.append(audit_row(
+                    user_id=auth_data['user_id'],
+                    action="CREATE_CAMERA",
+                    entity_type="Camera",
+                    entity_id=camera_id,
+                    details=f"Camera {camera.device_name} created by {auth_data['user_email']}"
+                ))
+                audit_rows.append(audit_row(
+                    user_id=auth_data['user_id'],
+                    action="ASSIGN_CAMERA",
+                    entity_type="CameraAssignment",
+                    entity_id=assignment_ids.get(camera_id),
+                    details=f"Camera {camera.device_name} assigned to user {auth_data['user_email']}"
+                ))
+            await commit_with_audit(conn, audit_rows)
+        await camera_list_cache.invalidate([SCOPE_ALL] + user_scopes([auth_data['user_id']]))
+
+        return {
+            "created": len(valid_rows),
+            "failed": len(errors),
+            "errors": errors,
+            "cameras": [{"camera_id": camera_ids[camera.device_name], "camera_name": camera.device_name} for camera in valid_rows]
+        }
         
-    def assign_camera(self, camera_data, auth_data):
+    async def assign_camera(self, camera_data, auth_data):
         '''
         Assign a camera to a user
         '''
-        with db.session() as conn:
+        async with db.async_session() as conn:
             # Check if the camera exists
-            existing_camera = conn.query(database.Camera).filter(database.Camera.device_name == camera_data.device_name).first()
+            existing_camera = await conn.scalar(select(database.Camera).filter(database.Camera.device_name == camera_data.device_name))
             if not existing_camera:
 
                 raise Error(status_code=404, details="Camera not found!")
             
             # Check if the user exists
-            existing_user = conn.query(database.User).filter(database.User.email == camera_data.user_email).first()
+            existing_user = await conn.scalar(select(database.User).filter(database.User.email == camera_data.user_email))
             if not existing_user:
                 raise Error(status_code=404, details="User not found!")
             
             # Check if the camera is already assigned to the user
-            existing_assignment = conn.query(database.CameraAssignmentMap).filter(
+            existing_assignment = await conn.scalar(select(database.CameraAssignmentMap).filter(
                 database.CameraAssignmentMap.camera_id == existing_camera.id,
                 database.CameraAssignmentMap.user_id == existing_user.id
-            ).first()
+            ))
 
             if existing_assignment:
                 raise Error(status_code=400, details="Camera is already assigned to this user!")
@@ -151,7 +357,7 @@ class CameraManagement():
             )
             
             conn.add(new_assignment)
-            conn.flush()
+            await conn.flush()
             # Create an audit log entry for the assignment
             assign_audit_entry = audit_log(
                 user_id=auth_data['user_id'],
@@ -162,12 +368,144 @@ class CameraManagement():
                 conn=conn
             )
             
-            conn.add(assign_audit_entry)
-            conn.commit()
+            await commit_with_audit(conn, [assign_audit_entry])
+            await camera_list_cache.invalidate(user_scopes([existing_user.id]))
             
             return {"message": "Camera assigned successfully", "assignment_id": new_assignment.id}
         
-    def delete_camera(self, camera_data, auth_data):
+    async def _resolve_assignment_targets(self, conn, data):
+        '''
+        Resolve the camera names and user emails of a bulk assignment with one query each
+        Returns id -> name maps, unknown names or emails abort the request
+        '''
+        device_names = list(dict.fromkeys(data.device_names))
+        user_emails = list(dict.fromkeys(data.user_emails))
+        if len(device_names) * len(user_emails) > BULK_ASSIGNMENT_MAX_PAIRS:
+            raise Error(status_code=400, details=f"At most {BULK_ASSIGNMENT_MAX_PAIRS} camera/user pairs can be changed at once!")
+
+        cameras = {}
+        for names in chunked(device_names):
+            result = await conn.execute(select(database.Camera.id, database.Camera.device_name).filter(database.Camera.device_name.in_(names)))
+            cameras.update(result.all())
+        users = {}
+        for emails in chunked(user_emails):
+            result = await conn.execute(select(database.User.id, database.User.email).filter(database.User.email.in_(emails)))
+            users.update(result.all())
+
+        missing_cameras = sorted(set(device_names) - set(cameras.values()))
+        missing_users = sorted(set(user_emails) - set(users.values()))
+        if missing_cameras or missing_users:
+            raise Error(status_code=404, details={"message": "Cameras or users not found!", "device_names": missing_cameras, "user_emails": missing_users})
+        return cameras, users
+
+    async def bulk_assign_cameras(self, data, auth_data):
+        '''
+        Assign every given camera to every given user
+        Existing assignments are diffed in one query and only the missing pairs are inserted
+        '''
+        async with db.async_session() as conn:
+            cameras, users = await self._resolve_assignment_targets(conn, data)
+
+            existing = set()
+            for camera_ids in chunked(list(cameras)):
+                result = await conn.execute(select(database.CameraAssignmentMap.camera_id, database.CameraAssignmentMap.user_id).filter(
+                    database.CameraAssignmentMap.camera_id.in_(camera_ids),
+                    database.CameraAssignmentMap.user_id.in_(list(users))
+                ))
+                existing.update(result.all())
+
+            new_pairs = [(camera_id, user_id) for camera_id in cameras for user_id in users if (camera_id, user_id) not in existing]
+            if not new_pairs:
+                return {"message": "Cameras assigned successfully", "assigned": 0, "already_assigned": len(existing)}
+
+            now = datetime.utcnow()
+            assignment_rows = [{
+                "camera_id": camera_id,
+                "user_id": user_id,
+                "assigned_by": auth_data['user_id'],
+                "created_by": auth_data['user_email'],
+                "created_on": now,
+                "updated_by": auth_data['user_email'],
+                "updated_on": now
+            } for camera_id, user_id in new_pairs]
+            for chunk in chunked(assignment_rows):
+                await conn.execute(insert(database.CameraAssignmentMap).values(chunk))
+
+            # Read back the generated ids for the audit entries
+            assignment_ids = {}
+            for camera_ids in chunked(list(cameras)):
+                result = await conn.execute(select(
+                    database.CameraAssignmentMap.camera_id,
+                    database.CameraAssignmentMap.user_id,
+                    database.CameraAssignmentMap.id
+                ).filter(
+                    database.CameraAssignmentMap.camera_id.in_(camera_ids),
+                    database.CameraAssignmentMap.user_id.in_(list(users))
+                ))
+                assignment_ids.update({(row.camera_id, row.user_id): row.id for row in result.all()})
+
+            await commit_with_audit(conn, [audit_row(
+                user_id=auth_data['user_id'],
+                action="ASSIGN_CAMERA",
+                entity_type="CameraAssignment",
+                entity_id=assignment_ids.get((camera_id, user_id)),
+                details=f"Camera {cameras[camera_id]} assigned to user {users[user_id]}"
+            ) for camera_id, user_id in new_pairs])
+            await camera_list_cache.invalidate(user_scopes([user_id for _, user_id in new_pairs]))
+
+            return {"message": "Cameras assigned successfully", "assigned": len(new_pairs), "already_assigned": len(existing)}
+
+    async def bulk_deassign_cameras(self, data, auth_data):
+        '''
+        Remove the assignments of every given camera from every given user
+        Like deassign_camera, assignments made by a higher ranked user can not be removed,
+        if any such assignment is part of the request nothing is removed
+        '''
+        current_user_rank = auth_data['user_rank']
+        async with db.async_session() as conn:
+            cameras, users = await self._resolve_assignment_targets(conn, data)
+
+            # Fetch the assignments together with the rank of whoever assigned them, None when they have no role
+            assignments = []
+            for camera_ids in chunked(list(cameras)):
+                result = await conn.execute(select(
+                    database.CameraAssignmentMap.id,
+                    database.CameraAssignmentMap.camera_id,
+                    database.CameraAssignmentMap.user_id,
+                    database.Role.rank
+                ).outerjoin(
+                    database.UserRoleMap, database.UserRoleMap.user_id == database.CameraAssignmentMap.assigned_by
+                ).outerjoin(
+                    database.Role, database.Role.id == database.UserRoleMap.role_id
+                ).filter(
+                    database.CameraAssignmentMap.camera_id.in_(camera_ids),
+                    database.CameraAssignmentMap.user_id.in_(list(users))
+                ))
+                assignments.extend(result.all())
+
+            forbidden = [{"device_name": cameras[row.camera_id], "user_email": users[row.user_id]} for row in assignments if outranked(row.rank, current_user_rank)]
+            if forbidden:
+                raise Error(status_code=403, details={"message": "You do not have permission to deassign these cameras!", "assignments": forbidden})
+
+            for ids in chunked([row.id for row in assignments]):
+                await conn.execute(delete(database.CameraAssignmentMap).filter(database.CameraAssignmentMap.id.in_(ids)))
+
+            await commit_with_audit(conn, [audit_row(
+                user_id=auth_data['user_id'],
+                action="DEASSIGN_CAMERA",
+                entity_type="CameraAssignment",
+                entity_id=row.id,
+                details=f"Camera {cameras[row.camera_id]} deassigned from user {users[row.user_id]} by {auth_data['user_email']}"
+            ) for row in assignments])
+            await camera_list_cache.invalidate(user_scopes([row.user_id for row in assignments]))
+
+            return {
+                "message": "Cameras deassigned successfully",
+                "deassigned": len(assignments),
+                "not_assigned": len(cameras) * len(users) - len(assignments)
+            }
+
+    async def delete_camera(self, camera_data, auth_data):
         '''
         Delete a camera from the system
 
@@ -175,28 +513,26 @@ class CameraManagement():
         Check the rank of current user and assigned_by user in the assignment map
         If the assigned user rank is higher than the current user, then raise an error
         '''
-        with db.session() as conn:
-            # Check if the camera exists
-            existing_camera = conn.query(database.Camera).filter(database.Camera.device_name == camera_data.device_name).first()
-            if not existing_camera:
+        async with db.async_session() as conn:
+            # The camera, its assignment to the user and the rank of the assigner in one statement
+            row = await database.camera_assignment(conn, camera_data.device_name, auth_data['user_id'])
+            if not row:
                 raise Error(status_code=404, details="Camera not found!") 
-            # Check if the camera is assigned to the user
-            existing_assignment = conn.query(database.CameraAssignmentMap).filter(
-                database.CameraAssignmentMap.camera_id == existing_camera.id,
-                database.CameraAssignmentMap.user_id == auth_data['user_id']
-            ).first()
+            existing_camera, existing_assignment, assigner_rank = row
 
             if not existing_assignment:
                 raise Error(status_code=404, details="Camera is not assigned to you!")
             
             # Check the rank of the user who assigned the camera
-            assigner_rank = existing_assignment.assigner.roles[0].rank
             current_user_rank = auth_data['user_rank']
-            print(f"Assigner Rank: {assigner_rank}, Current User Rank: {current_user_rank}")
-            if assigner_rank < current_user_rank:
+            logger.debug(f"Assigner Rank: {assigner_rank}, Current User Rank: {current_user_rank}")
+            if outranked(assigner_rank, current_user_rank):
                 raise Error(status_code=403, details="You do not have permission to delete this camera!")
+            # Everyone the camera is assigned to has it in their cached camera list
+            result = await conn.execute(select(database.CameraAssignmentMap.user_id).filter(database.CameraAssignmentMap.camera_id == existing_camera.id))
+            assigned_user_ids = result.scalars().all()
             # Delete the camera assignment
-            conn.delete(existing_assignment)
+            await conn.delete(existing_assignment)
             # Create an audit log entry for the deletion
             delete_audit_entry = audit_log(
                 user_id=auth_data['user_id'],
@@ -207,9 +543,8 @@ class CameraManagement():
                 conn=conn
             )
            
-            conn.add(delete_audit_entry)
             # Delete the camera itself
-            conn.delete(existing_camera)
+            await conn.delete(existing_camera)
             # Create an audit log entry for the camera deletion
             camera_delete_audit_entry = audit_log(
                 user_id=auth_data['user_id'],
@@ -220,27 +555,22 @@ class CameraManagement():
                 conn=conn
             )
             
-            conn.add(camera_delete_audit_entry)
-            conn.commit()
+            await commit_with_audit(conn, [delete_audit_entry, camera_delete_audit_entry])
+            await camera_list_cache.invalidate([SCOPE_ALL] + user_scopes(assigned_user_ids))
             
             return {"message": "Camera deleted successfully", "camera_name": existing_camera.device_name}
         
-    def modify_camera(self, camera_data, auth_data):
+    async def modify_camera(self, camera_data, auth_data):
         '''
         Edit a camera in the system
         This will update the camera details and also update the assignment if the camera is assigned to the user
         '''
-        with db.session() as conn:
-            # Check if the camera exists
-            existing_camera = conn.query(database.Camera).filter(database.Camera.device_name == camera_data.device_name).first()
-            if not existing_camera:
+        async with db.async_session() as conn:
+            # The camera and its assignment to the user in one statement
+            row = await database.camera_assignment(conn, camera_data.device_name, auth_data['user_id'])
+            if not row:
                 raise Error(status_code=404, details="Camera not found!")
-            
-            # Check if the camera is assigned to the user
-            existing_assignment = conn.query(database.CameraAssignmentMap).filter(
-                database.CameraAssignmentMap.camera_id == existing_camera.id,
-                database.CameraAssignmentMap.user_id == auth_data['user_id']
-            ).first()
+            existing_camera, existing_assignment, _ = row
 
             if not existing_assignment:
                 raise Error(status_code=404, details="Camera is not assigned to you!")
@@ -252,6 +582,10 @@ class CameraManagement():
                 existing_camera.device_ip = camera_data.new_device_ip
             if camera_data.new_device_location:
                 existing_camera.device_location = camera_data.new_device_location
+            if camera_data.new_probe_port:
+                existing_camera.probe_port = camera_data.new_probe_port
+            if camera_data.new_probe_path:
+                existing_camera.probe_path = camera_data.new_probe_path
             
             existing_camera.updated_by = auth_data['user_email']
             existing_camera.updated_on = datetime.utcnow()
@@ -262,7 +596,10 @@ class CameraManagement():
             
             conn.add(existing_camera)
             conn.add(existing_assignment)
-            conn.flush()
+            await conn.flush()
+            # Everyone the camera is assigned to has it in their cached camera list
+            result = await conn.execute(select(database.CameraAssignmentMap.user_id).filter(database.CameraAssignmentMap.camera_id == existing_camera.id))
+            assigned_user_ids = result.scalars().all()
             # Create an audit log entry for the edit
             edit_audit_entry = audit_log(
                 user_id=auth_data['user_id'],
@@ -273,45 +610,39 @@ class CameraManagement():
                 conn=conn
             )
             
-            conn.add(edit_audit_entry)
-            conn.commit()
+            await commit_with_audit(conn, [edit_audit_entry])
+            await camera_list_cache.invalidate([SCOPE_ALL] + user_scopes(assigned_user_ids))
             
             return {"message": "Camera edited successfully", "camera_name": existing_camera.device_name}
         
-    def deassign_camera(self, camera_data, auth_data):
+    async def deassign_camera(self, camera_data, auth_data):
         '''
         Deassign a camera from a user. Users email is given in input
         This will remove the camera assignment from the user
         '''
-        with db.session() as conn:
-            # Check if the camera exists
-            existing_camera = conn.query(database.Camera).filter(database.Camera.device_name == camera_data.device_name).first()
-            if not existing_camera:
-                raise Error(status_code=404, details="Camera not found!")
-            
+        async with db.async_session() as conn:
             # Check if the user exists
-            existing_user = conn.query(database.User).filter(database.User.email == camera_data.user_email).first()
+            existing_user = await conn.scalar(select(database.User).filter(database.User.email == camera_data.user_email))
             if not existing_user:
                 raise Error(status_code=404, details="User not found!")
             
-            # Check if the camera is assigned to the user
-            existing_assignment = conn.query(database.CameraAssignmentMap).filter(
-                database.CameraAssignmentMap.camera_id == existing_camera.id,
-                database.CameraAssignmentMap.user_id == existing_user.id
-            ).first()
+            # The camera, its assignment to the user and the rank of the assigner in one statement
+            row = await database.camera_assignment(conn, camera_data.device_name, existing_user.id)
+            if not row:
+                raise Error(status_code=404, details="Camera not found!")
+            existing_camera, existing_assignment, assigner_rank = row
 
             if not existing_assignment:
                 raise Error(status_code=404, details="Camera is not assigned to this user!")
             
             # Check the rank of the user who assigned the camera
-            assigner_rank = existing_assignment.assigner.roles[0].rank
             current_user_rank = auth_data['user_rank']
-            print(f"Assigner Rank: {assigner_rank}, Current User Rank: {current_user_rank}")
-            if assigner_rank < current_user_rank:
+            logger.debug(f"Assigner Rank: {assigner_rank}, Current User Rank: {current_user_rank}")
+            if outranked(assigner_rank, current_user_rank):
                 raise Error(status_code=403, details="You do not have permission to deassign this camera!")
             
             # Delete the camera assignment
-            conn.delete(existing_assignment)
+            await conn.delete(existing_assignment)
             # Create an audit log entry for the deassignment
             deassign_audit_entry = audit_log(
                 user_id=auth_data['user_id'],
@@ -322,8 +653,8 @@ class CameraManagement():
                 conn=conn
             )
             
-            conn.add(deassign_audit_entry)
-            conn.commit()
+            await commit_with_audit(conn, [deassign_audit_entry])
+            await camera_list_cache.invalidate(user_scopes([existing_user.id]))
             
             return {"message": "Camera deassigned successfully", "camera_name": existing_camera.device_name}
             
\ No newline at end of file
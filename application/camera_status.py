@@ -0,0 +1,283 @@
+'''
+Camera reachability poller
+
+One worker of the deployment (redis lock) probes every camera once per interval_seconds. The probes of a round
+are spread evenly over the interval with random jitter, at most `concurrency` run at once. A probe is a TCP
+connect to the camera's probe_port, or an HTTP GET of its probe_path when it has one, within `timeout` seconds.
+
+Results are kept in the redis hash camera_status as one compact "online|last_seen|latency_ms" value per camera id,
+so listings read the status of a page with one HMGET. camera_status:generation is increased after every round
+in which a camera went on- or offline, it is part of the camera listing ETag.
+
+Configured through CAMERA_STATUS, e.g. {"enabled": true, "interval_seconds": 60, "concurrency": 1000, "timeout": 1.0}
+'''
+import utils.database as database
+from utils.cache import get_redis
+from sqlalchemy import select
+from datetime import datetime, timezone
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from logger import logger
+
+db = database.get_database()
+
+STATUS_KEY = "camera_status"
+GENERATION_KEY = "camera_status:generation"
+SUMMARY_KEY = "camera_status:summary"
+LOCK_KEY = "camera_status:lock"
+
+CAMERA_STATUS_DEFAULTS = {
+    "enabled": False,
+    "interval_seconds": 60.0,
+    "concurrency": 1000,
+    "timeout": 1.0,
+    "default_port": 554,
+    "jitter": 0.5,
+    "flush_size": 1000,
+}
+UNKNOWN_STATUS = {"online": None, "last_seen": None, "latency_ms": None}
+
+
+def encode_status(online, last_seen, latency_ms):
+    return f"{int(online)}|{last_seen or ''}|{'' if latency_ms is None else round(latency_ms, 1)}"
+
+
+def decode_status(value):
+    online, last_seen, latency_ms = value.split("|")
+    return {
+        "online": online == "1",
+        "last_seen": datetime.fromtimestamp(int(last_seen), timezone.utc) if last_seen else None,
+        "latency_ms": float(latency_ms) if latency_ms else None,
+    }
+
+
+async def probe(host, port, path=None, timeout=1.0):
+    '''
+    Round trip in ms of a TCP connect (or an HTTP request when path is set), None when the camera did not answer
+    '''
+    writer = None
+
+    async def connect():
+        nonlocal writer
+        reader, writer = await asyncio.open_connection(host, port)
+        if path:
+            writer.write(f"GET {path} HTTP/1.0\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            return (await reader.readline()).startswith(b"HTTP/")
+        return True
+
+    start = time.perf_counter()
+    try:
+        if not await asyncio.wait_for(connect(), timeout):
+            return None
+        return (time.perf_counter() - start) * 1000
+    except (OSError, asyncio.TimeoutError, ValueError):
+        return None
+    except Exception as e:
+        # Whatever else goes wrong with one camera, it is recorded as down and the round goes on
+        logger.warning(f"Probe of {host}:{port} failed: {e!r}")
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+
+async def camera_statuses(camera_ids):
+    '''
+    Status of every camera id, cameras which were not probed yet (or with redis unavailable) get None fields
+    '''
+    if not camera_ids:
+        return {}
+    try:
+        values = await get_redis().hmget(STATUS_KEY, [str(camera_id) for camera_id in camera_ids])
+    except Exception as e:
+        logger.warning(f"Camera status unavailable: {e}")
+        values = [None] * len(camera_ids)
+    return {camera_id: decode_status(value) if value else UNKNOWN_STATUS for camera_id, value in zip(camera_ids, values)}
+
+
+async def status_generation():
+    return await get_redis().get(GENERATION_KEY) or "0"
+
+
+async def status_summary(camera_ids=None):
+    '''
+    Online, offline and not yet probed counts of every camera (as of the last round) or of the given cameras
+    '''
+    if camera_ids is None:
+        summary = await get_redis().get(SUMMARY_KEY)
+        if not summary:
+            return {"total": 0, "online": 0, "offline": 0, "unknown": 0, "updated_at": None}
+        summary = json.loads(summary)
+        summary["updated_at"] = datetime.fromisoformat(summary["updated_at"])
+        return summary
+    statuses = (await camera_statuses(camera_ids)).values()
+    online = sum(1 for status in statuses if status["online"] is True)
+    offline = sum(1 for status in statuses if status["online"] is False)
+    return {"total": len(camera_ids), "online": online, "offline": offline, "unknown": len(camera_ids) - online - offline, "updated_at": None}
+
+
+class CameraStatusPoller():
+    def __init__(self, config):
+        self.options = {key: type(default)(config.get(key, default)) for key, default in CAMERA_STATUS_DEFAULTS.items()}
+        self.enabled = self.options["enabled"]
+        self._token = uuid.uuid4().hex
+        self._task = None
+        # State of the cameras while this worker holds the lock
+        self.online = {}
+        self.last_seen = {}
+        self._pending = {}
+        self._changed = False
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            rc = get_redis()
+            if await rc.get(LOCK_KEY) == self._token:
+                await rc.delete(LOCK_KEY)
+        except Exception as e:
+            logger.warning(f"Failed to release the camera status lock: {e}")
+
+    async def acquire_lock(self):
+        '''
+        Take or extend the lock, it outlives a round so it only moves on when its holder stopped polling
+        '''
+        rc = get_redis()
+        ttl = int(self.options["interval_seconds"] * 2) + 1
+        if await rc.set(LOCK_KEY, self._token, nx=True, ex=ttl):
+            return True
+        if await rc.get(LOCK_KEY) == self._token:
+            await rc.expire(LOCK_KEY, ttl)
+            return True
+        return False
+
+    async def load_status(self):
+        '''
+        Continue from the results of the previous holder of the lock
+        '''
+        for camera_id, value in (await get_redis().hgetall(STATUS_KEY)).items():
+            status = decode_status(value)
+            self.online[int(camera_id)] = status["online"]
+            if status["last_seen"] is not None:
+                self.last_seen[int(camera_id)] = int(status["last_seen"].timestamp())
+
+    async def load_cameras(self):
+        async with db.async_session() as conn:
+            result = await conn.execute(select(
+                database.Camera.id, database.Camera.device_ip, database.Camera.probe_port, database.Camera.probe_path
+            ))
+            return result.all()
+
+    async def probe_camera(self, camera, semaphore):
+        try:
+            latency_ms = await probe(
+                camera.device_ip, camera.probe_port or self.options["default_port"], camera.probe_path, self.options["timeout"]
+            )
+        finally:
+            semaphore.release()
+        online = latency_ms is not None
+        if online:
+            self.last_seen[camera.id] = int(time.time())
+        if self.online.get(camera.id) != online:
+            self._changed = True
+        self.online[camera.id] = online
+        self._pending[str(camera.id)] = encode_status(online, self.last_seen.get(camera.id), latency_ms)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        await get_redis().hset(STATUS_KEY, mapping=pending)
+
+    async def run_round(self):
+        '''
+        Probe every camera once, returns the number of probed cameras
+        '''
+        cameras = await self.load_cameras()
+        started = time.monotonic()
+        spacing = self.options["interval_seconds"] / max(len(cameras), 1)
+        semaphore = asyncio.Semaphore(self.options["concurrency"])
+        tasks = set()
+
+        for index, camera in enumerate(cameras):
+            # Every camera has its slot in the interval, the jitter keeps probes from lining up between rounds
+            delay = started + (index + random.uniform(0, self.options["jitter"])) * spacing - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await semaphore.acquire()
+            task = asyncio.create_task(self.probe_camera(camera, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            if len(self._pending) >= self.options["flush_size"]:
+                await self.flush()
+        if tasks:
+            await asyncio.gather(*tasks)
+        await self.flush()
+
+        # Deleted cameras are dropped from the status hash
+        camera_ids = {camera.id for camera in cameras}
+        stale = [camera_id for camera_id in self.online if camera_id not in camera_ids]
+        rc = get_redis()
+        if stale:
+            await rc.hdel(STATUS_KEY, *[str(camera_id) for camera_id in stale])
+            for camera_id in stale:
+                self.online.pop(camera_id, None)
+                self.last_seen.pop(camera_id, None)
+
+        online = sum(1 for camera_id in camera_ids if self.online.get(camera_id))
+        summary = {
+            "total": len(camera_ids),
+            "online": online,
+            "offline": len(camera_ids) - online,
+            "unknown": 0,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "round_seconds": round(time.monotonic() - started, 1),
+        }
+        async with rc.pipeline(transaction=False) as pipe:
+            pipe.set(SUMMARY_KEY, json.dumps(summary))
+            if self._changed or stale:
+                pipe.incr(GENERATION_KEY)
+            await pipe.execute()
+        self._changed = False
+        return len(cameras)
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                if await self.acquire_lock():
+                    if not self.online:
+                        await self.load_status()
+                    probed = await self.run_round()
+                    logger.info(f"Probed {probed} cameras in {time.monotonic() - started:.1f}s")
+                else:
+                    # Another worker polls, its results are loaded again when this one takes over
+                    self.online.clear()
+                    self.last_seen.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Camera status round failed: {e}")
+            await asyncio.sleep(max(self.options["interval_seconds"] - (time.monotonic() - started), 0))
+
+
+camera_status_poller = CameraStatusPoller(json.loads(os.getenv('CAMERA_STATUS', '{}')))
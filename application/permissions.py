@@ -0,0 +1,62 @@
+'''
+Push permission changes made by hand to the live sessions and tokens
+
+After editing role_permission_map or user_role_map directly in the database run one of
+
+    python -m application.permissions --role <role name>     every user of the role
+    python -m application.permissions --user <email>          one user
+    python -m application.permissions --all                   every user
+
+Every worker drops its cached permissions, the sessions of the affected users are rewritten with the new role and
+permissions and their access tokens are revoked (they carry the old permissions as claims), the users get new
+tokens through the refresh token or a new login.
+'''
+import argparse
+import asyncio
+import sys
+
+import utils.database as database
+from sqlalchemy import select
+from utils.exceptions import *
+from .service import publish_permission_change
+
+db = database.get_database()
+
+
+async def propagate_permission_change(role=None, email=None):
+    '''
+    Resolve the role name or user email and publish the change, returns the emails of the affected users
+    Without role and email every user is affected
+    '''
+    role_id = user_id = None
+    async with db.async_session() as conn:
+        if role is not None:
+            role_id = await conn.scalar(select(database.Role.id).filter(database.Role.name == role))
+            if role_id is None:
+                raise Error(status_code=404, details=f"Role {role} not found!")
+        if email is not None:
+            user_id = await conn.scalar(select(database.User.id).filter(database.User.email == email))
+            if user_id is None:
+                raise Error(status_code=404, details=f"User {email} not found!")
+    return await publish_permission_change(user_id=user_id, role_id=role_id)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m application.permissions", description="Push hand-made permission changes to live sessions")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--role", help="name of the role whose permissions changed")
+    target.add_argument("--user", help="email of the user whose role changed")
+    target.add_argument("--all", action="store_true", help="refresh every user")
+    args = parser.parse_args(argv)
+
+    try:
+        emails = asyncio.run(propagate_permission_change(role=args.role, email=args.user))
+    except Error as e:
+        print(e.details, file=sys.stderr)
+        return 1
+    print(f"Refreshed the sessions and revoked the access tokens of {len(emails)} users")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,252 @@
+'''
+Audit log retention
+
+Audit logs older than max_age_days are moved, one calendar month at a time, out of the audit_logs table
+into append-only gzip archives on local disk (one file per month, one gzip member per batch).
+A manifest next to every archive records the highest archived id so an interrupted run never archives
+a row twice. Before a batch is appended the manifest records the archive size, a run interrupted between the
+append and the manifest update truncates the archive back to it. Archived logs stay readable through read_archived_logs which only opens the files of the
+months overlapping the requested time range.
+
+Run once with: python -m application.retention (takes the same lock as the workers, exits with 1 while it is held)
+'''
+import utils.database as database
+from utils.cache import get_redis
+from sqlalchemy import select, delete
+from datetime import datetime, timedelta, timezone
+import asyncio
+import glob
+import gzip
+import json
+import os
+import sys
+import uuid
+from logger import logger
+from .service import EXPORT_COLUMNS
+
+db = database.get_database()
+
+ARCHIVE_PREFIX = "audit_logs-"
+RETENTION_LOCK_KEY = "audit_retention:lock"
+# Extend or delete the lock only while it is still held with our token
+EXTEND_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end return 0"
+RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def next_month(moment):
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+
+def naive_utc(moment):
+    '''
+    Audit timestamps are naive UTC, aware bounds are converted so they can be compared
+    '''
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class AuditRetention():
+    def __init__(self, config):
+        self.enabled = bool(config.get("enabled", False))
+        self.max_age_days = int(config.get("max_age_days", 90))
+        self.archive_dir = config.get("archive_dir", "audit-archive")
+        self.interval_seconds = int(config.get("interval_seconds", 3600))
+        self.batch_size = int(config.get("batch_size", 5000))
+        # The lock is extended after every batch, it only expires when its holder stopped archiving
+        self.lock_seconds = int(config.get("lock_seconds", 300))
+        self._token = uuid.uuid4().hex
+        self._locked = False
+        self._task = None
+
+    def archive_path(self, month):
+        return os.path.join(self.archive_dir, f"{ARCHIVE_PREFIX}{month:%Y-%m}.ndjson.gz")
+
+    def manifest_path(self, month):
+        return os.path.join(self.archive_dir, f"{ARCHIVE_PREFIX}{month:%Y-%m}.manifest.json")
+
+    def read_manifest(self, month):
+        try:
+            with open(self.manifest_path(month)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {"archived_max_id": 0, "rows": 0}
+
+    def write_manifest(self, month, manifest):
+        path = self.manifest_path(month)
+        with open(f"{path}.tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def recover(self, month, manifest):
+        '''
+        Undo a batch which was appended but not recorded in the manifest, it is archived again
+        '''
+        pending = manifest.pop("pending_size", None)
+        if pending is None:
+            return manifest
+        path = self.archive_path(month)
+        if os.path.exists(path) and os.path.getsize(path) > pending:
+            with open(path, "r+b") as archive_file:
+                archive_file.truncate(pending)
+                os.fsync(archive_file.fileno())
+            logger.warning(f"Truncated {path} to {pending} bytes after an interrupted archival")
+        self.write_manifest(month, manifest)
+        return manifest
+
+    def archive_size(self, month):
+        path = self.archive_path(month)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def append_archive(self, month, rows):
+        # Every batch becomes its own gzip member, gzip readers see the members as one stream
+        with open(self.archive_path(month), "ab") as archive_file:
+            with gzip.GzipFile(fileobj=archive_file, mode="wb") as member:
+                for row in rows:
+                    member.write((json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + "\n").encode())
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+
+    def cutoff(self):
+        '''
+        Only whole months which are entirely older than max_age_days are archived
+        '''
+        return month_start(datetime.now() - timedelta(days=self.max_age_days))
+
+    async def run_once(self):
+        '''
+        Archive every month older than the cutoff, returns the number of archived rows
+        '''
+        os.makedirs(self.archive_dir, exist_ok=True)
+        cutoff = self.cutoff()
+        async with db.async_session() as conn:
+            oldest = await conn.scalar(select(database.AuditLog.timestamp).filter(database.AuditLog.timestamp < cutoff).order_by(database.AuditLog.timestamp).limit(1))
+        archived = 0
+        month = month_start(oldest) if oldest else cutoff
+        while month < cutoff:
+            archived += await self.archive_month(month)
+            month = next_month(month)
+        return archived
+
+    async def archive_month(self, month):
+        columns = [getattr(database.AuditLog, column) for column in EXPORT_COLUMNS]
+        in_month = [database.AuditLog.timestamp >= month, database.AuditLog.timestamp < next_month(month)]
+        manifest = await asyncio.to_thread(lambda: self.recover(month, self.read_manifest(month)))
+        archived = 0
+
+        async with db.async_session() as conn:
+            # Rows archived by an interrupted run are already on disk, only delete them
+            await conn.execute(delete(database.AuditLog).filter(*in_month, database.AuditLog.id <= manifest["archived_max_id"]))
+            await conn.commit()
+
+            while True:
+                result = await conn.execute(
+                    select(*columns)
+                    .filter(*in_month, database.AuditLog.id > manifest["archived_max_id"])
+                    .order_by(database.AuditLog.id)
+                    .limit(self.batch_size)
+                )
+                rows = result.all()
+                if not rows:
+                    break
+                size = await asyncio.to_thread(self.archive_size, month)
+                await asyncio.to_thread(self.write_manifest, month, {**manifest, "pending_size": size})
+                await asyncio.to_thread(self.append_archive, month, rows)
+                manifest = {"archived_max_id": rows[-1].id, "rows": manifest["rows"] + len(rows)}
+                await asyncio.to_thread(self.write_manifest, month, manifest)
+
+                await conn.execute(delete(database.AuditLog).filter(database.AuditLog.id.in_([row.id for row in rows])))
+                await conn.commit()
+                archived += len(rows)
+                await self.extend_lock()
+
+        if archived:
+            logger.info(f"Archived {archived} audit logs of {month:%Y-%m}")
+        return archived
+
+    def read_archived_logs(self, since=None, until=None, **filters):
+        '''
+        Yield archived logs as dicts, only the archives of months overlapping [since, until) are opened
+        '''
+        since, until = naive_utc(since), naive_utc(until)
+        for path in sorted(glob.glob(os.path.join(self.archive_dir, f"{ARCHIVE_PREFIX}*.ndjson.gz"))):
+            month = datetime.strptime(os.path.basename(path)[len(ARCHIVE_PREFIX):len(ARCHIVE_PREFIX) + 7], "%Y-%m")
+            if (since is not None and next_month(month) <= since) or (until is not None and month >= until):
+                continue
+            with gzip.open(path, "rt") as archive_file:
+                for line in archive_file:
+                    row = json.loads(line)
+                    timestamp = datetime.fromisoformat(row["timestamp"])
+                    if since is not None and timestamp < since:
+                        continue
+                    if until is not None and timestamp >= until:
+                        continue
+                    if any(value is not None and row[key] != value for key, value in filters.items()):
+                        continue
+                    yield row
+
+    async def run_locked(self):
+        '''
+        Run once while holding the deployment wide lock, returns None without archiving while another process holds it
+        '''
+        if not await get_redis().set(RETENTION_LOCK_KEY, self._token, nx=True, ex=self.lock_seconds):
+            return None
+        self._locked = True
+        try:
+            return await self.run_once()
+        finally:
+            self._locked = False
+            await self.release_lock()
+
+    async def extend_lock(self):
+        if self._locked:
+            await get_redis().eval(EXTEND_LOCK, 1, RETENTION_LOCK_KEY, self._token, self.lock_seconds)
+
+    async def release_lock(self):
+        try:
+            await get_redis().eval(RELEASE_LOCK, 1, RETENTION_LOCK_KEY, self._token)
+        except Exception as e:
+            # The lock expires after lock_seconds
+            logger.warning(f"Failed to release the audit retention lock: {e}")
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # Only one worker of the deployment runs the archival at a time
+                await self.run_locked()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Audit log retention failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+
+audit_retention = AuditRetention(json.loads(os.getenv('AUDIT_RETENTION', '{}')))
+
+
+if __name__ == "__main__":
+    archived = asyncio.run(audit_retention.run_locked())
+    if archived is None:
+        print("Audit logs are being archived by another process, try again later")
+        sys.exit(1)
+    print(f"Archived {archived} audit logs")
+    sys.exit(0)
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field,EmailStr,model_validator
-from typing import Optional
+from typing import Optional, List, Literal
+from datetime import date, datetime
 
 
 
@@ -36,11 +37,22 @@ class CreateCamera(BaseModel):
     device_name: str = Field(min_length=1,default="camera-name")
     device_ip: str = Field(min_length=1,default="192.168.1.12")
     device_location: str = Field(min_length=1, default="hallway")
+    # Reachability probe, TCP port or HTTP path, the CAMERA_STATUS default_port when both are left out
+    probe_port: Optional[int] = Field(default=None, ge=1, le=65535)
+    probe_path: Optional[str] = Field(default=None, pattern=r"^/", max_length=255)
+
+class BulkCreateCamera(BaseModel):
+    cameras: List[CreateCamera] = Field(min_length=1)
+    mode: Literal["atomic", "best_effort"] = Field(default="atomic")
 
 class AssignCamera(BaseModel):
     device_name: str = Field(min_length=1,default="camera-name")
     user_email: EmailStr = Field(min_length=1, default="user@gmail.com")
 
+class BulkCameraAssignment(BaseModel):
+    device_names: List[str] = Field(min_length=1, default=["camera-name"])
+    user_emails: List[EmailStr] = Field(min_length=1, default=["user@gmail.com"])
+
 class DeleteCamera(BaseModel):
     device_name: str = Field(min_length=1,default="camera-name")
 
@@ -49,7 +61,74 @@ class ModifyCamera(BaseModel):
     new_device_name: Optional[str] = Field(min_length=1, default=None)
     new_device_ip: Optional[str] = Field(min_length=1, default=None)
     new_device_location: Optional[str] = Field(min_length=1, default=None)
+    new_probe_port: Optional[int] = Field(default=None, ge=1, le=65535)
+    new_probe_path: Optional[str] = Field(default=None, pattern=r"^/", max_length=255)
 
 class DeassignCamera(BaseModel):
     device_name: str = Field(min_length=1,default="camera-name")
-    user_email: EmailStr = Field(min_length=1, default="user@gmail.com")
\ No newline at end of file
+    user_email: EmailStr = Field(min_length=1, default="user@gmail.com")
+
+
+# Response models
+# They document the responses, listings encode their column dicts with orjson directly (see api/v1.py listing_body).
+# Fields left out by a camera projection (fields=) are not in the response, so only id is required
+
+class CameraOut(BaseModel):
+    id: int
+    device_name: Optional[str] = None
+    device_ip: Optional[str] = None
+    device_location: Optional[str] = None
+    created_by: Optional[str] = None
+    created_on: Optional[date] = None
+    updated_by: Optional[str] = None
+    updated_on: Optional[str] = None
+    probe_port: Optional[int] = None
+    probe_path: Optional[str] = None
+    # Reachability, part of the listing unless fields leaves out "status"
+    online: Optional[bool] = None
+    last_seen: Optional[datetime] = None
+    latency_ms: Optional[float] = None
+
+class CameraPage(BaseModel):
+    items: List[CameraOut]
+    next_cursor: Optional[int] = None
+
+class CameraListResponse(BaseModel):
+    responseData: CameraPage
+
+class CameraStatusSummary(BaseModel):
+    total: int
+    online: int
+    offline: int
+    unknown: int
+    updated_at: Optional[datetime] = None
+    round_seconds: Optional[float] = None
+
+class CameraStatusSummaryResponse(BaseModel):
+    responseData: CameraStatusSummary
+
+class UserOut(BaseModel):
+    id: int
+    name: str
+    email: str
+    created_on: date
+    created_by: str
+
+class UserListResponse(BaseModel):
+    responseData: List[UserOut]
+
+class AuditLogOut(BaseModel):
+    id: int
+    user_id: int
+    action: str
+    entity_type: str
+    entity_id: Optional[int] = None
+    details: Optional[str] = None
+    timestamp: datetime
+
+class AuditLogPage(BaseModel):
+    items: List[AuditLogOut]
+    next_cursor: Optional[str] = None
+
+class AuditLogListResponse(BaseModel):
+    responseData: AuditLogPage
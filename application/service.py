@@ -3,30 +3,236 @@ Contains all generalized logic
 '''
 import utils.database as database
 from utils.exceptions import *
+from utils.cache import subscriber, publish, get_redis
+from .audit_writer import audit_writer
+from sqlalchemy import select, insert, and_, or_
 from datetime import datetime
 import os 
 import json
+import time
+import base64
+import csv
+import io
+import zlib
 
-config = json.loads(os.getenv('DB_CONNECTION_STRING', {}))
-db = database.DatabaseResource(config)
-
-def require_permissions(auth_data,permission_type):
-    user_id = auth_data["user_id"]
-    with db.session() as conn:
-        all_permissions = []
-        data = conn.query(database.User).filter(database.User.id == user_id).first()
-        user_role = data.roles
-        user_role_id = user_role[0].id
-
-        role_details = conn.query(database.Role).filter(database.Role.id == user_role_id).first()
-        role_permissions = role_details.permissions
-        for i in role_permissions:
-            all_permissions.append(i.permission_name)
-        
-        if permission_type in all_permissions:
+db = database.get_database()
+
+PERMISSION_CACHE_TTL = int(os.getenv('PERMISSION_CACHE_TTL', 300))
+PERMISSION_CHANNEL = "permissions:invalidate"
+
+
+class PermissionCache():
+    '''
+    Per worker cache of user -> role id and role id -> permission names
+    Entries expire after a TTL and are invalidated across workers through redis pub/sub
+    '''
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.user_roles = {}
+        self.role_permissions = {}
+
+    async def role_for_user(self, user_id):
+        cached = self.user_roles.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        async with db.async_session() as conn:
+            role_id = await conn.scalar(select(database.UserRoleMap.role_id).filter(database.UserRoleMap.user_id == user_id))
+        if role_id is None:
+            raise Error(status_code=404, details="User not found!")
+        self.user_roles[user_id] = (role_id, time.monotonic() + self.ttl)
+        return role_id
+
+    async def permissions_for_role(self, role_id):
+        cached = self.role_permissions.get(role_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        async with db.async_session() as conn:
+            permissions = await database.role_permission_names(conn, role_id)
+        self.role_permissions[role_id] = (permissions, time.monotonic() + self.ttl)
+        return permissions
+
+    async def permissions_for_user(self, user_id):
+        return await self.permissions_for_role(await self.role_for_user(user_id))
+
+    def invalidate(self, user_id=None, role_id=None):
+        '''
+        Drop the affected entries, or everything when nothing specific is given
+        '''
+        if user_id is None and role_id is None:
+            self.clear()
+            return
+        if user_id is not None:
+            self.user_roles.pop(user_id, None)
+        if role_id is not None:
+            self.role_permissions.pop(role_id, None)
+
+    def clear(self):
+        self.user_roles.clear()
+        self.role_permissions.clear()
+
+    def handle_message(self, message):
+        self.invalidate(user_id=message.get("user_id"), role_id=message.get("role_id"))
+
+
+permission_cache = PermissionCache(PERMISSION_CACHE_TTL)
+subscriber.register(PERMISSION_CHANNEL, permission_cache.handle_message, on_reset=permission_cache.clear)
+
+
+ACCESS_TOKEN_EXPIRE_MINUTES = 10
+REVOCATION_CHANNEL = "tokens:revoke"
+REVOKED_TOKENS_KEY = "revocations:tokens"
+NOT_BEFORE_KEY = "revocations:not_before"
+
+
+class TokenRevocations():
+    '''
+    Per worker copy of revoked access tokens, used to validate access tokens without a redis lookup
+    Single tokens are revoked by id (jti) until they expire, all tokens of a user issued up to a
+    "not before" timestamp are revoked by email. Revocations are stored in redis, pushed to every
+    worker through pub/sub and reloaded from redis whenever the subscription is (re)established
+    '''
+    def __init__(self, token_lifetime):
+        self.token_lifetime = token_lifetime
+        self.tokens = {}
+        self.not_before = {}
+
+    def is_revoked(self, payload):
+        if self.is_token_revoked(payload):
             return True
-        else:
-            raise Error(status_code=400, details="User is not authorized to perform this action!")
+        not_before = self.not_before.get(payload.get("user_email"))
+        return not_before is not None and payload.get("iat", 0) <= not_before
+
+    def is_token_revoked(self, payload):
+        '''
+        Whether this very token was revoked (logout), sessions outlive the revocation of a user's older tokens
+        '''
+        return payload.get("jti") in self.tokens
+
+    def apply(self, message):
+        if message.get("jti"):
+            self.tokens[message["jti"]] = message["exp"]
+        for email in message.get("user_emails", []):
+            self.not_before[email] = max(self.not_before.get(email, 0), message["not_before"])
+        self.prune()
+
+    def prune(self):
+        # Access tokens issued before now - token_lifetime have expired anyway
+        now = time.time()
+        self.tokens = {jti: exp for jti, exp in self.tokens.items() if exp > now}
+        self.not_before = {email: moment for email, moment in self.not_before.items() if moment > now - self.token_lifetime}
+
+    async def load(self):
+        rc = get_redis()
+        now = time.time()
+        await rc.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", now)
+        tokens = await rc.zrange(REVOKED_TOKENS_KEY, 0, -1, withscores=True)
+        not_before = {email: float(moment) for email, moment in (await rc.hgetall(NOT_BEFORE_KEY)).items()}
+        stale = [email for email, moment in not_before.items() if moment <= now - self.token_lifetime]
+        if stale:
+            await rc.hdel(NOT_BEFORE_KEY, *stale)
+        self.tokens = dict(tokens)
+        self.not_before = {email: moment for email, moment in not_before.items() if email not in stale}
+
+    async def revoke_token(self, jti, exp):
+        await get_redis().zadd(REVOKED_TOKENS_KEY, {jti: exp})
+        message = {"jti": jti, "exp": exp}
+        self.apply(message)
+        await publish(REVOCATION_CHANNEL, message)
+
+    async def revoke_users(self, emails):
+        '''
+        Revoke every access token issued to the users until now
+        '''
+        if not emails:
+            return
+        message = {"user_emails": list(emails), "not_before": time.time()}
+        await get_redis().hset(NOT_BEFORE_KEY, mapping={email: message["not_before"] for email in emails})
+        self.apply(message)
+        await publish(REVOCATION_CHANNEL, message)
+
+
+token_revocations = TokenRevocations(ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+subscriber.register(REVOCATION_CHANNEL, token_revocations.apply, on_reset=token_revocations.load)
+
+
+async def publish_permission_change(user_id=None, role_id=None):
+    '''
+    Invalidate cached permissions in this worker and broadcast the change to all other workers
+    Sessions of the affected users are refreshed so they carry the new permissions,
+    their access tokens are revoked since those carry the old role and permissions as claims
+    Call this after a change to user_role_map or role_permission_map has been committed (see application.permissions
+    for changes made by hand), returns the emails of the affected users
+    '''
+    permission_cache.invalidate(user_id=user_id, role_id=role_id)
+    await publish(PERMISSION_CHANNEL, {"user_id": user_id, "role_id": role_id})
+    emails = await refresh_sessions(user_ids=[user_id] if user_id is not None else None, role_id=role_id)
+    await token_revocations.revoke_users(emails)
+    return emails
+
+
+SESSION_BATCH_SIZE = 500
+
+
+async def refresh_sessions(user_ids=None, role_id=None):
+    '''
+    Rewrite the role, rank and permissions stored in the active sessions of the affected users
+    Sessions keep their remaining TTL and sessions which expired in the meantime are not recreated
+    Returns the emails of the affected users
+    '''
+    async with db.async_session() as conn:
+        query = select(
+            database.User.email,
+            database.Role.id,
+            database.Role.name,
+            database.Role.rank
+        ).join(
+            database.UserRoleMap, database.UserRoleMap.user_id == database.User.id
+        ).join(
+            database.Role, database.Role.id == database.UserRoleMap.role_id
+        )
+        if user_ids is not None:
+            query = query.filter(database.User.id.in_(user_ids))
+        if role_id is not None:
+            query = query.filter(database.Role.id == role_id)
+        users = (await conn.execute(query)).all()
+
+    rc = get_redis()
+    for start in range(0, len(users), SESSION_BATCH_SIZE):
+        batch = users[start:start + SESSION_BATCH_SIZE]
+        keys = [f"user_token:{user.email}" for user in batch]
+        sessions = await rc.mget(keys)
+        async with rc.pipeline(transaction=False) as pipe:
+            for key, user, session in zip(keys, batch, sessions):
+                if session is None:
+                    continue
+                session = json.loads(session)
+                session["user_role"] = user.name
+                session["user_rank"] = user.rank
+                session["user_permissions"] = sorted(await permission_cache.permissions_for_role(user.id))
+                pipe.set(key, json.dumps(session), xx=True, keepttl=True)
+            await pipe.execute()
+    return [user.email for user in users]
+
+
+async def revoke_sessions(emails):
+    '''
+    Remove the access and refresh sessions of the given users and revoke their access tokens
+    '''
+    keys = [f"{prefix}:{email}" for email in emails for prefix in ("user_token", "refresh_token")]
+    if keys:
+        await get_redis().delete(*keys)
+    await token_revocations.revoke_users(emails)
+
+
+async def require_permissions(auth_data,permission_type):
+    # Sessions created at login carry the effective permissions of the user
+    all_permissions = auth_data.get("user_permissions")
+    if all_permissions is None:
+        all_permissions = await permission_cache.permissions_for_user(auth_data["user_id"])
+    if permission_type in all_permissions:
+        return True
+    else:
+        raise Error(status_code=400, details="User is not authorized to perform this action!")
 
 
 def audit_log(user_id, action, entity_type, entity_id=None, details=None,conn=None):
@@ -45,10 +251,160 @@ def audit_log(user_id, action, entity_type, entity_id=None, details=None,conn=No
     # This allows the caller to control transaction boundaries
     return audit_entry
 
-def fetch_activity_logs():
+
+BULK_CHUNK_SIZE = 1000
+
+
+def chunked(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def audit_row(user_id, action, entity_type, entity_id=None, details=None):
+    '''
+    Same as audit_log but returns a plain row for multi-row inserts
+    '''
+    return {
+        "user_id": user_id,
+        "action": action,
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "details": details,
+        "timestamp": datetime.now()
+    }
+
+
+async def write_audit_rows(conn, rows):
+    '''
+    Insert audit rows with multi-row inserts, the commit is driven by the caller
+    '''
+    for chunk in chunked(rows):
+        await conn.execute(insert(database.AuditLog).values(chunk))
+
+
+AUDIT_COLUMNS = ["user_id", "action", "entity_type", "entity_id", "details", "timestamp"]
+
+
+async def commit_with_audit(conn, entries):
+    '''
+    Commit the caller's transaction together with its audit entries (AuditLog objects or audit rows)
+    When the buffered audit writer is enabled the entries are queued once the commit succeeded
+    '''
+    rows = [entry if isinstance(entry, dict) else {column: getattr(entry, column) for column in AUDIT_COLUMNS} for entry in entries]
+    if audit_writer.enabled:
+        await conn.commit()
+        await audit_writer.submit(rows)
+    else:
+        await write_audit_rows(conn, rows)
+        await conn.commit()
+
+ACTIVITY_PAGE_SIZE = 100
+ACTIVITY_MAX_PAGE_SIZE = 500
+
+
+def encode_activity_cursor(log):
+    return base64.urlsafe_b64encode(f"{log.timestamp.isoformat()}|{log.id}".encode()).decode()
+
+
+def decode_activity_cursor(cursor):
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except Exception:
+        raise Error(status_code=400, details="Invalid cursor!")
+
+
+def activity_log_filters(user_id=None, action=None, entity_type=None, entity_id=None, since=None, until=None):
+    '''
+    Build the where clauses shared by the activity log listing and export
+    '''
+    filters = []
+    if user_id is not None:
+        filters.append(database.AuditLog.user_id == user_id)
+    if action is not None:
+        filters.append(database.AuditLog.action == action)
+    if entity_type is not None:
+        filters.append(database.AuditLog.entity_type == entity_type)
+    if entity_id is not None:
+        filters.append(database.AuditLog.entity_id == entity_id)
+    if since is not None:
+        filters.append(database.AuditLog.timestamp >= since)
+    if until is not None:
+        filters.append(database.AuditLog.timestamp < until)
+    return filters
+
+
+async def fetch_activity_logs(limit=ACTIVITY_PAGE_SIZE, cursor=None, **filters):
+    '''
+    Fetch one page of activity logs ordered by latest first
+    Pages are keyset paginated on (timestamp, id), pass back next_cursor to get the following page
+    '''
+    limit = min(limit, ACTIVITY_MAX_PAGE_SIZE)
+    conditions = activity_log_filters(**filters)
+    if cursor:
+        timestamp, log_id = decode_activity_cursor(cursor)
+        conditions.append(or_(
+            database.AuditLog.timestamp < timestamp,
+            and_(database.AuditLog.timestamp == timestamp, database.AuditLog.id < log_id)
+        ))
+
+    async with db.async_session() as conn:
+        result = await conn.execute(
+            select(*[getattr(database.AuditLog, column) for column in EXPORT_COLUMNS])
+            .filter(*conditions)
+            .order_by(database.AuditLog.timestamp.desc(), database.AuditLog.id.desc())
+            .limit(limit + 1)
+        )
+        logs = result.all()
+
+    # One extra row is fetched to know if there is a next page
+    next_cursor = encode_activity_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return {"items": [dict(log._mapping) for log in logs[:limit]], "next_cursor": next_cursor}
+
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ["id", "user_id", "action", "entity_type", "entity_id", "details", "timestamp"]
+
+
+async def stream_activity_logs(**filters):
     '''
-    Fetch all activity logs from our database ordered by latest first
+    Yield activity log rows oldest first in batches of EXPORT_BATCH_SIZE
+    Rows are read through a server side cursor so memory does not grow with the size of the export
     '''
-    with db.session() as conn:
-        logs = conn.query(database.AuditLog).order_by(database.AuditLog.timestamp.desc()).all()
-        return logs
\ No newline at end of file
+    columns = [getattr(database.AuditLog, column) for column in EXPORT_COLUMNS]
+    async with db.async_session() as conn:
+        result = await conn.stream(
+            select(*columns)
+            .filter(*activity_log_filters(**filters))
+            .order_by(database.AuditLog.timestamp, database.AuditLog.id)
+        )
+        async for rows in result.partitions(EXPORT_BATCH_SIZE):
+            yield rows
+
+
+async def export_activity_logs(export_format="ndjson", compress=False, **filters):
+    '''
+    Encode the streamed activity logs as NDJSON or CSV, optionally gzip compressed
+    '''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def encode(chunk):
+        data = chunk.encode()
+        return compressor.compress(data) if compressor else data
+
+    if export_format == "csv":
+        yield encode(",".join(EXPORT_COLUMNS) + "\r\n")
+    async for rows in stream_activity_logs(**filters):
+        buffer = io.StringIO()
+        if export_format == "csv":
+            writer = csv.writer(buffer)
+            writer.writerows(tuple(row) for row in rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str))
+                buffer.write("\n")
+        chunk = encode(buffer.getvalue())
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
\ No newline at end of file
@@ -1,51 +1,51 @@
 from passlib.context import CryptContext
 import utils.database as database
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 from utils.exceptions import *
 import json
 from functools import wraps
 from datetime import datetime
 from .authentication import LoginHandler
-from .service import audit_log
+from .service import audit_log, commit_with_audit, publish_permission_change, revoke_sessions
 import os
+from logger import logger
 
 
-config = json.loads(os.getenv('DB_CONNECTION_STRING', {}))
-db = database.DatabaseResource(config)
+db = database.get_database()
 
 
 class UserManagement():
     def __init__(self):
         pass
 
-    def list_all_users(self):
+    async def list_all_users(self):
         '''
         Fetch all users from database 
         Only specific columns will be fetched to hide sensitive info such as hashed passwords
         '''
-        with db.session() as conn:
-            data = conn.query(database.User).with_entities(database.User.id,database.User.name,database.User.email,database.User.created_on,database.User.created_by).all()
-            print("test>>>",data)
-            return data
+        async with db.async_session() as conn:
+            result = await conn.execute(select(database.User.id,database.User.name,database.User.email,database.User.created_on,database.User.created_by))
+            return [dict(row._mapping) for row in result.all()]
         
-    def create_user(self,data,auth_data):
+    async def create_user(self,data,auth_data):
         '''
         Create new user in our database 
         '''
-        
-        with db.session() as conn:
+        # Hashed before a connection is checked out, bcrypt must not hold a pooled connection
+        login_handler = LoginHandler()
+        hashed_password = await login_handler.hash_password(data.password)
+
+        async with db.async_session() as conn:
             # Check if user exists in our database already
-            user_exists = conn.query(database.User).filter(database.User.email == data.user_email).first()
+            user_exists = await conn.scalar(select(database.User).filter(database.User.email == data.user_email))
             if user_exists:
                 raise Error(status_code=400,details = "User already exists!")
             
             # Check if requested role is present or not
-            role_exists = conn.query(database.Role).filter(database.Role.name == data.role).first()
+            role_exists = await conn.scalar(select(database.Role).filter(database.Role.name == data.role))
             if not role_exists:
                 raise Error(status_code=400, details="Requested role does not exist!")
-            
-            # Use common function and hash the users password
-            login_handler = LoginHandler()
-            hashed_password = login_handler.hash_password(data.password)
 
             # Create entry in users table
             user_entry = database.User(
@@ -58,7 +58,7 @@ class UserManagement():
                 updated_by = auth_data["user_email"]
             )
             conn.add(user_entry)
-            conn.flush()
+            await conn.flush()
             
             # Create entry in user_role_map to map user to requested role
             user_role_map_entry = database.UserRoleMap(
@@ -86,36 +86,42 @@ class UserManagement():
                 "updated_by": user_entry.updated_by
             }
             conn.add(user_role_map_entry)
-            conn.add(audit_entry)
-            conn.commit()
+            await commit_with_audit(conn, [audit_entry])
             
             return data
         
-    def modify_user(self, data, auth_data):
+    async def modify_user(self, data, auth_data):
         '''
         Modify a user in our database
         '''
         user_email = data.user_email
-        with db.session() as conn:
+        # Hashed before a connection is checked out, bcrypt must not hold a pooled connection
+        hashed_password = None
+        if data.password:
+            login_handler = LoginHandler()
+            hashed_password = await login_handler.hash_password(data.password)
+
+        async with db.async_session() as conn:
             # Check if user exists in our database
-            user_exists = conn.query(database.User).filter(database.User.email == user_email).first()
+            user_exists = await conn.scalar(select(database.User).filter(database.User.email == user_email))
             if not user_exists:
                 raise Error(status_code=400, details="User does not exist!")
 
             # Update the user entry
             if data.user_name:
                 user_exists.name = data.user_name
+            role_changed = False
             if data.role:
-                role_exists = conn.query(database.Role).filter(database.Role.name == data.role).first()
+                role_exists = await conn.scalar(select(database.Role).filter(database.Role.name == data.role))
                 if not role_exists:
                     raise Error(status_code=400, details="Requested role does not exist!")
                 # Update the user_role_map entry for this user
-                user_role_map_exists = conn.query(database.UserRoleMap).filter(database.UserRoleMap.user_id == user_exists.id).first()
-                if user_role_map_exists:
+                user_role_map_exists = await conn.scalar(select(database.UserRoleMap).filter(database.UserRoleMap.user_id == user_exists.id))
+                # Sessions and tokens are only refreshed when the user really gets another role
+                if user_role_map_exists and user_role_map_exists.role_id != role_exists.id:
                     user_role_map_exists.role_id = role_exists.id
-            if data.password:
-                login_handler = LoginHandler()
-                hashed_password = login_handler.hash_password(data.password)
+                    role_changed = True
+            if hashed_password:
                 user_exists.hashed_password = hashed_password
 
             # Update timestamps and updated_by field
@@ -129,30 +135,38 @@ class UserManagement():
                       entity_id=user_exists.id,
                       details=f"User {user_exists.name} modified by {auth_data['user_email']}", conn=conn)
 
-            conn.add(audit_entry)
-            conn.commit()
-            return {"message": "User modified successfully!"}
+            await commit_with_audit(conn, [audit_entry])
+            user_id = user_exists.id
+
+        if role_changed:
+            # The change is committed, a failed broadcast leaves the sessions to their TTL
+            try:
+                await publish_permission_change(user_id=user_id)
+            except Exception as e:
+                logger.error(f"Failed to publish the role change of user {user_id}: {e}")
+        return {"message": "User modified successfully!"}
         
-    def delete_user(self, data, auth_data):
+    async def delete_user(self, data, auth_data):
         '''
         Delete a user from our database
         '''
         user_email = data.user_email
         if user_email == auth_data["user_email"]:
             raise Error(status_code=400, details="You cannot delete your own account!")
-        with db.session() as conn:
+        async with db.async_session() as conn:
             # Check if user exists in our database
-            user_exists = conn.query(database.User).filter(database.User.email == user_email).first()
+            # role_links is loaded up front since the delete cascades to it
+            user_exists = await conn.scalar(select(database.User).options(selectinload(database.User.role_links)).filter(database.User.email == user_email))
             if not user_exists:
                 raise Error(status_code=400, details="User does not exist!")
 
             # Delete the user_role_map entry for this user
-            user_role_map_exists = conn.query(database.UserRoleMap).filter(database.UserRoleMap.user_id == user_exists.id).first()
+            user_role_map_exists = await conn.scalar(select(database.UserRoleMap).filter(database.UserRoleMap.user_id == user_exists.id))
             if user_role_map_exists:
-                conn.delete(user_role_map_exists)
+                await conn.delete(user_role_map_exists)
 
             # Delete the user entry
-            conn.delete(user_exists)
+            await conn.delete(user_exists)
             
             # Audit log for user deletion
             audit_entry = audit_log(user_id=auth_data["user_id"],
@@ -161,6 +175,13 @@ class UserManagement():
                       entity_id=user_exists.id,
                       details=f"User {user_exists.name} deleted by {auth_data['user_email']}", conn=conn)
             
-            conn.add(audit_entry)
-            conn.commit()
-            return {"message": "User deleted successfully!"}
\ No newline at end of file
+            user_id = user_exists.id
+            await commit_with_audit(conn, [audit_entry])
+
+        # The user is deleted, a failed revocation leaves the sessions to their TTL
+        try:
+            await revoke_sessions([user_email])
+            await publish_permission_change(user_id=user_id)
+        except Exception as e:
+            logger.error(f"Failed to revoke the sessions of deleted user {user_email}: {e}")
+        return {"message": "User deleted successfully!"}
\ No newline at end of file
@@ -0,0 +1,10 @@
+'''
+End to end load tests of main:app
+
+The app runs in process against a SQLite file (or a local MySQL) and an in-process fake redis,
+requests are driven through the ASGI interface so no server or network is involved.
+
+Usage:
+    python -m benchmarks.run --concurrency 20 --duration 30 --output base.json
+    python -m benchmarks.compare base.json new.json
+'''
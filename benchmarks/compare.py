@@ -0,0 +1,95 @@
+'''
+Compare two benchmark reports and flag regressions
+
+    python -m benchmarks.compare base.json new.json [--latency-threshold 0.10] [--throughput-threshold 0.10]
+
+A route regresses when its p95 or p99 latency grows, or its throughput drops, by more than the threshold,
+or when its error rate grows by more than --error-threshold. Exits with 1 if any route regressed.
+'''
+import argparse
+import json
+import sys
+
+
+def relative_change(base, new):
+    if not base:
+        return 0.0
+    return (new - base) / base
+
+
+def compare(base, new, latency_threshold, throughput_threshold, error_threshold):
+    '''
+    Returns one row per route of either report and whether anything regressed
+    '''
+    rows = []
+    regressed = False
+    for route in sorted(set(base["routes"]) | set(new["routes"])):
+        before = base["routes"].get(route)
+        after = new["routes"].get(route)
+        if before is None or after is None:
+            rows.append({"route": route, "status": "only in base" if after is None else "only in new", "reasons": []})
+            continue
+
+        reasons = []
+        changes = {
+            "p50": relative_change(before["latency_ms"]["p50"], after["latency_ms"]["p50"]),
+            "p95": relative_change(before["latency_ms"]["p95"], after["latency_ms"]["p95"]),
+            "p99": relative_change(before["latency_ms"]["p99"], after["latency_ms"]["p99"]),
+            "throughput": relative_change(before["throughput_rps"], after["throughput_rps"]),
+            "error_rate": after["error_rate"] - before["error_rate"],
+        }
+        for key in ("p95", "p99"):
+            if changes[key] > latency_threshold:
+                reasons.append(f"{key} latency +{changes[key]:.0%}")
+        if -changes["throughput"] > throughput_threshold:
+            reasons.append(f"throughput {changes['throughput']:.0%}")
+        if changes["error_rate"] > error_threshold:
+            reasons.append(f"error rate +{changes['error_rate']:.2%}")
+        regressed = regressed or bool(reasons)
+        rows.append({"route": route, "status": "REGRESSION" if reasons else "ok", "reasons": reasons, "changes": changes,
+                     "base": before, "new": after})
+    return rows, regressed
+
+
+def print_table(rows, base, new):
+    print(f"base: {base['meta'].get('revision')} ({base['meta']['mix']}, concurrency {base['meta']['concurrency']})")
+    print(f"new:  {new['meta'].get('revision')} ({new['meta']['mix']}, concurrency {new['meta']['concurrency']})")
+    for key in ("mix", "concurrency", "database", "redis", "cameras"):
+        if base["meta"].get(key) != new["meta"].get(key):
+            print(f"warning: the runs differ in {key}, results are not comparable")
+    print()
+    print(f"{'route':<45} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'req/s':>16} {'errors':>14}  status")
+    for row in rows:
+        if "changes" not in row:
+            print(f"{row['route']:<45} {row['status']}")
+            continue
+        before, after = row["base"], row["new"]
+        cells = [f"{before['latency_ms'][key]:.1f}>{after['latency_ms'][key]:.1f}" for key in ("p50", "p95", "p99")]
+        cells.append(f"{before['throughput_rps']:.1f}>{after['throughput_rps']:.1f}")
+        cells.append(f"{before['error_rate']:.1%}>{after['error_rate']:.1%}")
+        status = row["status"] + (f" ({', '.join(row['reasons'])})" if row["reasons"] else "")
+        print(f"{row['route']:<45} {cells[0]:>16} {cells[1]:>16} {cells[2]:>16} {cells[3]:>16} {cells[4]:>14}  {status}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description="Compare two benchmark reports")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--latency-threshold", type=float, default=0.10, help="Allowed relative growth of p95/p99")
+    parser.add_argument("--throughput-threshold", type=float, default=0.10, help="Allowed relative drop of throughput")
+    parser.add_argument("--error-threshold", type=float, default=0.01, help="Allowed absolute growth of the error rate")
+    parser.add_argument("--json", action="store_true", help="Print the comparison as JSON")
+    options = parser.parse_args(argv)
+
+    with open(options.base) as base_file, open(options.new) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+    rows, regressed = compare(base, new, options.latency_threshold, options.throughput_threshold, options.error_threshold)
+    if options.json:
+        print(json.dumps({"regressed": regressed, "routes": rows}, indent=2))
+    else:
+        print_table(rows, base, new)
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
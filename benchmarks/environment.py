@@ -0,0 +1,129 @@
+'''
+Environment and seed data for the benchmarks
+'''
+from datetime import date, datetime, timedelta
+import json
+import os
+import random
+
+PASSWORD = "BenchPassword1"
+SUPERADMIN_EMAIL = "bench-superadmin@example.com"
+SUPERVISOR_EMAIL = "bench-supervisor@example.com"
+ASSIGN_CAMERA_PREFIX = "bench-assign-"
+
+# Same permissions as the seed in sql/001_init_schema.sql
+ROLE_PERMISSIONS = {
+    "superadmin": (1, ["CREATE_CAMERA", "EDIT_CAMERA", "DELETE_CAMERA", "VIEW_CAMERA", "ASSIGN_CAMERA",
+                       "VIEW_ALL_USERS", "CREATE_USER", "EDIT_USER", "DELETE_USER", "VIEW_ACTIVITY_LOGS"]),
+    "branchadmin": (2, ["CREATE_CAMERA", "EDIT_CAMERA", "DELETE_CAMERA", "VIEW_CAMERA"]),
+    "supervisor": (3, ["VIEW_CAMERA"]),
+}
+
+
+def configure(workdir, database=None, redis=None):
+    '''
+    Set the environment main:app reads at import time, so this runs before main is imported
+    database and redis are DB_CONNECTION_STRING / REDIS_CONNECTION_STRING style dicts,
+    by default a fresh SQLite file in workdir and an in-process fake redis
+    '''
+    if database is None:
+        path = os.path.join(workdir, "benchmark.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        database = {"dialect": "sqlite", "db_name": path}
+    os.environ["DB_CONNECTION_STRING"] = json.dumps(database)
+    if redis is not None:
+        os.environ["REDIS_CONNECTION_STRING"] = json.dumps(redis)
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+    os.environ.setdefault("ALGORITHIM", "HS256")
+    os.environ.setdefault("SUPERADMIN_RANK", "1")
+    os.environ["AUDIT_RETENTION"] = json.dumps({"enabled": False})
+    return database
+
+
+def use_fake_redis():
+    from fakeredis import FakeAsyncRedis
+    from utils.cache import use_redis
+
+    use_redis(FakeAsyncRedis(decode_responses=True))
+
+
+def seed(db, cameras, supervisor_cameras, workers, audit_logs, rng_seed=0):
+    '''
+    Create the schema and the benchmark users, cameras, assignments and audit logs
+    Every worker gets its own camera for the assign/deassign cycle so workers never conflict
+    '''
+    # Imported here since models need the environment set up by configure
+    import utils.database as database
+    from sqlalchemy import insert, select
+    from utils.hashing import _hash
+
+    database.Base.metadata.create_all(db.engine)
+    if db.engine.dialect.name == "sqlite":
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+    today = date.today()
+    audit = {"created_by": "BENCHMARK", "created_on": today, "updated_by": "BENCHMARK", "updated_on": today}
+    rng = random.Random(rng_seed)
+    with db.session() as conn:
+        if conn.scalar(select(database.User.id).filter(database.User.email == SUPERADMIN_EMAIL)):
+            raise RuntimeError("Database is already seeded, benchmarks need a fresh database")
+
+        permission_names = sorted({name for _, names in ROLE_PERMISSIONS.values() for name in names})
+        for name in permission_names:
+            if not conn.scalar(select(database.Permission.id).filter(database.Permission.permission_name == name)):
+                conn.add(database.Permission(permission_name=name, **audit))
+        for name, (rank, _) in ROLE_PERMISSIONS.items():
+            if not conn.scalar(select(database.Role.id).filter(database.Role.name == name)):
+                conn.add(database.Role(name=name, rank=rank, **audit))
+        conn.flush()
+        permission_ids = dict(conn.execute(select(database.Permission.permission_name, database.Permission.id)).all())
+        role_ids = dict(conn.execute(select(database.Role.name, database.Role.id)).all())
+        existing_links = set(conn.execute(select(database.RolePermissionMap.role_id, database.RolePermissionMap.permission_id)).all())
+        for name, (_, names) in ROLE_PERMISSIONS.items():
+            for permission in names:
+                if (role_ids[name], permission_ids[permission]) not in existing_links:
+                    conn.add(database.RolePermissionMap(role_id=role_ids[name], permission_id=permission_ids[permission], **audit))
+
+        hashed_password = _hash(PASSWORD)
+        users = {}
+        for email, role in ((SUPERADMIN_EMAIL, "superadmin"), (SUPERVISOR_EMAIL, "supervisor")):
+            user = database.User(name=email.split("@")[0], email=email, hashed_password=hashed_password, **audit)
+            conn.add(user)
+            conn.flush()
+            conn.add(database.UserRoleMap(role_id=role_ids[role], user_id=user.id, **audit))
+            users[role] = user.id
+
+        camera_rows = [{
+            "device_name": f"bench-camera-{number:06d}",
+            "device_ip": f"10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}",
+            "device_location": f"site-{number % 20:02d}",
+            **audit
+        } for number in range(cameras)]
+        camera_rows += [{
+            "device_name": f"{ASSIGN_CAMERA_PREFIX}{worker:04d}",
+            "device_ip": "10.255.255.1",
+            "device_location": "assign-cycle",
+            **audit
+        } for worker in range(workers)]
+        conn.execute(insert(database.Camera), camera_rows)
+        camera_ids = conn.execute(select(database.Camera.id).order_by(database.Camera.id)).scalars().all()
+
+        # The superadmin created every camera, the supervisor sees a subset
+        assignment_rows = [{"camera_id": camera_id, "user_id": users["superadmin"], "assigned_by": users["superadmin"], **audit} for camera_id in camera_ids]
+        assignment_rows += [{"camera_id": camera_id, "user_id": users["supervisor"], "assigned_by": users["superadmin"], **audit}
+                            for camera_id in rng.sample(camera_ids[:cameras], min(supervisor_cameras, cameras))]
+        conn.execute(insert(database.CameraAssignmentMap), assignment_rows)
+
+        now = datetime.utcnow()
+        conn.execute(insert(database.AuditLog), [{
+            "user_id": users["superadmin"],
+            "action": rng.choice(["CREATE_CAMERA", "ASSIGN_CAMERA", "EDIT_CAMERA", "CREATE_USER"]),
+            "entity_type": "Camera",
+            "entity_id": rng.choice(camera_ids),
+            "details": "Seeded by the benchmarks",
+            "timestamp": now - timedelta(seconds=number * 60)
+        } for number in range(audit_logs)])
+        conn.commit()
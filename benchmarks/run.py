@@ -0,0 +1,172 @@
+'''
+Run a benchmark and write the report as JSON
+
+    python -m benchmarks.run [--mix mixed] [--concurrency 20] [--duration 30] [--output report.json]
+
+--database takes a DB_CONNECTION_STRING style JSON to run against a local MySQL instead of SQLite,
+--redis a REDIS_CONNECTION_STRING style JSON to use a real redis instead of the in-process fake
+'''
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import environment
+from benchmarks.scenarios import MIXES, OPERATIONS, Session, login
+
+
+def percentile(sorted_values, fraction):
+    '''
+    Nearest rank percentile of an already sorted list
+    '''
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    routes = {}
+    for route, status, seconds in samples:
+        routes.setdefault(route, []).append((status, seconds))
+
+    report = {}
+    for route, results in sorted(routes.items()):
+        latencies = sorted(seconds for _, seconds in results)
+        errors = {}
+        for status, _ in results:
+            # 304 is the expected answer of a conditional request
+            if not isinstance(status, int) or status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+        report[route] = {
+            "requests": len(results),
+            "throughput_rps": len(results) / elapsed,
+            "error_rate": sum(errors.values()) / len(results),
+            "errors": errors,
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies) * 1000,
+                "p50": percentile(latencies, 0.50) * 1000,
+                "p95": percentile(latencies, 0.95) * 1000,
+                "p99": percentile(latencies, 0.99) * 1000,
+                "max": latencies[-1] * 1000,
+            },
+        }
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+async def worker(number, client, tokens, options, deadline, samples):
+    rng = random.Random(options.seed * 1000 + number)
+    session = Session(number, rng, tokens, options.login_burst)
+    mix = MIXES[options.mix]
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.perf_counter() < deadline:
+        samples.extend(await OPERATIONS[rng.choices(names, weights)[0]](client, session))
+
+
+async def run(options):
+    import httpx
+    import utils.database as database
+    from main import app
+
+    db = database.get_database()
+    environment.seed(db, options.cameras, options.supervisor_cameras, options.concurrency, options.audit_logs, options.seed)
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            tokens = {
+                "superadmin": await login(client, environment.SUPERADMIN_EMAIL),
+                "supervisor": await login(client, environment.SUPERVISOR_EMAIL),
+            }
+            if options.warmup:
+                await asyncio.gather(*[worker(number, client, tokens, options, time.perf_counter() + options.warmup, [])
+                                       for number in range(options.concurrency)])
+
+            samples = []
+            start = time.perf_counter()
+            deadline = start + options.duration
+            await asyncio.gather(*[worker(number, client, tokens, options, deadline, samples)
+                                   for number in range(options.concurrency)])
+            elapsed = time.perf_counter() - start
+    finally:
+        await app.router.shutdown()
+
+    errors = sum(1 for _, status, _ in samples if not isinstance(status, int) or status >= 400)
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "database": db.engine.dialect.name,
+            "redis": "real" if options.redis else "fake",
+            "mix": options.mix,
+            "concurrency": options.concurrency,
+            "duration_seconds": elapsed,
+            "seed": options.seed,
+            "cameras": options.cameras,
+            "supervisor_cameras": options.supervisor_cameras,
+            "audit_logs": options.audit_logs,
+        },
+        "total": {
+            "requests": len(samples),
+            "throughput_rps": len(samples) / elapsed,
+            "error_rate": errors / len(samples) if samples else 0.0,
+        },
+        "routes": summarize(samples, elapsed),
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="End to end load test of main:app")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent virtual clients")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds before the run")
+    parser.add_argument("--login-burst", type=int, default=10, help="Concurrent logins per burst")
+    parser.add_argument("--cameras", type=int, default=2000)
+    parser.add_argument("--supervisor-cameras", type=int, default=200)
+    parser.add_argument("--audit-logs", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the data and of the request mix")
+    parser.add_argument("--database", type=json.loads, default=None, help="DB_CONNECTION_STRING style JSON, default is a fresh SQLite file")
+    parser.add_argument("--redis", type=json.loads, default=None, help="REDIS_CONNECTION_STRING style JSON, default is an in-process fake redis")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "cctv-benchmark"))
+    parser.add_argument("--output", help="Write the report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    options = parse_args(argv)
+    os.makedirs(options.workdir, exist_ok=True)
+    # The app reads its configuration at import time
+    environment.configure(options.workdir, database=options.database, redis=options.redis)
+    if options.redis is None:
+        environment.use_fake_redis()
+
+    report = asyncio.run(run(options))
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as report_file:
+            report_file.write(output + "\n")
+        print(f"{report['total']['requests']} requests, {report['total']['throughput_rps']:.1f} req/s, report written to {options.output}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
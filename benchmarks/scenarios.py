@@ -0,0 +1,130 @@
+'''
+Request mixes driven by the benchmark workers
+
+Every operation is an async function (client, session) which returns a list of (route, status, seconds),
+most operations send one request, bursts and cycles send several
+'''
+import asyncio
+import time
+
+from benchmarks.environment import PASSWORD, SUPERADMIN_EMAIL, SUPERVISOR_EMAIL, ASSIGN_CAMERA_PREFIX
+
+
+class Session():
+    '''
+    State of one benchmark worker
+    '''
+    def __init__(self, worker, rng, tokens, login_burst):
+        self.worker = worker
+        self.rng = rng
+        self.tokens = tokens
+        self.login_burst = login_burst
+        self.etags = {}
+        self.assign_camera = f"{ASSIGN_CAMERA_PREFIX}{worker:04d}"
+
+
+async def timed(route, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+        status = response.status_code
+    except Exception as e:
+        response, status = None, type(e).__name__
+    return response, (route, status, time.perf_counter() - start)
+
+
+async def login(client, email):
+    response = await client.post("/v1/login", json={"email": email, "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()["responseData"]["access_token"]
+
+
+async def login_burst(client, session):
+    '''
+    Many users logging in at the same moment, e.g. at shift change
+    '''
+    emails = [SUPERADMIN_EMAIL, SUPERVISOR_EMAIL]
+    results = await asyncio.gather(*[
+        timed("POST /v1/login", client.post("/v1/login", json={"email": emails[number % 2], "password": PASSWORD}))
+        for number in range(session.login_burst)
+    ])
+    return [sample for _, sample in results]
+
+
+async def users_me(client, session):
+    _, sample = await timed("GET /v1/users/me", client.get("/v1/users/me", headers={"token": session.tokens["supervisor"]}))
+    return [sample]
+
+
+async def cameras(client, session, role, conditional=False):
+    '''
+    A page of the camera list, conditional requests replay the last ETag like a polling wall display
+    '''
+    headers = {"token": session.tokens[role]}
+    params = {"limit": 100}
+    if role == "superadmin" and session.rng.random() < 0.5:
+        params["location"] = f"site-{session.rng.randrange(20):02d}"
+    key = (role, params.get("location"))
+    if conditional and key in session.etags:
+        headers["If-None-Match"] = session.etags[key]
+    route = f"GET /v1/camera {role}{' conditional' if conditional else ''}"
+    response, sample = await timed(route, client.get("/v1/camera", params=params, headers=headers))
+    if response is not None and response.headers.get("etag"):
+        session.etags[key] = response.headers["etag"]
+    return [sample]
+
+
+async def assign_cycle(client, session):
+    '''
+    Assign the worker's own camera to the supervisor and take it away again
+    '''
+    headers = {"token": session.tokens["superadmin"]}
+    data = {"device_name": session.assign_camera, "user_email": SUPERVISOR_EMAIL}
+    _, assign = await timed("POST /v1/camera/assign", client.post("/v1/camera/assign", json=data, headers=headers))
+    _, deassign = await timed("POST /v1/camera/deassign", client.post("/v1/camera/deassign", json=data, headers=headers))
+    return [assign, deassign]
+
+
+async def activity(client, session):
+    headers = {"token": session.tokens["superadmin"]}
+    params = {"limit": 100}
+    if session.rng.random() < 0.3:
+        params["action"] = session.rng.choice(["CREATE_CAMERA", "ASSIGN_CAMERA", "EDIT_CAMERA"])
+    _, sample = await timed("GET /v1/activity", client.get("/v1/activity", params=params, headers=headers))
+    return [sample]
+
+
+OPERATIONS = {
+    "login_burst": login_burst,
+    "users_me": users_me,
+    "cameras_superadmin": lambda client, session: cameras(client, session, "superadmin"),
+    "cameras_supervisor": lambda client, session: cameras(client, session, "supervisor"),
+    "cameras_supervisor_conditional": lambda client, session: cameras(client, session, "supervisor", conditional=True),
+    "assign_cycle": assign_cycle,
+    "activity": activity,
+}
+
+# Relative weights of the operations in each mix
+MIXES = {
+    "mixed": {
+        "login_burst": 1,
+        "users_me": 20,
+        "cameras_superadmin": 15,
+        "cameras_supervisor": 20,
+        "cameras_supervisor_conditional": 25,
+        "assign_cycle": 5,
+        "activity": 10,
+    },
+    "read": {
+        "users_me": 30,
+        "cameras_superadmin": 30,
+        "cameras_supervisor": 30,
+        "activity": 10,
+    },
+    "login": {
+        "login_burst": 1,
+    },
+    "write": {
+        "assign_cycle": 1,
+    },
+}
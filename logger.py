@@ -1,17 +1,137 @@
 # logger.py
+'''
+Application logging
+
+Records are put on a bounded queue by a QueueHandler and written to stdout by a QueueListener thread,
+so a slow stdout never blocks the event loop. When the queue is full new records are dropped and counted.
+Every record carries the id of the request it was logged in (see middleware.RequestContext).
+The uvicorn server and access loggers write through the same queue.
+
+Configured through LOGGING, e.g.
+{"level": "INFO", "format": "json", "levels": {"sqlalchemy.engine": "WARNING"}, "sample_rates": {"auth_success": 0.01}}
+
+High frequency events are logged with extra={"sample": "<name>"}, only a sample_rates[name] fraction of them
+is kept and the kept records carry the rate so counts can be scaled back up.
+'''
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+
+LOGGING_DEFAULTS = {
+    "level": "INFO",
+    "format": "json",
+    "levels": {},
+    "sample_rates": {},
+    "max_queue": 10000,
+}
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(request_id)s] %(message)s"
+# uvicorn configures its loggers with their own stream handlers before it imports the app, they are replaced
+# (uvicorn.error propagates to uvicorn)
+SERVER_LOGGERS = ("uvicorn", "uvicorn.access")
+
+# Id of the request being handled, set per request by the RequestContext middleware
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+class ContextFilter(logging.Filter):
+    '''
+    Adds the request id and drops the unsampled share of sampled records
+    Runs in the thread which logs the record, before it is queued, so it sees the request's context variables
+    '''
+    def __init__(self, sample_rates):
+        super().__init__()
+        self.sample_rates = sample_rates
+
+    def filter(self, record):
+        sample = getattr(record, "sample", None)
+        if sample is not None:
+            rate = self.sample_rates.get(sample, 1.0)
+            if rate < 1.0:
+                if random.random() >= rate:
+                    return False
+                # Only records of a sampled event carry the rate, the rest are all kept
+                record.sample_rate = rate
+        record.request_id = request_id.get()
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler which drops records instead of blocking or raising when the queue is full
+    '''
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format message and traceback here, the arguments may change before the listener gets to them
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    One JSON object per line
+    '''
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if getattr(record, "sample_rate", None) is not None:
+            entry["sample_rate"] = record.sample_rate
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(config):
+    options = {key: config.get(key, default) for key, default in LOGGING_DEFAULTS.items()}
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if options["format"] == "json" else logging.Formatter(TEXT_FORMAT))
 
-# Create logger
-logger = logging.getLogger("app_logger")
-logger.setLevel(logging.DEBUG)
+    queue_handler = DroppingQueueHandler(queue.Queue(int(options["max_queue"])))
+    queue_handler.addFilter(ContextFilter({name: float(rate) for name, rate in options["sample_rates"].items()}))
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Records still queued are written on exit
+    atexit.register(listener.stop)
 
-# Create console handler
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
+    app_logger = logging.getLogger("app_logger")
+    app_logger.setLevel(options["level"])
+    app_logger.addHandler(queue_handler)
+    app_logger.propagate = False
+    for name in SERVER_LOGGERS:
+        server_logger = logging.getLogger(name)
+        server_logger.handlers = [queue_handler]
+        server_logger.propagate = False
+    for name, level in options["levels"].items():
+        logging.getLogger(name).setLevel(level)
+    return app_logger, queue_handler
 
-# Create formatter and add to handler
-formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s")
-ch.setFormatter(formatter)
 
-# Add handler to logger
-logger.addHandler(ch)
+logger, log_handler = setup_logging(json.loads(os.getenv('LOGGING', '{}')))
@@ -1,21 +1,66 @@
 from fastapi import FastAPI,Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from utils.exceptions import *
 from application.api.v1 import v1
 import datetime
+import os
 from logger import logger
+from utils.cache import close_redis, subscriber
+from utils.hashing import hashing_pool
+from utils.database import dispose_all
+from application.audit_writer import audit_writer
+from application.retention import audit_retention
+from application.camera_status import camera_status_poller
+from application.camera_management import BULK_IMPORT_MAX_BYTES
+from utils.metrics import ERRORS, metrics_sampler, render_metrics
 
 
-# from middleware import Middle
+from middleware import Middle, RequestContext, Compression, BodyLimit
 
-app = FastAPI(title="CCTV Management App", version="1.0.0", description="CCTV Application API")
+# Responses smaller than this are not worth compressing
+GZIP_MINIMUM_SIZE = int(os.getenv('GZIP_MINIMUM_SIZE', 1000))
+
+app = FastAPI(title="CCTV Management App", version="1.0.0", description="CCTV Application API", default_response_class=ORJSONResponse)
+app.add_middleware(Compression, minimum_size=GZIP_MINIMUM_SIZE)
+app.add_middleware(Middle)
+app.add_middleware(BodyLimit, limits={path: BULK_IMPORT_MAX_BYTES for path in ("/v1/camera/bulk", "/v1/camera/bulk/csv")})
+# Added last so it is the outermost middleware and the request id is set for everything below
+app.add_middleware(RequestContext)
 
 
 
 @app.exception_handler(Error)
 async def exceptionHandler(request: Request, exc:Error):
+    ERRORS.labels(str(exc.status_code)).inc()
     error = {"responseData": {"message": "FAILURE", "reason": exc.details}}
-    return JSONResponse(status_code=exc.status_code,content=error)
+    return ORJSONResponse(status_code=exc.status_code,content=error)
+
+
+@app.on_event("startup")
+async def startup():
+    subscriber.start()
+    metrics_sampler.start()
+    audit_writer.start()
+    audit_retention.start()
+    camera_status_poller.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await subscriber.stop()
+    await audit_retention.stop()
+    await camera_status_poller.stop()
+    # Pending audit entries are flushed before the engines are disposed
+    await audit_writer.stop()
+    await close_redis()
+    hashing_pool.shutdown()
+    await dispose_all()
+    await metrics_sampler.stop()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return render_metrics()
 
 
 app.include_router(v1, prefix="/v1")
\ No newline at end of file
@@ -0,0 +1,319 @@
+'''
+Opt-in sampling profiler for single requests
+
+A request is profiled when it carries the header X-Profile-Token with the configured token, or when it is
+picked by sample_rate. While at least one request is profiled a background thread samples the stack of the
+request's task every interval_ms. Time the request spends awaiting the database, redis or anything else is
+sampled too, as the suspended coroutine chain ending in an "<await ...>" frame.
+
+Every profile is written to output_dir in the folded stack format ("frame;frame;frame count" per line)
+which flamegraph.pl, speedscope and inferno read directly.
+
+Configured through PROFILER, e.g. {"enabled": true, "token": "...", "sample_rate": 0.001}
+'''
+import asyncio
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder
+from starlette.responses import JSONResponse
+
+from logger import logger, request_id
+from utils.metrics import ERRORS
+
+
+PROFILER_DEFAULTS = {
+    "enabled": False,
+    "token": "",
+    "sample_rate": 0.0,
+    "interval_ms": 5,
+    "max_concurrent": 4,
+    "output_dir": "profiles",
+}
+PROFILE_HEADER = b"x-profile-token"
+REQUEST_ID_HEADER = b"x-request-id"
+CONTENT_LENGTH_HEADER = b"content-length"
+REQUEST_ID_PATTERN = re.compile(rb"^[A-Za-z0-9._-]{1,64}$")
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def frame_label(frame):
+    filename = frame.f_code.co_filename
+    if filename.startswith(ROOT):
+        filename = os.path.relpath(filename, ROOT)
+    else:
+        # Keep library frames short, e.g. sqlalchemy/engine/base.py
+        parts = filename.split(os.sep)
+        if "site-packages" in parts:
+            filename = "/".join(parts[parts.index("site-packages") + 1:])
+    # ; separates frames in the folded format
+    return f"{frame.f_code.co_name} ({filename}:{frame.f_lineno})".replace(";", ",")
+
+
+class RequestProfile:
+    def __init__(self, scope, task, frame, thread_id):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = scope.get("method", "")
+        self.path = scope.get("path", "")
+        self.task = task
+        self.frame = frame
+        self.thread_id = thread_id
+        self.samples = Counter()
+        self.start = time.perf_counter()
+
+    def sample(self, current_frame):
+        '''
+        Record the stack of the request below the middleware, running or suspended
+        Called from the sampler thread, it only reads frame and coroutine attributes
+        '''
+        chain = []
+        awaitable = self.task.get_coro()
+        running = False
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            chain.append(frame)
+            running = getattr(awaitable, "cr_running", None) or getattr(awaitable, "gi_running", False)
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+
+        if running:
+            # Running coroutines do not link to what they await, the thread's frames are the stack.
+            # Code running in a greenlet (SQLAlchemy asyncio) has its own stack which does not link back
+            frames = []
+            frame = current_frame
+            while frame is not None and frame is not self.frame:
+                frames.append(frame)
+                frame = frame.f_back
+            if frame is None:
+                return
+            stack = [frame_label(frame) for frame in reversed(frames)]
+        else:
+            if self.frame not in chain:
+                return
+            stack = [frame_label(frame) for frame in chain[chain.index(self.frame) + 1:]]
+            stack.append(f"<await {type(awaitable).__name__}>" if awaitable is not None else "<await>")
+        self.samples[";".join(stack)] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class Sampler:
+    '''
+    Background thread sampling every active profile, only runs while there is one
+    '''
+    def __init__(self, interval):
+        self.interval = interval
+        self.profiles = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self.profiles[profile.id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile):
+        with self._lock:
+            self.profiles.pop(profile.id, None)
+
+    def active(self):
+        return len(self.profiles)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                profiles = list(self.profiles.values())
+                if not profiles:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for profile in profiles:
+                try:
+                    profile.sample(frames.get(profile.thread_id))
+                except Exception:
+                    # The loop may change the coroutine chain while it is walked, the sample is skipped
+                    pass
+            del frames
+            time.sleep(self.interval)
+
+
+class Middle:
+    '''
+    ASGI middleware which profiles requests selected by the profile header or by sample_rate
+    Requests which are not profiled only pay for one header lookup and one random draw
+    '''
+    def __init__(self, app, config=None):
+        self.app = app
+        config = config if config is not None else json.loads(os.getenv('PROFILER', '{}'))
+        self.options = {key: type(default)(config.get(key, default)) for key, default in PROFILER_DEFAULTS.items()}
+        self.token = self.options["token"].encode()
+        self.sampler = Sampler(self.options["interval_ms"] / 1000)
+
+    def selected(self, scope):
+        if self.token:
+            for name, value in scope.get("headers", []):
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.token)
+        return self.options["sample_rate"] > 0 and random.random() < self.options["sample_rate"]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.options["enabled"] or not self.selected(scope):
+            return await self.app(scope, receive, send)
+        if self.sampler.active() >= self.options["max_concurrent"]:
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope, asyncio.current_task(), sys._getframe(), threading.get_ident())
+        status = {}
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        self.sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self.sampler.remove(profile)
+            duration_ms = (time.perf_counter() - profile.start) * 1000
+            await asyncio.to_thread(self.write, profile, status.get("code", 500), duration_ms)
+
+    def write(self, profile, status, duration_ms):
+        if not profile.samples:
+            return
+        try:
+            os.makedirs(self.options["output_dir"], exist_ok=True)
+            path_name = re.sub(r"[^A-Za-z0-9]+", "_", profile.path).strip("_") or "root"
+            filename = f"{time.strftime('%Y%m%dT%H%M%S')}-{profile.method}-{path_name}-{status}-{duration_ms:.0f}ms-{profile.id}.folded"
+            with open(os.path.join(self.options["output_dir"], filename), "w") as profile_file:
+                profile_file.write(profile.folded())
+            logger.info(f"Profiled {profile.method} {profile.path} in {duration_ms:.1f}ms, {sum(profile.samples.values())} samples written to {filename}")
+        except Exception as e:
+            logger.error(f"Failed to write profile of {profile.method} {profile.path}: {e}")
+
+
+class RequestContext:
+    '''
+    ASGI middleware which assigns every request an id, taken from X-Request-ID when the caller (or a proxy)
+    sent a sane one, and returns it in X-Request-ID. Log records of the request carry the id
+    '''
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        current_id = None
+        for name, value in scope.get("headers", []):
+            if name == REQUEST_ID_HEADER and REQUEST_ID_PATTERN.match(value):
+                current_id = value.decode()
+                break
+        current_id = current_id or uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(REQUEST_ID_HEADER, current_id.encode())]}
+            await send(message)
+
+        token = request_id.set(current_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id.reset(token)
+
+
+class Compression:
+    '''
+    GZipMiddleware for every response except the ones which are compressed already, which it would compress
+    a second time (starlette 0.37 only looks at Content-Encoding): e.g. exports requested with gzip=true.
+    The decision is taken on the content type of the response
+    '''
+    PRECOMPRESSED_TYPES = ("application/gzip",)
+
+    def __init__(self, app, minimum_size=1000, compresslevel=9):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            return await self.app(scope, receive, send)
+
+        responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+        responder.send = send
+        target = None
+
+        async def send_compressed(message):
+            nonlocal target
+            if message["type"] == "http.response.start":
+                content_type = Headers(raw=message["headers"]).get("content-type", "")
+                precompressed = content_type.split(";")[0].strip() in self.PRECOMPRESSED_TYPES
+                target = send if precompressed else responder.send_with_gzip
+            await target(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+class BodyLimit:
+    '''
+    ASGI middleware which caps the request body of the given paths ({path: max bytes})
+    The body is read here, a body over the limit is answered with a 413 before the app parses any of it
+    '''
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def reject(self, scope, receive, send, limit):
+        ERRORS.labels("413").inc()
+        error = {"responseData": {"message": "FAILURE", "reason": f"Request body is larger than {limit} bytes!"}}
+        await JSONResponse(error, status_code=413)(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == CONTENT_LENGTH_HEADER and value.isdigit() and int(value) > limit:
+                return await self.reject(scope, receive, send, limit)
+
+        # Chunked bodies have no length up front, they are counted while they arrive
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > limit:
+                return await self.reject(scope, receive, send, limit)
+            if not message.get("more_body", False):
+                break
+
+        body = b"".join(chunks)
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay, send)
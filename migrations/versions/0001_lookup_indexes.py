@@ -0,0 +1,24 @@
+'''Add unique lookup indexes on users, cameras, roles, permissions and camera assignments'''
+from utils.database.migrations import create_index, drop_index
+
+
+def up(conn):
+    create_index(conn, "users", "uq_users_email", ["email"], unique=True)
+    create_index(conn, "cameras", "uq_cameras_device_name", ["device_name"], unique=True)
+    create_index(conn, "roles", "uq_roles_name", ["name"], unique=True)
+    create_index(conn, "permissions", "uq_permissions_permission_name", ["permission_name"], unique=True)
+    create_index(conn, "camera_assignment_map", "uq_camera_assignment_camera_user", ["camera_id", "user_id"], unique=True)
+    create_index(conn, "camera_assignment_map", "idx_camera_assignment_user", ["user_id", "camera_id"])
+    # The unique index replaces the plain (camera_id, user_id) one
+    drop_index(conn, "camera_assignment_map", "idx_camera_assignment_camera")
+
+
+def down(conn):
+    # Recreated first since the camera_id foreign key needs an index to stay on
+    create_index(conn, "camera_assignment_map", "idx_camera_assignment_camera", ["camera_id", "user_id"])
+    drop_index(conn, "camera_assignment_map", "uq_camera_assignment_camera_user")
+    # idx_camera_assignment_user is kept since the user_id foreign key relies on it
+    drop_index(conn, "permissions", "uq_permissions_permission_name")
+    drop_index(conn, "roles", "uq_roles_name")
+    drop_index(conn, "cameras", "uq_cameras_device_name")
+    drop_index(conn, "users", "uq_users_email")
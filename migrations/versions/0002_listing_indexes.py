@@ -0,0 +1,26 @@
+'''Add the activity log and camera listing indexes to deployments created before they were in the seed'''
+from sqlalchemy import text
+from utils.database.migrations import create_index, drop_index
+
+
+def up(conn):
+    if conn.dialect.name == "mysql":
+        conn.execute(text("ALTER TABLE `audit_logs` MODIFY `timestamp` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)"))
+    create_index(conn, "audit_logs", "idx_audit_logs_timestamp", ["timestamp", "id"])
+    create_index(conn, "audit_logs", "idx_audit_logs_user", ["user_id", "timestamp", "id"])
+    create_index(conn, "audit_logs", "idx_audit_logs_action", ["action", "timestamp", "id"])
+    create_index(conn, "audit_logs", "idx_audit_logs_entity", ["entity_type", "entity_id", "timestamp", "id"])
+    create_index(conn, "cameras", "idx_cameras_location", ["device_location", "id"])
+    create_index(conn, "cameras", "idx_cameras_ip", ["device_ip"])
+
+
+def down(conn):
+    drop_index(conn, "cameras", "idx_cameras_ip")
+    drop_index(conn, "cameras", "idx_cameras_location")
+    drop_index(conn, "audit_logs", "idx_audit_logs_entity")
+    drop_index(conn, "audit_logs", "idx_audit_logs_action")
+    # idx_audit_logs_user is kept since the user_id foreign key relies on it
+    drop_index(conn, "audit_logs", "idx_audit_logs_timestamp")
+    if conn.dialect.name == "mysql":
+        # Sub-second precision of existing timestamps is lost
+        conn.execute(text("ALTER TABLE `audit_logs` MODIFY `timestamp` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP"))
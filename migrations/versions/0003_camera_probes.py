@@ -0,0 +1,12 @@
+'''Add the per camera reachability probe settings'''
+from utils.database.migrations import add_column, drop_column
+
+
+def up(conn):
+    add_column(conn, "cameras", "probe_port", "INTEGER NULL")
+    add_column(conn, "cameras", "probe_path", "VARCHAR(255) NULL")
+
+
+def down(conn):
+    drop_column(conn, "cameras", "probe_path")
+    drop_column(conn, "cameras", "probe_port")
@@ -67,6 +67,8 @@ CREATE TABLE IF NOT EXISTS `cameras` (
 	`created_on` date NOT NULL,
 	`updated_by` varchar(255) NOT NULL,
 	`updated_on` varchar(255) NOT NULL,
+	`probe_port` int,
+	`probe_path` varchar(255),
 	PRIMARY KEY (`id`)
 );
 
@@ -77,11 +79,16 @@ CREATE TABLE audit_logs (
     `entity_type` VARCHAR(100) NOT NULL,
     `entity_id` INTEGER,
     `details` TEXT,
-    `timestamp` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    `timestamp` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
     FOREIGN KEY(user_id) REFERENCES users(id),
     PRIMARY KEY(`id`)
 );
 
+CREATE INDEX `idx_audit_logs_timestamp` ON `audit_logs` (`timestamp`, `id`);
+CREATE INDEX `idx_audit_logs_user` ON `audit_logs` (`user_id`, `timestamp`, `id`);
+CREATE INDEX `idx_audit_logs_action` ON `audit_logs` (`action`, `timestamp`, `id`);
+CREATE INDEX `idx_audit_logs_entity` ON `audit_logs` (`entity_type`, `entity_id`, `timestamp`, `id`);
+
 CREATE TABLE  camera_assignment_map (
 	`id` int AUTO_INCREMENT NOT NULL UNIQUE,
 	`camera_id` int NOT NULL,
@@ -94,6 +101,16 @@ CREATE TABLE  camera_assignment_map (
 	PRIMARY KEY (`id`)
 );
 
+/* The final index set of the migrations, they find every index in place and only record their version */
+CREATE UNIQUE INDEX `uq_users_email` ON `users` (`email`);
+CREATE UNIQUE INDEX `uq_roles_name` ON `roles` (`name`);
+CREATE UNIQUE INDEX `uq_permissions_permission_name` ON `permissions` (`permission_name`);
+CREATE UNIQUE INDEX `uq_cameras_device_name` ON `cameras` (`device_name`);
+CREATE INDEX `idx_cameras_location` ON `cameras` (`device_location`, `id`);
+CREATE INDEX `idx_cameras_ip` ON `cameras` (`device_ip`);
+CREATE UNIQUE INDEX `uq_camera_assignment_camera_user` ON `camera_assignment_map` (`camera_id`, `user_id`);
+CREATE INDEX `idx_camera_assignment_user` ON `camera_assignment_map` (`user_id`, `camera_id`);
+
 ALTER TABLE `user_role_map` ADD CONSTRAINT `user_role_map_fk0` FOREIGN KEY (`role_id`) REFERENCES `roles`(`id`);
 
 ALTER TABLE `user_role_map` ADD CONSTRAINT `user_role_map_fk1` FOREIGN KEY (`user_id`) REFERENCES `users`(`id`);
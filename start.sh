@@ -5,4 +5,13 @@ set -e
 
 cd /app/cctv-app/
 
+# Samples of the previous run would be aggregated into the new one
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+# Bring the schema up to date before the workers start
+python -m utils.database.migrations upgrade
+
 uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4
\ No newline at end of file
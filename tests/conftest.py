@@ -0,0 +1,107 @@
+'''
+Shared fixtures
+
+The app runs in process against a fresh SQLite file and an in-process fake redis, seeded like the benchmarks
+(see benchmarks/environment.py). Everything runs on one event loop since the engines and the redis client are
+bound to the loop they were first used on.
+'''
+import asyncio
+import tempfile
+
+import pytest
+
+from benchmarks import environment
+
+# The app reads its configuration at import time, before any test module imports it
+WORKDIR = tempfile.mkdtemp(prefix="cctv-tests-")
+environment.configure(WORKDIR)
+environment.use_fake_redis()
+
+CAMERAS = 50
+SUPERVISOR_CAMERAS = 10
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def run(loop):
+    '''
+    Run a coroutine on the session loop
+    '''
+    return loop.run_until_complete
+
+
+@pytest.fixture(scope="session")
+def app(run):
+    import utils.database as database
+    from main import app
+
+    environment.seed(database.get_database(), CAMERAS, SUPERVISOR_CAMERAS, workers=1, audit_logs=20)
+    run(app.router.startup())
+    yield app
+    run(app.router.shutdown())
+
+
+@pytest.fixture(scope="session")
+def client(app, run):
+    import httpx
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://tests", timeout=60)
+    yield client
+    run(client.aclose())
+
+
+@pytest.fixture(scope="session")
+def tokens(client, run):
+    from benchmarks.scenarios import login
+
+    return {
+        "superadmin": run(login(client, environment.SUPERADMIN_EMAIL)),
+        "supervisor": run(login(client, environment.SUPERVISOR_EMAIL)),
+    }
+
+
+@pytest.fixture
+def make_user(app, run):
+    '''
+    Create a user with the given role and the benchmark password, returns its email
+    The users, their assignments and sessions are removed after the test
+    '''
+    from datetime import date
+    from sqlalchemy import delete, select
+    import utils.database as database
+    from utils.cache import get_redis
+
+    db = database.get_database()
+    audit = {"created_by": "TESTS", "created_on": date.today(), "updated_by": "TESTS", "updated_on": date.today()}
+    created = {}
+
+    def create(name, role="supervisor"):
+        email = f"{name}@example.com"
+        with db.session() as conn:
+            hashed_password = conn.scalar(select(database.User.hashed_password).filter(database.User.email == environment.SUPERVISOR_EMAIL))
+            role_id = conn.scalar(select(database.Role.id).filter(database.Role.name == role))
+            user = database.User(name=name, email=email, hashed_password=hashed_password, **audit)
+            conn.add(user)
+            conn.flush()
+            conn.add(database.UserRoleMap(role_id=role_id, user_id=user.id, **audit))
+            conn.commit()
+            created[email] = user.id
+        return email
+
+    yield create
+
+    with db.session() as conn:
+        user_ids = list(created.values())
+        conn.execute(delete(database.CameraAssignmentMap).filter(database.CameraAssignmentMap.user_id.in_(user_ids)))
+        conn.execute(delete(database.UserRoleMap).filter(database.UserRoleMap.user_id.in_(user_ids)))
+        conn.execute(delete(database.User).filter(database.User.id.in_(user_ids)))
+        conn.commit()
+    keys = [f"{prefix}:{email}" for email in created for prefix in ("user_token", "refresh_token")]
+    if keys:
+        run(get_redis().delete(*keys))
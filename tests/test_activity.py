@@ -0,0 +1,169 @@
+'''
+Keyset pagination and filters of the activity log listing, and the activity log export
+'''
+from datetime import datetime, timedelta
+
+import pytest
+
+ACTION = "PAGINATION_TEST"
+TIED = datetime(2024, 3, 1, 12, 0, 0)
+EARLIER = TIED - timedelta(hours=1)
+
+
+@pytest.fixture
+def logs(app):
+    '''
+    Seven logs, five of them sharing a timestamp, returns their ids latest first
+    '''
+    import utils.database as database
+    from sqlalchemy import delete
+
+    db = database.get_database()
+    with db.session() as conn:
+        added = [
+            database.AuditLog(
+                user_id=1 if index % 2 else 2, action=ACTION, entity_type="Camera" if index < 4 else "User",
+                entity_id=index, details=f"log {index}", timestamp=TIED if index < 5 else EARLIER
+            )
+            for index in range(7)
+        ]
+        conn.add_all(added)
+        conn.commit()
+        by_id = {log.id: log for log in added}
+
+    yield sorted(by_id, key=lambda log_id: (by_id[log_id].timestamp, log_id), reverse=True)
+
+    with db.session() as conn:
+        conn.execute(delete(database.AuditLog).filter(database.AuditLog.action == ACTION))
+        conn.commit()
+
+
+def activity(client, run, tokens, **params):
+    response = run(client.get("/v1/activity", params={"action": ACTION, **params}, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200, response.text
+    return response.json()["responseData"]
+
+
+def ids(page):
+    return [item["id"] for item in page["items"]]
+
+
+def test_pages_walk_tied_timestamps_without_gaps_or_duplicates(client, run, tokens, logs):
+    walked, cursor, pages = [], None, 0
+    while True:
+        page = activity(client, run, tokens, limit=2, **({"cursor": cursor} if cursor else {}))
+        walked += ids(page)
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert walked == logs
+    assert pages == 4
+
+
+def test_last_full_page_has_no_cursor(client, run, tokens, logs):
+    page = activity(client, run, tokens, limit=7)
+    assert ids(page) == logs
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "bm9waXBl"])
+def test_bad_cursor_is_rejected(client, run, tokens, cursor):
+    response = run(client.get("/v1/activity", params={"cursor": cursor}, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 400
+    assert response.json()["responseData"]["reason"] == "Invalid cursor!"
+
+
+def test_filters(client, run, tokens, logs):
+    items = activity(client, run, tokens)["items"]
+    assert len(items) == 7
+
+    assert {item["user_id"] for item in activity(client, run, tokens, user_id=1)["items"]} == {1}
+    assert len(activity(client, run, tokens, user_id=1)["items"]) == 3
+    assert len(activity(client, run, tokens, entity_type="Camera")["items"]) == 4
+    assert [item["entity_id"] for item in activity(client, run, tokens, entity_type="User", entity_id=5)["items"]] == [5]
+    assert activity(client, run, tokens, action="NO_SUCH_ACTION")["items"] == []
+
+    # since is inclusive, until is exclusive
+    assert len(activity(client, run, tokens, since=TIED.isoformat())["items"]) == 5
+    assert len(activity(client, run, tokens, until=TIED.isoformat())["items"]) == 2
+    assert len(activity(client, run, tokens, since=EARLIER.isoformat(), until=TIED.isoformat())["items"]) == 2
+
+
+def exported(client, run, tokens, **params):
+    headers = {"token": tokens["superadmin"], "accept-encoding": "gzip"}
+    response = run(client.get("/v1/activity/export", params={"action": ACTION, **params}, headers=headers))
+    assert response.status_code == 200, response.text
+    return response
+
+
+def stored():
+    '''
+    The test logs as the export encodes them, oldest first
+    '''
+    import utils.database as database
+    from sqlalchemy import select
+    from application.service import EXPORT_COLUMNS
+
+    with database.get_database().session() as conn:
+        rows = conn.execute(
+            select(*[getattr(database.AuditLog, column) for column in EXPORT_COLUMNS])
+            .filter(database.AuditLog.action == ACTION)
+            .order_by(database.AuditLog.timestamp, database.AuditLog.id)
+        ).all()
+    return [dict(zip(EXPORT_COLUMNS, row)) for row in rows]
+
+
+def test_ndjson_export(client, run, tokens, logs):
+    import json
+
+    response = exported(client, run, tokens)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert 'filename="audit_logs.ndjson"' in response.headers["content-disposition"]
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == logs[::-1]
+    assert rows == [json.loads(json.dumps(row, default=str)) for row in stored()]
+
+
+def test_csv_export(client, run, tokens, logs):
+    import csv
+    import io
+    from application.service import EXPORT_COLUMNS
+
+    response = exported(client, run, tokens, format="csv")
+    assert response.headers["content-type"].startswith("text/csv")
+    reader = csv.reader(io.StringIO(response.text))
+    assert next(reader) == EXPORT_COLUMNS
+    expected = [["" if value is None else str(value) for value in row.values()] for row in stored()]
+    assert list(reader) == expected
+
+
+@pytest.mark.parametrize("export_format", ["ndjson", "csv"])
+def test_gzip_export_decompresses_to_the_plain_export(client, run, tokens, logs, export_format):
+    import gzip
+
+    plain = exported(client, run, tokens, format=export_format).content
+    response = exported(client, run, tokens, format=export_format, gzip="true")
+    assert response.headers["content-type"] == "application/gzip"
+    assert "content-encoding" not in response.headers
+    assert f'filename="audit_logs.{export_format}.gz"' in response.headers["content-disposition"]
+    # Gzip framing, one member with a header and trailer
+    assert response.content[:2] == b"\x1f\x8b"
+    assert gzip.decompress(response.content) == plain
+
+
+def test_export_streams_in_batches(run, logs, monkeypatch):
+    import gzip
+    import json
+    import application.service as service
+
+    monkeypatch.setattr(service, "EXPORT_BATCH_SIZE", 2)
+
+    async def collect(**options):
+        return [chunk async for chunk in service.export_activity_logs(action=ACTION, **options)]
+
+    chunks = run(collect())
+    # One chunk per batch of two rows
+    assert len(chunks) == 4
+    assert [json.loads(line)["id"] for line in b"".join(chunks).splitlines()] == logs[::-1]
+    assert gzip.decompress(b"".join(run(collect(compress=True)))) == b"".join(chunks)
@@ -0,0 +1,121 @@
+'''
+Spilling, replay and quarantine of the buffered audit writer
+'''
+import asyncio
+import glob
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+MARKER = "audit-writer-test"
+
+
+@pytest.fixture
+def writer(app, tmp_path):
+    from application.audit_writer import AuditWriter
+
+    yield AuditWriter({"enabled": True, "spill_dir": str(tmp_path), "flush_interval": 0.05})
+
+    import utils.database as database
+    from sqlalchemy import delete
+
+    with database.get_database().session() as conn:
+        conn.execute(delete(database.AuditLog).filter(database.AuditLog.details.like(f"{MARKER}%")).execution_options(synchronize_session=False))
+        conn.commit()
+
+
+def rows(*names):
+    return [{
+        "user_id": 1,
+        "action": "TEST",
+        "entity_type": "Test",
+        "entity_id": None,
+        "details": f"{MARKER} {name}",
+        "timestamp": datetime(2024, 1, 1, 12, 0, 0)
+    } for name in names]
+
+
+def written():
+    import utils.database as database
+    from sqlalchemy import select
+
+    with database.get_database().session() as conn:
+        return sorted(conn.execute(select(database.AuditLog.details).filter(database.AuditLog.details.like(f"{MARKER}%"))).scalars().all())
+
+
+@pytest.fixture
+def database_down(monkeypatch):
+    '''
+    Make audit inserts fail until the returned function is called
+    '''
+    import application.service as service
+
+    async def write_audit_rows(conn, rows):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(service, "write_audit_rows", write_audit_rows)
+    return monkeypatch.undo
+
+
+def test_failed_batch_is_spilled_and_replayed(run, writer, database_down, tmp_path):
+    run(writer._flush(rows("a", "b")))
+    assert writer.spilled == 2
+    spill_files = glob.glob(str(tmp_path / "audit-spill-*.ndjson"))
+    assert len(spill_files) == 1
+    with open(spill_files[0]) as spill_file:
+        assert [json.loads(line)["details"] for line in spill_file] == [f"{MARKER} a", f"{MARKER} b"]
+
+    database_down()
+    run(writer._flush(rows("c")))
+    assert written() == [f"{MARKER} a", f"{MARKER} b", f"{MARKER} c"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_unreadable_spilled_lines_are_quarantined(run, writer, tmp_path):
+    line = json.dumps({**rows("spilled")[0], "timestamp": "2024-01-01T12:00:00"})
+    with open(writer._spill_path(), "w") as spill_file:
+        # The last line was cut off by a crash while spilling
+        spill_file.write(line + "\n" + line[:20])
+
+    run(writer._flush(rows("fresh")))
+    assert written() == [f"{MARKER} fresh", f"{MARKER} spilled"]
+    quarantined = glob.glob(str(tmp_path / "audit-quarantine-*.ndjson"))
+    assert len(quarantined) == 1
+    with open(quarantined[0]) as quarantine_file:
+        assert quarantine_file.read() == line[:20] + "\n"
+
+
+def test_spill_files_of_live_workers_are_left_alone(run, writer, tmp_path):
+    # The parent process is alive and may still append to its file
+    other = writer._spill_path(os.getppid())
+    with open(other, "w") as spill_file:
+        spill_file.write(json.dumps({**rows("other")[0], "timestamp": "2024-01-01T12:00:00"}) + "\n")
+
+    run(writer._flush(rows("own")))
+    assert written() == [f"{MARKER} own"]
+    assert os.path.exists(other)
+
+
+def test_writer_survives_a_failing_spill(run, writer, database_down, monkeypatch):
+    def write_spill(batch):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(writer, "_write_spill", write_spill)
+
+    async def scenario():
+        writer.start()
+        await writer.submit(rows("lost-0", "lost-1"))
+        for _ in range(500):
+            if writer.dropped >= 2 or writer._task.done():
+                break
+            await asyncio.sleep(0.01)
+        assert not writer._task.done()
+        database_down()
+        await writer.submit(rows("kept"))
+        await writer.stop()
+
+    run(scenario())
+    assert writer.dropped == 2
+    assert written() == [f"{MARKER} kept"]
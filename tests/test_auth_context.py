@@ -0,0 +1,79 @@
+'''
+Every request resolves and keeps its own identity, however requests of different users interleave
+'''
+import asyncio
+import random
+
+import pytest
+
+from benchmarks import environment
+
+
+@pytest.fixture
+def session_lookups(monkeypatch):
+    '''
+    Make session lookups in redis yield to other requests, returns the looked up session keys
+    '''
+    from utils.cache import get_redis
+
+    rc = get_redis()
+    get = rc.get
+    looked_up = []
+
+    async def slow_get(key, *args, **kwargs):
+        if key.startswith("user_token:"):
+            looked_up.append(key)
+            await asyncio.sleep(random.uniform(0, 0.01))
+        return await get(key, *args, **kwargs)
+
+    monkeypatch.setattr(rc, "get", slow_get)
+    return looked_up
+
+
+@pytest.mark.parametrize("auth_mode", ["session", "stateless"])
+def test_interleaved_requests_keep_their_identity(client, run, tokens, session_lookups, monkeypatch, auth_mode):
+    import application.authentication as authentication
+    from utils.cache import subscriber
+
+    monkeypatch.setattr(authentication, "AUTH_MODE", auth_mode)
+    monkeypatch.setattr(subscriber, "connected", True)
+    callers = [("superadmin", environment.SUPERADMIN_EMAIL), ("supervisor", environment.SUPERVISOR_EMAIL)] * 20
+    random.shuffle(callers)
+
+    async def whoami():
+        return await asyncio.gather(*[client.get("/v1/users/me", headers={"token": tokens[name]}) for name, _ in callers])
+
+    responses = run(whoami())
+    assert [response.status_code for response in responses] == [200] * len(callers)
+    assert [response.json()["user_email"] for response in responses] == [email for _, email in callers]
+    # Stateless tokens are validated without a session lookup
+    assert len(session_lookups) == (len(callers) if auth_mode == "session" else 0)
+
+
+def test_permission_checks_use_their_own_requests_identity(client, run, tokens, session_lookups):
+    async def listings():
+        return await asyncio.gather(*[
+            client.get("/v1/users", headers={"token": tokens[name]}) for name in ["superadmin", "supervisor"] * 10
+        ])
+
+    responses = run(listings())
+    # Only the superadmin may list users, an interleaved supervisor request must never pass as the superadmin
+    assert [response.status_code for response in responses] == [200, 400] * 10
+
+
+def test_session_is_resolved_once_per_request(client, run, tokens, session_lookups):
+    # The permission dependency and the route share the session the authentication dependency resolved
+    response = run(client.get("/v1/camera", headers={"token": tokens["supervisor"]}))
+    assert response.status_code == 200
+    assert session_lookups == [f"user_token:{environment.SUPERVISOR_EMAIL}"]
+
+
+def test_auth_data_is_kept_on_the_request(app, run, tokens):
+    from starlette.requests import Request
+    from application.authentication import LoginHandler
+
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "app": app})
+    auth_data = run(LoginHandler.authenticate(request, token=tokens["supervisor"]))
+    assert request.state.auth_data is auth_data
+    assert auth_data["user_email"] == environment.SUPERVISOR_EMAIL
+    assert request.state.token_claims["user_email"] == environment.SUPERVISOR_EMAIL
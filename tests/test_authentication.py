@@ -0,0 +1,85 @@
+'''
+Token types, revocation and the stateless fast path of the authentication dependency
+'''
+import jwt
+
+from benchmarks import environment
+
+
+def login(client, run, email, **data):
+    response = run(client.post("/v1/login", json={"email": email, **(data or {"password": environment.PASSWORD})}))
+    assert response.status_code == 200, response.text
+    return response.json()["responseData"]
+
+
+def me(client, run, token):
+    return run(client.get("/v1/users/me", headers={"token": token})).status_code
+
+
+def test_refresh_token_is_not_an_access_token(client, run, make_user):
+    email = make_user("auth-refresh")
+    tokens = login(client, run, email)
+    assert me(client, run, tokens["access_token"]) == 200
+    assert me(client, run, tokens["refresh_token"]) == 401
+
+
+def test_access_token_is_not_a_refresh_token(client, run, make_user):
+    email = make_user("auth-exchange")
+    tokens = login(client, run, email)
+
+    response = run(client.post("/v1/login", json={"email": email, "refresh_token": tokens["access_token"]}))
+    assert response.status_code == 401
+
+    refreshed = login(client, run, email, refresh_token=tokens["refresh_token"])
+    assert me(client, run, refreshed["access_token"]) == 200
+
+
+def test_revoked_user_tokens_get_401(client, run, make_user, monkeypatch):
+    import application.authentication as authentication
+    from application.service import revoke_sessions
+    from utils.cache import subscriber
+
+    monkeypatch.setattr(authentication, "AUTH_MODE", "stateless")
+    monkeypatch.setattr(subscriber, "connected", True)
+    email = make_user("auth-revoked")
+    token = login(client, run, email)["access_token"]
+    assert me(client, run, token) == 200
+
+    run(revoke_sessions([email]))
+    assert me(client, run, token) == 401
+    # Tokens issued after the revocation are valid
+    assert me(client, run, login(client, run, email)["access_token"]) == 200
+
+
+def test_logout_revokes_the_jti(client, run, make_user):
+    from application.service import token_revocations
+
+    email = make_user("auth-logout")
+    token = login(client, run, email)["access_token"]
+    response = run(client.post("/v1/logout", headers={"token": token}))
+    assert response.status_code == 200, response.text
+
+    jti = jwt.decode(token, options={"verify_signature": False})["jti"]
+    assert jti in token_revocations.tokens
+    assert me(client, run, token) == 401
+    # Logging in again creates a new session, the logged out token stays revoked
+    fresh = login(client, run, email)["access_token"]
+    assert me(client, run, fresh) == 200
+    assert me(client, run, token) == 401
+
+
+def test_stateless_path_falls_back_to_the_session_while_disconnected(client, run, make_user, monkeypatch):
+    import application.authentication as authentication
+    from utils.cache import get_redis, subscriber
+
+    monkeypatch.setattr(authentication, "AUTH_MODE", "stateless")
+    email = make_user("auth-fallback")
+    token = login(client, run, email)["access_token"]
+    # Without a session only the signed claims can vouch for the token
+    run(get_redis().delete(f"user_token:{email}"))
+
+    monkeypatch.setattr(subscriber, "connected", True)
+    assert me(client, run, token) == 200
+
+    monkeypatch.setattr(subscriber, "connected", False)
+    assert me(client, run, token) == 401
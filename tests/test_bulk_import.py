@@ -0,0 +1,54 @@
+'''
+Size limits of the bulk camera imports
+'''
+
+
+def test_oversized_json_body_is_rejected_before_parsing(client, run, tokens):
+    from application.camera_management import BULK_IMPORT_MAX_BYTES
+
+    body = b'{"cameras": [' + b" " * BULK_IMPORT_MAX_BYTES + b"]}"
+    headers = {"token": tokens["superadmin"], "content-type": "application/json"}
+    response = run(client.post("/v1/camera/bulk", content=body, headers=headers))
+    assert response.status_code == 413
+    assert response.json()["responseData"]["message"] == "FAILURE"
+
+
+def test_oversized_chunked_body_is_rejected(client, run, tokens):
+    from application.camera_management import BULK_IMPORT_MAX_BYTES
+
+    async def chunks():
+        # No Content-Length, the body is counted while it arrives
+        yield b'{"cameras": ['
+        for _ in range(BULK_IMPORT_MAX_BYTES // 65536 + 1):
+            yield b" " * 65536
+        yield b"]}"
+
+    headers = {"token": tokens["superadmin"], "content-type": "application/json"}
+    response = run(client.post("/v1/camera/bulk", content=chunks(), headers=headers))
+    assert response.status_code == 413
+
+
+def test_csv_with_too_many_rows(client, run, tokens):
+    from application.camera_management import BULK_IMPORT_MAX_ROWS
+
+    rows = "".join(f"csv-camera-{number},10.0.0.1,tests\n" for number in range(BULK_IMPORT_MAX_ROWS + 1))
+    files = {"file": ("cameras.csv", "device_name,device_ip,device_location\n" + rows, "text/csv")}
+    response = run(client.post("/v1/camera/bulk/csv", files=files, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 400
+    assert str(BULK_IMPORT_MAX_ROWS) in response.json()["responseData"]["reason"]
+
+
+def test_small_import_passes_the_limit(client, run, tokens):
+    import utils.database as database
+    from sqlalchemy import delete, select
+
+    data = {"cameras": [{"device_name": "limit-camera-0", "device_ip": "10.0.0.1", "device_location": "tests"}]}
+    response = run(client.post("/v1/camera/bulk", json=data, headers={"token": tokens["superadmin"]}))
+    try:
+        assert response.status_code == 201, response.text
+    finally:
+        with database.get_database().session() as conn:
+            camera_ids = conn.execute(select(database.Camera.id).filter(database.Camera.device_name == "limit-camera-0")).scalars().all()
+            conn.execute(delete(database.CameraAssignmentMap).filter(database.CameraAssignmentMap.camera_id.in_(camera_ids)))
+            conn.execute(delete(database.Camera).filter(database.Camera.id.in_(camera_ids)))
+            conn.commit()
@@ -0,0 +1,57 @@
+'''
+Rank checks of the camera deassignment
+'''
+from datetime import date
+
+import pytest
+
+from benchmarks import environment
+
+
+@pytest.fixture
+def roleless_assignments(app):
+    '''
+    Two cameras assigned to the supervisor by a user without a role, returns their names
+    '''
+    from sqlalchemy import delete, insert, select
+    import utils.database as database
+
+    db = database.get_database()
+    audit = {"created_by": "TESTS", "created_on": date.today(), "updated_by": "TESTS", "updated_on": date.today()}
+    names = ["roleless-camera-0", "roleless-camera-1"]
+    with db.session() as conn:
+        assigner = database.User(name="roleless", email="roleless@example.com", hashed_password="-", **audit)
+        conn.add(assigner)
+        conn.flush()
+        conn.execute(insert(database.Camera), [{"device_name": name, "device_ip": "10.255.255.2", "device_location": "tests", **audit} for name in names])
+        camera_ids = conn.execute(select(database.Camera.id).filter(database.Camera.device_name.in_(names))).scalars().all()
+        supervisor_id = conn.scalar(select(database.User.id).filter(database.User.email == environment.SUPERVISOR_EMAIL))
+        conn.execute(insert(database.CameraAssignmentMap), [
+            {"camera_id": camera_id, "user_id": supervisor_id, "assigned_by": assigner.id, **audit} for camera_id in camera_ids
+        ])
+        conn.commit()
+        assigner_id = assigner.id
+
+    yield names
+
+    with db.session() as conn:
+        conn.execute(delete(database.CameraAssignmentMap).filter(database.CameraAssignmentMap.camera_id.in_(camera_ids)))
+        conn.execute(delete(database.Camera).filter(database.Camera.id.in_(camera_ids)))
+        conn.execute(delete(database.User).filter(database.User.id == assigner_id))
+        conn.commit()
+
+
+def test_assignments_of_a_roleless_assigner_can_be_removed(client, run, tokens, roleless_assignments):
+    headers = {"token": tokens["superadmin"]}
+    single, bulk = roleless_assignments
+
+    data = {"device_name": single, "user_email": environment.SUPERVISOR_EMAIL}
+    response = run(client.post("/v1/camera/deassign", json=data, headers=headers))
+    assert response.status_code == 200, response.text
+
+    data = {"device_names": [bulk], "user_emails": [environment.SUPERVISOR_EMAIL]}
+    response = run(client.post("/v1/camera/deassign/bulk", json=data, headers=headers))
+    assert response.status_code == 200, response.text
+    result = response.json()["responseData"]["data"]
+    assert result["deassigned"] == 1
+    assert result["not_assigned"] == 0
@@ -0,0 +1,150 @@
+'''
+ETags, conditional requests and per scope invalidation of the camera listing cache
+'''
+import pytest
+
+from benchmarks import environment
+
+CAMERA = "cache-camera-0"
+
+
+def etag(client, run, token, **params):
+    response = run(client.get("/v1/camera", params=params, headers={"token": token}))
+    assert response.status_code == 200, response.text
+    return response.headers["etag"]
+
+
+def unchanged(client, run, token, tag):
+    '''
+    Whether a conditional request with the ETag is answered with a 304
+    '''
+    response = run(client.get("/v1/camera", headers={"token": token, "if-none-match": tag}))
+    assert response.status_code in (200, 304)
+    return response.status_code == 304
+
+
+@pytest.fixture
+def camera(client, run, tokens):
+    '''
+    A camera created (and so assigned to) the superadmin, deleted after the test
+    '''
+    headers = {"token": tokens["superadmin"]}
+    data = {"device_name": CAMERA, "device_ip": "10.255.255.3", "device_location": "cache-tests"}
+    response = run(client.post("/v1/camera", json=data, headers=headers))
+    assert response.status_code == 201, response.text
+    yield CAMERA
+    run(client.request("DELETE", "/v1/camera", json={"device_name": CAMERA}, headers=headers))
+
+
+def assignment(name):
+    return {"device_name": name, "user_email": environment.SUPERVISOR_EMAIL}
+
+
+def test_matching_if_none_match_gets_304(client, run, tokens):
+    token = tokens["superadmin"]
+    tag = etag(client, run, token)
+
+    response = run(client.get("/v1/camera", headers={"token": token, "if-none-match": tag}))
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == tag
+
+    assert unchanged(client, run, token, f'"other", {tag}')
+    assert unchanged(client, run, token, "*")
+    assert not unchanged(client, run, token, '"other"')
+    # The query parameters are part of the tag
+    assert etag(client, run, token, limit=5) != tag
+
+
+def test_superadmins_and_users_have_separate_scopes(client, run, tokens):
+    superadmin = run(client.get("/v1/camera", params={"limit": 1000}, headers={"token": tokens["superadmin"]}))
+    supervisor = run(client.get("/v1/camera", params={"limit": 1000}, headers={"token": tokens["supervisor"]}))
+    assert superadmin.headers["etag"] != supervisor.headers["etag"]
+    assert len(supervisor.json()["responseData"]["items"]) < len(superadmin.json()["responseData"]["items"])
+    # A superadmin's tag is no good for the supervisor's scope
+    assert not unchanged(client, run, tokens["supervisor"], superadmin.headers["etag"])
+
+
+def test_create_invalidates_only_the_creators_scopes(client, run, tokens, camera):
+    # The fixture created a camera, both tags are taken afterwards
+    all_tag, user_tag = etag(client, run, tokens["superadmin"]), etag(client, run, tokens["supervisor"])
+    data = {"device_name": "cache-camera-1", "device_ip": "10.255.255.4", "device_location": "cache-tests"}
+    headers = {"token": tokens["superadmin"]}
+    response = run(client.post("/v1/camera", json=data, headers=headers))
+    assert response.status_code == 201, response.text
+    try:
+        assert not unchanged(client, run, tokens["superadmin"], all_tag)
+        assert unchanged(client, run, tokens["supervisor"], user_tag)
+    finally:
+        run(client.request("DELETE", "/v1/camera", json={"device_name": "cache-camera-1"}, headers=headers))
+
+
+def test_assign_and_deassign_invalidate_the_assignees_scope(client, run, tokens, camera):
+    headers = {"token": tokens["superadmin"]}
+    all_tag, user_tag = etag(client, run, tokens["superadmin"]), etag(client, run, tokens["supervisor"])
+
+    # A superadmin's change shows up in the supervisor's scope
+    response = run(client.post("/v1/camera/assign", json=assignment(camera), headers=headers))
+    assert response.status_code == 201, response.text
+    assert not unchanged(client, run, tokens["supervisor"], user_tag)
+    assert unchanged(client, run, tokens["superadmin"], all_tag)
+    names = [item["device_name"] for item in run(client.get("/v1/camera", params={"limit": 1000}, headers={"token": tokens["supervisor"]})).json()["responseData"]["items"]]
+    assert camera in names
+
+    user_tag = etag(client, run, tokens["supervisor"])
+    response = run(client.post("/v1/camera/deassign", json=assignment(camera), headers=headers))
+    assert response.status_code == 200, response.text
+    assert not unchanged(client, run, tokens["supervisor"], user_tag)
+    assert unchanged(client, run, tokens["superadmin"], all_tag)
+
+
+def test_bulk_assign_and_deassign_invalidate_the_assignees_scope(client, run, tokens, camera):
+    headers = {"token": tokens["superadmin"]}
+    data = {"device_names": [camera], "user_emails": [environment.SUPERVISOR_EMAIL]}
+
+    user_tag = etag(client, run, tokens["supervisor"])
+    response = run(client.post("/v1/camera/assign/bulk", json=data, headers=headers))
+    assert response.status_code == 201, response.text
+    assert not unchanged(client, run, tokens["supervisor"], user_tag)
+
+    user_tag = etag(client, run, tokens["supervisor"])
+    response = run(client.post("/v1/camera/deassign/bulk", json=data, headers=headers))
+    assert response.status_code == 200, response.text
+    assert not unchanged(client, run, tokens["supervisor"], user_tag)
+
+
+def test_modify_and_delete_invalidate_every_assignee(client, run, tokens, camera):
+    headers = {"token": tokens["superadmin"]}
+    response = run(client.post("/v1/camera/assign", json=assignment(camera), headers=headers))
+    assert response.status_code == 201, response.text
+
+    all_tag, user_tag = etag(client, run, tokens["superadmin"]), etag(client, run, tokens["supervisor"])
+    response = run(client.patch("/v1/camera", json={"device_name": camera, "new_device_location": "cache-tests-moved"}, headers=headers))
+    assert response.status_code == 200, response.text
+    assert not unchanged(client, run, tokens["superadmin"], all_tag)
+    assert not unchanged(client, run, tokens["supervisor"], user_tag)
+
+    all_tag, user_tag = etag(client, run, tokens["superadmin"]), etag(client, run, tokens["supervisor"])
+    response = run(client.request("DELETE", "/v1/camera", json={"device_name": camera}, headers=headers))
+    assert response.status_code == 200, response.text
+    assert not unchanged(client, run, tokens["superadmin"], all_tag)
+    assert not unchanged(client, run, tokens["supervisor"], user_tag)
+
+
+def test_bulk_import_invalidates_the_importers_scopes(client, run, tokens):
+    import utils.database as database
+    from sqlalchemy import delete, select
+
+    all_tag, user_tag = etag(client, run, tokens["superadmin"]), etag(client, run, tokens["supervisor"])
+    data = {"cameras": [{"device_name": "cache-import-0", "device_ip": "10.255.255.5", "device_location": "cache-tests"}]}
+    response = run(client.post("/v1/camera/bulk", json=data, headers={"token": tokens["superadmin"]}))
+    try:
+        assert response.status_code == 201, response.text
+        assert not unchanged(client, run, tokens["superadmin"], all_tag)
+        assert unchanged(client, run, tokens["supervisor"], user_tag)
+    finally:
+        with database.get_database().session() as conn:
+            camera_ids = conn.execute(select(database.Camera.id).filter(database.Camera.device_name == "cache-import-0")).scalars().all()
+            conn.execute(delete(database.CameraAssignmentMap).filter(database.CameraAssignmentMap.camera_id.in_(camera_ids)))
+            conn.execute(delete(database.Camera).filter(database.Camera.id.in_(camera_ids)))
+            conn.commit()
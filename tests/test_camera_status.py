@@ -0,0 +1,141 @@
+'''
+Reachability probes against local TCP listeners standing in for cameras
+'''
+import asyncio
+import socket
+import time
+
+import pytest
+
+
+@pytest.fixture
+def camera(run):
+    '''
+    Start a local listener, returns its port. handler(reader, writer) decides how the "camera" answers
+    '''
+    servers = []
+    handlers = set()
+
+    def start(handler):
+        async def tracked(reader, writer):
+            handlers.add(asyncio.current_task())
+            await handler(reader, writer)
+
+        server = run(asyncio.start_server(tracked, "127.0.0.1", 0))
+        servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    yield start
+    for server in servers:
+        server.close()
+        run(server.wait_closed())
+    # Handlers which are still waiting (never_answers) are cancelled instead of being left pending on the loop
+    for task in handlers:
+        task.cancel()
+    run(asyncio.gather(*handlers, return_exceptions=True))
+
+
+def closed_port():
+    # Bound but not listening, connecting to it is refused
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    return sock, sock.getsockname()[1]
+
+
+async def close(reader, writer):
+    writer.close()
+
+
+async def http_ok(reader, writer):
+    await reader.readline()
+    writer.write(b"HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n")
+    await writer.drain()
+    writer.close()
+
+
+async def never_answers(reader, writer):
+    await asyncio.sleep(5)
+    writer.close()
+
+
+def test_tcp_probe_of_a_reachable_camera(run, camera):
+    from application.camera_status import probe
+
+    latency_ms = run(probe("127.0.0.1", camera(close), timeout=1.0))
+    assert latency_ms is not None and latency_ms >= 0
+
+
+def test_http_probe_of_a_reachable_camera(run, camera):
+    from application.camera_status import probe
+
+    assert run(probe("127.0.0.1", camera(http_ok), "/status", timeout=1.0)) is not None
+
+
+def test_refused_connection_is_offline(run):
+    from application.camera_status import probe
+
+    sock, port = closed_port()
+    try:
+        assert run(probe("127.0.0.1", port, timeout=1.0)) is None
+    finally:
+        sock.close()
+
+
+def test_http_probe_times_out(run, camera):
+    from application.camera_status import probe
+
+    port = camera(never_answers)
+    start = time.perf_counter()
+    assert run(probe("127.0.0.1", port, "/status", timeout=0.2)) is None
+    assert time.perf_counter() - start < 1.0
+
+
+def test_unexpected_probe_error_is_offline(run, monkeypatch):
+    from application.camera_status import probe
+
+    async def open_connection(host, port):
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(asyncio, "open_connection", open_connection)
+    assert run(probe("127.0.0.1", 554, timeout=1.0)) is None
+
+
+def test_http_probe_needs_an_http_answer(run, camera):
+    from application.camera_status import probe
+
+    # A listener which closes without answering is reachable over TCP but not a working HTTP endpoint
+    port = camera(close)
+    assert run(probe("127.0.0.1", port, timeout=1.0)) is not None
+    assert run(probe("127.0.0.1", port, "/status", timeout=1.0)) is None
+
+
+def test_round_writes_statuses_and_summary(run, camera, app, client, tokens):
+    from sqlalchemy import update
+    import utils.database as database
+    from application.camera_status import CameraStatusPoller, camera_statuses, status_summary
+
+    up = camera(close)
+    sock, down = closed_port()
+    try:
+        db = database.get_database()
+        with db.session() as conn:
+            conn.execute(update(database.Camera).values(device_ip="127.0.0.1", probe_port=down, probe_path=None))
+            conn.execute(update(database.Camera).filter(database.Camera.id <= 10).values(probe_port=up))
+            conn.commit()
+
+        poller = CameraStatusPoller({"interval_seconds": 0.1, "timeout": 0.5})
+        probed = run(poller.run_round())
+    finally:
+        sock.close()
+
+    statuses = run(camera_statuses([1, 11]))
+    assert statuses[1]["online"] is True and statuses[1]["last_seen"] is not None
+    assert statuses[11]["online"] is False and statuses[11]["last_seen"] is None
+
+    summary = run(status_summary())
+    assert summary["total"] == probed
+    assert summary["online"] == 10
+    assert summary["offline"] == probed - 10
+
+    response = client.get("/v1/camera/status/summary", headers={"token": tokens["superadmin"]})
+    assert run(response).json()["responseData"]["online"] == 10
@@ -0,0 +1,78 @@
+'''
+The bcrypt hashing pool: admission control and hashing outside of database connections
+'''
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks import environment
+
+
+def test_pool_rejects_callers_beyond_max_queue(run):
+    from utils.exceptions import Error
+    from utils.hashing import HashingPool
+
+    pool = HashingPool({"workers": 1, "max_concurrency": 1, "max_queue": 1})
+    # Threads instead of spawned processes, the admission control is the same
+    pool._executor = ThreadPoolExecutor(1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.create_task(pool.run("hash", release.wait))
+        while pool.in_flight == 0:
+            await asyncio.sleep(0.01)
+        waiting = asyncio.create_task(pool.run("hash", release.wait))
+        while pool.waiting == 0:
+            await asyncio.sleep(0.01)
+
+        with pytest.raises(Error) as rejected:
+            await pool.run("hash", release.wait)
+        assert rejected.value.status_code == 503
+
+        release.set()
+        await asyncio.gather(running, waiting)
+
+    try:
+        run(scenario())
+    finally:
+        release.set()
+        pool._executor.shutdown()
+    assert pool.rejected == 1
+    assert pool.stats()["timings"]["hash"]["count"] == 2
+
+
+def test_login_gets_503_while_the_pool_is_saturated(client, run, monkeypatch):
+    from utils.hashing import hashing_pool
+
+    monkeypatch.setattr(hashing_pool, "waiting", hashing_pool.options["max_queue"])
+    data = {"email": environment.SUPERVISOR_EMAIL, "password": environment.PASSWORD}
+    response = run(client.post("/v1/login", json=data))
+    assert response.status_code == 503
+    assert response.json()["responseData"]["reason"] == "Server is busy, please try again shortly!"
+
+
+def test_passwords_are_hashed_without_a_checked_out_connection(client, run, tokens, monkeypatch):
+    import utils.database as database
+    from utils.hashing import hashing_pool
+
+    db = database.get_database()
+    checked_out = []
+
+    async def hash(plain_password):
+        checked_out.append(db.pool_status()[1]["checked_out"])
+        return "$2b$12$" + "x" * 53
+
+    monkeypatch.setattr(hashing_pool, "hash", hash)
+    headers = {"token": tokens["superadmin"]}
+    data = {"user_name": "hashing", "user_email": "hashing@example.com", "role": "supervisor", "password": "Secret123"}
+    response = run(client.post("/v1/users", json=data, headers=headers))
+    assert response.status_code == 201, response.text
+    try:
+        data = {"user_email": "hashing@example.com", "role": None, "password": "Secret456"}
+        response = run(client.patch("/v1/users", json=data, headers=headers))
+        assert response.status_code == 200, response.text
+    finally:
+        run(client.request("DELETE", "/v1/users", json={"user_email": "hashing@example.com"}, headers=headers))
+    assert checked_out == [0, 0]
@@ -0,0 +1,47 @@
+'''
+Listing responses against their documented models, and response compression
+'''
+import gzip
+
+import pytest
+
+
+@pytest.mark.parametrize("path, model", [
+    ("/v1/users", "UserListResponse"),
+    ("/v1/activity", "AuditLogListResponse"),
+    ("/v1/camera", "CameraListResponse"),
+])
+def test_listings_match_their_documented_models(client, run, tokens, app, path, model):
+    import application.schema as schema
+
+    documented = app.openapi()["paths"][path]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert documented["$ref"].endswith(f"/{model}")
+
+    response = run(client.get(path, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200, response.text
+    getattr(schema, model).model_validate(response.json())
+
+
+def test_projected_camera_listing(client, run, tokens):
+    from application.schema import CameraListResponse
+
+    response = run(client.get("/v1/camera", params={"fields": "device_name", "limit": 5}, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200, response.text
+    items = response.json()["responseData"]["items"]
+    assert all(set(item) == {"id", "device_name"} for item in items)
+    CameraListResponse.model_validate(response.json())
+
+
+def test_listings_are_compressed(client, run, tokens):
+    response = run(client.get("/v1/camera", headers={"token": tokens["superadmin"], "accept-encoding": "gzip"}))
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+
+
+@pytest.mark.parametrize("flag", ["true", "t", "y", "1", "on"])
+def test_gzip_export_is_not_compressed_twice(client, run, tokens, flag):
+    response = run(client.get("/v1/activity/export", params={"gzip": flag}, headers={"token": tokens["superadmin"], "accept-encoding": "gzip"}))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    assert "content-encoding" not in response.headers
+    assert gzip.decompress(response.content).decode().count("\n") > 0
@@ -0,0 +1,120 @@
+'''
+Queued logging: sampling, dropping when the queue is full, server loggers and request ids
+'''
+import logging
+import queue
+
+import pytest
+
+
+def record(**extra):
+    return logging.makeLogRecord({"name": "app_logger", "levelno": logging.INFO, "levelname": "INFO", "msg": "event", **extra})
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    '''
+    Route the records of the app's queue handler to a fresh queue which the listener does not drain
+    '''
+    from logger import log_handler
+
+    captured = queue.Queue()
+    monkeypatch.setattr(log_handler, "queue", captured)
+
+    def records():
+        found = []
+        while not captured.empty():
+            found.append(captured.get_nowait())
+        return found
+
+    return records
+
+
+def test_only_sampled_records_carry_a_rate(monkeypatch):
+    import random
+    from logger import ContextFilter
+
+    context_filter = ContextFilter({"sampled": 0.25, "kept": 1.0})
+
+    unsampled = record()
+    assert context_filter.filter(unsampled)
+    assert not hasattr(unsampled, "sample_rate")
+
+    # A sample without a configured rate, or with a rate of 1, is not being sampled
+    for name in ("unconfigured", "kept"):
+        kept = record(sample=name)
+        assert context_filter.filter(kept)
+        assert not hasattr(kept, "sample_rate")
+
+    monkeypatch.setattr(random, "random", lambda: 0.1)
+    sampled = record(sample="sampled")
+    assert context_filter.filter(sampled)
+    assert sampled.sample_rate == 0.25
+
+    monkeypatch.setattr(random, "random", lambda: 0.5)
+    assert not context_filter.filter(record(sample="sampled"))
+
+
+def test_json_lines_carry_the_rate_of_sampled_records_only():
+    import json
+    from logger import JsonFormatter
+
+    formatter = JsonFormatter()
+    assert "sample_rate" not in json.loads(formatter.format(record()))
+    assert json.loads(formatter.format(record(sample_rate=0.25)))["sample_rate"] == 0.25
+
+
+def test_records_beyond_max_queue_are_dropped_and_counted():
+    from logger import DroppingQueueHandler
+
+    handler = DroppingQueueHandler(queue.Queue(2))
+    for number in range(5):
+        handler.handle(record(msg="event %s", args=(number,)))
+    assert handler.dropped == 3
+    # Messages are formatted before they are queued
+    assert [handler.queue.get_nowait().msg for _ in range(2)] == ["event 0", "event 1"]
+
+
+def test_dropped_records_are_counted_in_metrics(monkeypatch):
+    from logger import log_handler
+    from utils.metrics import LOG_RECORDS_DROPPED, sample_logging
+
+    before = LOG_RECORDS_DROPPED._value.get()
+    monkeypatch.setattr(log_handler, "dropped", 3)
+    sample_logging()
+    assert LOG_RECORDS_DROPPED._value.get() == before + 3
+    assert log_handler.dropped == 0
+
+
+@pytest.mark.parametrize("name", ["uvicorn", "uvicorn.error", "uvicorn.access"])
+def test_server_loggers_write_through_the_queue(queued, name):
+    from logger import log_handler
+
+    for server_logger in (logging.getLogger("uvicorn"), logging.getLogger("uvicorn.access")):
+        # pytest adds its capturing handlers next to ours
+        assert log_handler in server_logger.handlers
+        assert not server_logger.propagate
+    logging.getLogger(name).warning("server event")
+    [queued_record] = queued()
+    assert queued_record.name == name
+    assert queued_record.msg == "server event"
+
+
+def test_records_carry_the_request_id(client, run, tokens, queued):
+    from logger import logger
+
+    response = run(client.get("/v1/camera", headers={"token": tokens["supervisor"], "x-request-id": "tests-request-1"}))
+    assert response.status_code == 200
+    assert response.headers["x-request-id"] == "tests-request-1"
+    authenticated = [queued_record for queued_record in queued() if "authenticated successfully" in queued_record.msg]
+    assert authenticated and all(queued_record.request_id == "tests-request-1" for queued_record in authenticated)
+
+    # Unusable ids are replaced with a generated one
+    response = run(client.get("/v1/camera", headers={"token": tokens["supervisor"], "x-request-id": "not a sane id"}))
+    generated = response.headers["x-request-id"]
+    assert generated != "not a sane id"
+    assert {queued_record.request_id for queued_record in queued()} == {generated}
+
+    # Outside of a request there is no id
+    logger.info("no request")
+    assert [queued_record.request_id for queued_record in queued()] == [None]
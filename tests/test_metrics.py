@@ -0,0 +1,70 @@
+'''
+The Prometheus metrics served on /metrics
+'''
+from benchmarks import environment
+
+
+def scrape(client, run):
+    '''
+    Samples of /metrics as {(name, sorted label items): value}
+    '''
+    from prometheus_client.parser import text_string_to_metric_families
+
+    response = run(client.get("/metrics"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.text)
+        for sample in family.samples
+    }
+
+
+def value(samples, metric, **labels):
+    return samples.get((metric, tuple(sorted(labels.items()))), 0.0)
+
+
+def test_requests_are_counted_per_route_template(client, run, tokens):
+    before = scrape(client, run)
+    for _ in range(2):
+        assert run(client.get("/v1/camera", headers={"token": tokens["supervisor"]})).status_code == 200
+    assert run(client.get("/v1/camera")).status_code == 401
+    # The camera listing may be served from its cache, the user listing always runs statements
+    assert run(client.get("/v1/users", headers={"token": tokens["superadmin"]})).status_code == 200
+    after = scrape(client, run)
+
+    def delta(metric, **labels):
+        return value(after, metric, **labels) - value(before, metric, **labels)
+
+    assert delta("http_requests_total", method="GET", route="/v1/camera", status="200") == 2
+    assert delta("http_requests_total", method="GET", route="/v1/camera", status="401") == 1
+    assert delta("http_request_duration_seconds_count", method="GET", route="/v1/camera") == 3
+    assert delta("app_errors_total", status_code="401") == 1
+    # The statements of every request are observed too
+    assert delta("db_queries_per_request_count", route="/v1/camera") == 3
+    assert delta("db_queries_per_request_sum", route="/v1/users") > 0
+    assert delta("db_query_duration_seconds_count") >= delta("db_queries_per_request_sum", route="/v1/users")
+    # Sessions are looked up in redis
+    assert delta("redis_command_duration_seconds_count", operation="session_lookup") >= 2
+    assert delta("auth_duration_seconds_count", stage="authenticate", outcome="ok") == 3
+
+
+def test_database_pools_are_sampled_on_scrape(client, run):
+    from utils.database import pool_status
+
+    samples = scrape(client, run)
+    for stats in pool_status():
+        labels = {"name": stats["name"], "engine": stats["engine"]}
+        assert ("db_pool_checked_out", tuple(sorted(labels.items()))) in samples
+        assert value(samples, "db_pool_idle", **labels) >= 0
+
+
+def test_password_hashing_is_observed(client, run):
+    before = scrape(client, run)
+    response = run(client.post("/v1/login", json={"email": environment.SUPERVISOR_EMAIL, "password": environment.PASSWORD}))
+    assert response.status_code == 200
+    after = scrape(client, run)
+
+    for metric in ("password_hashing_duration_seconds_count", "password_hashing_wait_seconds_count"):
+        assert value(after, metric, operation="verify") - value(before, metric, operation="verify") == 1
+    assert ("password_hashing_waiting", ()) in after
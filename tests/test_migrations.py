@@ -0,0 +1,128 @@
+'''
+The migration runner and its helpers against a database with the schema from before the first migration
+'''
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+# The tables the migrations touch, as they were created before migration 0001
+BASE_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR(255))",
+    "CREATE TABLE roles (id INTEGER PRIMARY KEY, name VARCHAR(255))",
+    "CREATE TABLE permissions (id INTEGER PRIMARY KEY, permission_name VARCHAR(255))",
+    "CREATE TABLE cameras (id INTEGER PRIMARY KEY, device_name VARCHAR(255), device_ip VARCHAR(255), device_location VARCHAR(255))",
+    "CREATE TABLE camera_assignment_map (id INTEGER PRIMARY KEY, camera_id INTEGER, user_id INTEGER)",
+    "CREATE INDEX idx_camera_assignment_camera ON camera_assignment_map (camera_id, user_id)",
+    "CREATE TABLE audit_logs (id INTEGER PRIMARY KEY, user_id INTEGER, action VARCHAR(255), entity_type VARCHAR(255), entity_id INTEGER, timestamp DATETIME)",
+]
+
+
+@pytest.fixture
+def runner(tmp_path):
+    from utils.database.migrations import MigrationRunner
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    with engine.begin() as conn:
+        for statement in BASE_SCHEMA:
+            conn.execute(text(statement))
+    yield MigrationRunner(SimpleNamespace(engine=engine))
+    engine.dispose()
+
+
+def indexes(runner, table):
+    return {index["name"] for index in inspect(runner.engine).get_indexes(table)}
+
+
+def columns(runner, table):
+    return {column["name"] for column in inspect(runner.engine).get_columns(table)}
+
+
+def versions(runner):
+    with runner.engine.connect() as conn:
+        return conn.execute(text("SELECT version FROM schema_version ORDER BY version")).scalars().all()
+
+
+def test_migrations_are_loaded_in_order():
+    from utils.database.migrations import load_migrations
+
+    loaded = load_migrations()
+    assert [version for version, _ in loaded] == sorted(version for version, _ in loaded)
+    assert all(migration.__doc__ and migration.up and migration.down for _, migration in loaded)
+
+
+def test_upgrade_applies_and_records_every_migration(runner):
+    from utils.database.migrations import load_migrations
+
+    latest = load_migrations()[-1][0]
+    assert runner.current_version() == 0
+    runner.upgrade()
+    assert runner.current_version() == latest
+    assert versions(runner) == [version for version, _ in load_migrations()]
+
+    assert {"uq_camera_assignment_camera_user", "idx_camera_assignment_user"} <= indexes(runner, "camera_assignment_map")
+    assert "idx_camera_assignment_camera" not in indexes(runner, "camera_assignment_map")
+    assert {"uq_cameras_device_name", "idx_cameras_location", "idx_cameras_ip"} <= indexes(runner, "cameras")
+    assert "idx_audit_logs_timestamp" in indexes(runner, "audit_logs")
+    assert {"probe_port", "probe_path"} <= columns(runner, "cameras")
+    unique = {index["name"] for index in inspect(runner.engine).get_indexes("users") if index["unique"]}
+    assert "uq_users_email" in unique
+
+    # A second run finds nothing to do
+    runner.upgrade()
+    assert versions(runner) == [version for version, _ in load_migrations()]
+
+
+def test_upgrade_to_a_target_version(runner):
+    runner.upgrade(1)
+    assert runner.current_version() == 1
+    assert "uq_users_email" in indexes(runner, "users")
+    assert "idx_cameras_ip" not in indexes(runner, "cameras")
+
+    runner.upgrade(2)
+    assert versions(runner) == [1, 2]
+    assert "idx_cameras_ip" in indexes(runner, "cameras")
+    assert "probe_port" not in columns(runner, "cameras")
+
+
+def test_downgrade_restores_the_original_schema(runner):
+    original = {table: (indexes(runner, table), columns(runner, table)) for table in ("users", "cameras", "camera_assignment_map", "audit_logs")}
+    runner.upgrade()
+
+    runner.downgrade(2)
+    assert runner.current_version() == 2
+    assert "probe_port" not in columns(runner, "cameras")
+
+    runner.downgrade(0)
+    assert runner.current_version() == 0
+    assert versions(runner) == []
+    # Indexes the migrations keep for the foreign keys on user_id are the only difference
+    restored = {table: (indexes(runner, table), columns(runner, table)) for table in original}
+    restored["camera_assignment_map"][0].discard("idx_camera_assignment_user")
+    restored["audit_logs"][0].discard("idx_audit_logs_user")
+    assert restored == original
+
+
+def test_index_and_column_helpers_are_idempotent(runner):
+    from utils.database.migrations import add_column, create_index, drop_column, drop_index
+
+    with runner.engine.begin() as conn:
+        for _ in range(2):
+            create_index(conn, "cameras", "idx_tests", ["device_ip"])
+            add_column(conn, "cameras", "tests_column", "INTEGER NULL")
+    assert "idx_tests" in indexes(runner, "cameras")
+    assert "tests_column" in columns(runner, "cameras")
+
+    with runner.engine.begin() as conn:
+        for _ in range(2):
+            drop_index(conn, "cameras", "idx_tests")
+            drop_column(conn, "cameras", "tests_column")
+    assert "idx_tests" not in indexes(runner, "cameras")
+    assert "tests_column" not in columns(runner, "cameras")
+
+
+def test_command_line_needs_a_command(app):
+    from utils.database.migrations import main
+
+    assert main([]) == 1
+    assert main(["sideways"]) == 1
@@ -0,0 +1,108 @@
+'''
+Per worker cache of user roles and role permissions, and its invalidation across workers
+'''
+import asyncio
+import inspect
+
+import pytest
+
+
+def counted(run, coroutine):
+    '''
+    Run the coroutine, returns its result and the number of SQL statements it ran
+    '''
+    from utils.database.querystats import track_queries
+
+    async def tracked():
+        with track_queries() as queries:
+            result = await coroutine
+        return result, queries.count
+
+    return run(tracked())
+
+
+def supervisor_id():
+    import utils.database as database
+    from sqlalchemy import select
+    from benchmarks import environment
+
+    with database.get_database().session() as conn:
+        return conn.scalar(select(database.User.id).filter(database.User.email == environment.SUPERVISOR_EMAIL))
+
+
+def test_permissions_are_cached_until_invalidated(run, app):
+    from application.service import PermissionCache
+
+    cache = PermissionCache(ttl=60)
+    user_id = supervisor_id()
+
+    permissions, statements = counted(run, cache.permissions_for_user(user_id))
+    assert "VIEW_CAMERA" in permissions
+    assert statements == 2
+    assert counted(run, cache.permissions_for_user(user_id)) == (permissions, 0)
+
+    # Only the invalidated entry is loaded again
+    cache.invalidate(role_id=cache.user_roles[user_id][0])
+    assert counted(run, cache.permissions_for_user(user_id)) == (permissions, 1)
+    cache.invalidate(user_id=user_id)
+    assert counted(run, cache.permissions_for_user(user_id)) == (permissions, 1)
+    cache.invalidate()
+    assert counted(run, cache.permissions_for_user(user_id)) == (permissions, 2)
+
+
+def test_entries_expire_after_the_ttl(run, app):
+    from application.service import PermissionCache
+
+    cache = PermissionCache(ttl=0)
+    user_id = supervisor_id()
+    run(cache.permissions_for_user(user_id))
+    assert counted(run, cache.permissions_for_user(user_id))[1] == 2
+
+
+def test_unknown_user_is_not_found(run, app):
+    from application.service import PermissionCache
+    from utils.exceptions import Error
+
+    with pytest.raises(Error) as not_found:
+        run(PermissionCache(ttl=60).role_for_user(999999))
+    assert not_found.value.status_code == 404
+
+
+def test_published_changes_invalidate_every_worker(run, app):
+    from application.service import PERMISSION_CHANNEL, permission_cache
+    from utils.cache import publish, subscriber
+
+    user_id = supervisor_id()
+    run(permission_cache.permissions_for_user(user_id))
+    role_id = permission_cache.user_roles[user_id][0]
+
+    async def published(message, entries, key):
+        # The message takes the way through redis like one of another worker
+        await publish(PERMISSION_CHANNEL, message)
+        for _ in range(300):
+            if key not in entries:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    assert subscriber.connected
+    assert run(published({"user_id": None, "role_id": role_id}, permission_cache.role_permissions, role_id))
+    assert user_id in permission_cache.user_roles
+    assert run(published({"user_id": user_id, "role_id": None}, permission_cache.user_roles, user_id))
+
+
+def test_resubscribing_clears_the_cache(run, app):
+    from application.service import permission_cache
+    from utils.cache import subscriber
+
+    run(permission_cache.permissions_for_user(supervisor_id()))
+
+    async def resubscribed():
+        # What the subscriber runs after it (re)connects, messages may have been missed in between
+        for on_reset in subscriber.reset_handlers:
+            result = on_reset()
+            if inspect.isawaitable(result):
+                await result
+
+    run(resubscribed())
+    assert permission_cache.user_roles == {} and permission_cache.role_permissions == {}
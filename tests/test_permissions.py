@@ -0,0 +1,90 @@
+'''
+Permission changes made by hand reach live sessions and tokens through application.permissions
+'''
+from datetime import date
+
+import pytest
+
+from benchmarks import environment
+
+
+@pytest.fixture
+def viewer_role(app):
+    '''
+    A role which may only view cameras, returns a function which takes the permission away
+    '''
+    from sqlalchemy import delete, select
+    import utils.database as database
+    from application.service import permission_cache
+
+    db = database.get_database()
+    audit = {"created_by": "TESTS", "created_on": date.today(), "updated_by": "TESTS", "updated_on": date.today()}
+    with db.session() as conn:
+        role = database.Role(name="viewer", rank=3, **audit)
+        conn.add(role)
+        conn.flush()
+        permission_id = conn.scalar(select(database.Permission.id).filter(database.Permission.permission_name == "VIEW_CAMERA"))
+        conn.add(database.RolePermissionMap(role_id=role.id, permission_id=permission_id, **audit))
+        conn.commit()
+        role_id = role.id
+    # SQLite hands out the id of a deleted role again, the cache may still know it
+    permission_cache.invalidate(role_id=role_id)
+
+    def revoke_view():
+        with db.session() as conn:
+            conn.execute(delete(database.RolePermissionMap).filter(database.RolePermissionMap.role_id == role_id))
+            conn.commit()
+
+    yield revoke_view
+
+    revoke_view()
+    with db.session() as conn:
+        conn.execute(delete(database.Role).filter(database.Role.id == role_id))
+        conn.commit()
+
+
+def login(client, run, email):
+    response = run(client.post("/v1/login", json={"email": email, "password": environment.PASSWORD}))
+    assert response.status_code == 200, response.text
+    return response.json()["responseData"]["access_token"]
+
+
+def cameras(client, run, token):
+    return run(client.get("/v1/camera", headers={"token": token})).status_code
+
+
+def test_hand_made_role_change_reaches_sessions(client, run, viewer_role, make_user):
+    from application.permissions import propagate_permission_change
+
+    email = make_user("viewer-session", role="viewer")
+    token = login(client, run, email)
+    assert cameras(client, run, token) == 200
+
+    viewer_role()
+    # The session still carries VIEW_CAMERA until the change is propagated
+    assert cameras(client, run, token) == 200
+    assert run(propagate_permission_change(role="viewer")) == [email]
+    assert cameras(client, run, token) == 400
+
+
+def test_hand_made_role_change_revokes_stateless_tokens(client, run, viewer_role, make_user, monkeypatch):
+    import application.authentication as authentication
+    from application.permissions import propagate_permission_change
+    from utils.cache import subscriber
+
+    monkeypatch.setattr(authentication, "AUTH_MODE", "stateless")
+    monkeypatch.setattr(subscriber, "connected", True)
+    email = make_user("viewer-stateless", role="viewer")
+    token = login(client, run, email)
+    assert cameras(client, run, token) == 200
+
+    viewer_role()
+    run(propagate_permission_change(role="viewer"))
+    assert cameras(client, run, token) == 401
+    assert cameras(client, run, login(client, run, email)) == 400
+
+
+def test_unknown_role_is_reported(run, app):
+    from application.permissions import main
+
+    assert main(["--role", "no-such-role"]) == 1
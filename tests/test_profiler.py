@@ -0,0 +1,94 @@
+'''
+The sampling request profiler (middleware.Middle) around a small ASGI app
+'''
+import asyncio
+import os
+import time
+
+import pytest
+
+TOKEN = "profile-secret"
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def endpoint(scope, receive, send):
+    await asyncio.sleep(0.05)
+    busy(0.05)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+@pytest.fixture
+def profiled(run, tmp_path):
+    '''
+    Send a GET through the profiler with the given options, returns the response
+    '''
+    import httpx
+    from middleware import Middle
+
+    def request(headers=None, **options):
+        config = {"enabled": True, "token": TOKEN, "interval_ms": 1, "output_dir": str(tmp_path), **options}
+
+        async def send():
+            transport = httpx.ASGITransport(app=Middle(endpoint, config))
+            async with httpx.AsyncClient(transport=transport, base_url="http://tests") as client:
+                return await client.get("/v1/profiled", headers=headers or {})
+
+        return run(send())
+
+    return request
+
+
+def profiles(tmp_path):
+    return sorted(os.listdir(tmp_path))
+
+
+def test_requests_with_the_token_are_profiled(profiled, tmp_path):
+    response = profiled({"x-profile-token": TOKEN})
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+
+    [filename] = profiles(tmp_path)
+    assert filename.endswith(f"-GET-v1_profiled-200-{filename.split('-')[-2]}-{profile_id}.folded")
+    with open(tmp_path / filename) as profile_file:
+        lines = profile_file.read().splitlines()
+    stacks = {line.rsplit(" ", 1)[0]: int(line.rsplit(" ", 1)[1]) for line in lines}
+    # Both the time spent running and the time spent awaiting are sampled, below the middleware
+    assert any(stack.split(";")[-1].startswith("busy (tests/test_profiler.py:") for stack in stacks)
+    assert any(stack.split(";")[-1].startswith("<await") for stack in stacks)
+    assert all(stack.startswith("endpoint (tests/test_profiler.py:") for stack in stacks)
+    # Most common stacks come first
+    assert list(stacks.values()) == sorted(stacks.values(), reverse=True)
+
+
+def test_requests_without_the_token_are_not_profiled(profiled, tmp_path):
+    for headers in ({}, {"x-profile-token": "wrong"}):
+        response = profiled(headers)
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+    assert profiles(tmp_path) == []
+
+
+def test_sampled_requests_are_profiled(profiled, tmp_path):
+    response = profiled(sample_rate=1.0)
+    assert "x-profile-id" in response.headers
+    assert len(profiles(tmp_path)) == 1
+
+
+def test_disabled_profiler_and_max_concurrent(profiled, tmp_path):
+    assert "x-profile-id" not in profiled({"x-profile-token": TOKEN}, enabled=False).headers
+    assert "x-profile-id" not in profiled({"x-profile-token": TOKEN}, max_concurrent=0).headers
+    assert profiles(tmp_path) == []
+
+
+def test_sampler_thread_stops_without_profiles(profiled):
+    from middleware import Middle
+
+    middle = Middle(endpoint, {"enabled": True, "token": TOKEN, "interval_ms": 1})
+    assert middle.sampler.active() == 0
+    assert middle.sampler._thread is None
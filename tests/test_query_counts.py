@@ -0,0 +1,81 @@
+'''
+Statement counts of the hot endpoints
+
+Every count is the number of SQL statements one request runs, a higher count usually means a relationship is
+loaded lazily or a query runs in a loop (N+1). Lower the expected count when an endpoint gets cheaper.
+'''
+from benchmarks import environment
+
+
+def tracked(run, request):
+    '''
+    Await the request while counting its statements, returns (response, QueryStats)
+    '''
+    from utils.database.querystats import track_queries
+
+    async def send():
+        with track_queries() as queries:
+            response = await request
+        return response, queries
+
+    return run(send())
+
+
+def test_login_runs_one_statement_per_lookup(client, run):
+    from application.service import permission_cache
+
+    # The role's permissions are read from the DB once, then served by the permission cache
+    permission_cache.clear()
+    data = {"email": environment.SUPERVISOR_EMAIL, "password": environment.PASSWORD}
+    response, queries = tracked(run, client.post("/v1/login", json=data))
+    assert response.status_code == 200
+    assert queries.count == 2
+
+    response, queries = tracked(run, client.post("/v1/login", json=data))
+    assert response.status_code == 200
+    assert queries.count == 1
+
+
+def test_camera_list_does_not_grow_with_the_page(client, run, tokens):
+    from application.camera_cache import camera_list_cache, SCOPE_ALL
+
+    for limit in (5, 50):
+        # A new version stamp so the page comes from the DB and not from the response cache
+        run(camera_list_cache.invalidate([SCOPE_ALL]))
+        response, queries = tracked(run, client.get("/v1/camera", params={"limit": limit}, headers={"token": tokens["superadmin"]}))
+        assert response.status_code == 200
+        assert len(response.json()["responseData"]["items"]) == limit
+        assert queries.count == 2
+        assert not queries.n_plus_one()
+
+
+def test_supervisor_camera_list(client, run, tokens):
+    from application.camera_cache import camera_list_cache
+
+    run(camera_list_cache.invalidate(["user:2"]))
+    response, queries = tracked(run, client.get("/v1/camera", headers={"token": tokens["supervisor"]}))
+    assert response.status_code == 200
+    assert len(response.json()["responseData"]["items"]) == 10
+    assert queries.count == 2
+
+
+def test_user_list_runs_one_statement(client, run, tokens):
+    response, queries = tracked(run, client.get("/v1/users", headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200
+    assert len(response.json()["responseData"]) == 2
+    assert queries.count == 1
+
+
+def test_camera_assign_and_deassign(client, run, tokens):
+    headers = {"token": tokens["superadmin"]}
+    data = {"device_name": f"{environment.ASSIGN_CAMERA_PREFIX}0000", "user_email": environment.SUPERVISOR_EMAIL}
+
+    response, queries = tracked(run, client.post("/v1/camera/assign", json=data, headers=headers))
+    assert response.status_code == 201, response.text
+    assert queries.count == 5
+    assert not queries.n_plus_one()
+
+    response, queries = tracked(run, client.post("/v1/camera/deassign", json=data, headers=headers))
+    assert response.status_code == 200, response.text
+    assert queries.count == 4
+    assert not queries.n_plus_one()
@@ -0,0 +1,88 @@
+'''
+Slow query logging and N+1 detection of the SQL instrumentation
+'''
+import pytest
+
+
+class Recorder:
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+
+@pytest.fixture
+def warnings(monkeypatch):
+    import utils.database.querystats as querystats
+    import utils.metrics as metrics
+
+    recorder = Recorder()
+    monkeypatch.setattr(querystats, "logger", recorder)
+    monkeypatch.setattr(metrics, "logger", recorder)
+    return recorder.warnings
+
+
+def test_slow_queries_are_logged_with_their_call_site(client, run, tokens, warnings, monkeypatch):
+    from utils.database.querystats import QUERY_STATS_OPTIONS
+
+    monkeypatch.setitem(QUERY_STATS_OPTIONS, "slow_query_ms", 0.0)
+    response = run(client.get("/v1/users", headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200
+
+    slow = [message for message in warnings if message.startswith("Slow query")]
+    assert slow
+    # The statement is traced back to the application code which issued it, not SQLAlchemy's
+    assert any(" at application/" in message for message in slow), slow
+
+
+def test_fast_queries_are_not_logged(client, run, tokens, warnings):
+    response = run(client.get("/v1/users", headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200
+    assert not [message for message in warnings if message.startswith("Slow query")]
+
+
+def test_repeated_statements_are_reported_with_their_call_site(run, app, monkeypatch):
+    from sqlalchemy import select
+    import utils.database as database
+    from utils.database.querystats import QUERY_STATS_OPTIONS, track_queries
+
+    monkeypatch.setitem(QUERY_STATS_OPTIONS, "n_plus_one_threshold", 3)
+    db = database.get_database()
+
+    async def users_one_by_one():
+        with track_queries() as queries:
+            async with db.async_session() as conn:
+                for user_id in range(4):
+                    await conn.execute(select(database.User.name).filter(database.User.id == user_id))
+                # One IN list of any length is one shape, it is not repeated
+                await conn.execute(select(database.User.name).filter(database.User.id.in_([1, 2])))
+        return queries
+
+    queries = run(users_one_by_one())
+    assert queries.count == 5
+    [repeated] = queries.n_plus_one()
+    assert repeated["count"] == 4
+    assert "FROM users" in repeated["statement"]
+    assert repeated["call_site"].startswith("tests/test_querystats.py:")
+    assert repeated["call_site"].endswith(" in users_one_by_one")
+
+
+def test_n_plus_one_is_logged_per_route(warnings, monkeypatch):
+    from utils.database.querystats import QueryStats, QUERY_STATS_OPTIONS
+    from utils.metrics import record_queries
+
+    monkeypatch.setitem(QUERY_STATS_OPTIONS, "n_plus_one_threshold", 2)
+    queries = QueryStats()
+    for user_id in range(3):
+        queries.record(f"SELECT name FROM users WHERE id = ?", 0.001)
+    record_queries("GET", "/v1/tests", queries)
+    [message] = warnings
+    assert message.startswith("Probable N+1 in GET /v1/tests: 3 x SELECT name FROM users WHERE id = ?")
+
+
+def test_parameter_lists_are_one_shape():
+    from utils.database.querystats import statement_shape
+
+    assert statement_shape("SELECT 1 FROM t WHERE id IN (?, ?,\n ?)") == statement_shape("SELECT 1 FROM t WHERE id IN (?)")
+    assert statement_shape("INSERT INTO t VALUES (%s, %s), (%s, %s)") == "INSERT INTO t VALUES (?), (?)"
@@ -0,0 +1,126 @@
+'''
+Archival of old audit logs, recovery of interrupted runs and reading the archives back
+'''
+import gzip
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+ACTION = "RETENTION_TEST"
+OLD = [datetime(2020, 1, 5, 10), datetime(2020, 1, 20, 10), datetime(2020, 1, 31, 23, 59, 59), datetime(2020, 2, 1), datetime(2020, 2, 10, 8)]
+
+
+@pytest.fixture
+def retention(app, tmp_path):
+    '''
+    Five logs in January and February 2020 and one recent log, and a retention archiving into tmp_path
+    '''
+    import utils.database as database
+    from sqlalchemy import delete
+    from application.retention import AuditRetention
+
+    db = database.get_database()
+    with db.session() as conn:
+        conn.add_all([
+            database.AuditLog(user_id=1 if index % 2 else 2, action=ACTION, entity_type="Camera", entity_id=index, details=f"old {index}", timestamp=timestamp)
+            for index, timestamp in enumerate(OLD)
+        ] + [database.AuditLog(user_id=1, action=ACTION, entity_type="Camera", entity_id=None, details="recent", timestamp=datetime.utcnow())])
+        conn.commit()
+
+    yield AuditRetention({"archive_dir": str(tmp_path), "max_age_days": 90, "batch_size": 2})
+
+    with db.session() as conn:
+        conn.execute(delete(database.AuditLog).filter(database.AuditLog.action == ACTION))
+        conn.commit()
+
+
+def remaining():
+    import utils.database as database
+    from sqlalchemy import select
+
+    with database.get_database().session() as conn:
+        return conn.execute(select(database.AuditLog.details).filter(database.AuditLog.action == ACTION)).scalars().all()
+
+
+def archived(retention, month):
+    with gzip.open(retention.archive_path(month), "rt") as archive_file:
+        return [json.loads(line)["details"] for line in archive_file]
+
+
+def test_old_months_are_archived(run, retention):
+    from application.retention import RETENTION_LOCK_KEY
+    from utils.cache import get_redis
+
+    assert run(retention.run_locked()) == 5
+    assert remaining() == ["recent"]
+    # January took two batches, each its own gzip member
+    assert archived(retention, datetime(2020, 1, 1)) == ["old 0", "old 1", "old 2"]
+    assert archived(retention, datetime(2020, 2, 1)) == ["old 3", "old 4"]
+    assert retention.read_manifest(datetime(2020, 1, 1))["rows"] == 3
+    assert run(get_redis().get(RETENTION_LOCK_KEY)) is None
+
+    # A second pass finds nothing left to archive
+    assert run(retention.run_locked()) == 0
+    assert archived(retention, datetime(2020, 1, 1)) == ["old 0", "old 1", "old 2"]
+
+
+def test_nothing_is_archived_while_the_lock_is_held(run, retention):
+    from application.retention import RETENTION_LOCK_KEY
+    from utils.cache import get_redis
+
+    run(get_redis().set(RETENTION_LOCK_KEY, "another-worker", ex=60))
+    try:
+        assert run(retention.run_locked()) is None
+        assert len(remaining()) == 6
+        assert run(get_redis().get(RETENTION_LOCK_KEY)) in ("another-worker", b"another-worker")
+    finally:
+        run(get_redis().delete(RETENTION_LOCK_KEY))
+
+
+def test_interrupted_batch_is_archived_once(run, retention, monkeypatch):
+    january = datetime(2020, 1, 1)
+    write_manifest = retention.write_manifest
+
+    def crash_after_append(month, manifest):
+        # The manifest without pending_size is written after the batch was appended
+        if "pending_size" not in manifest:
+            raise OSError(5, "Input/output error")
+        write_manifest(month, manifest)
+
+    monkeypatch.setattr(retention, "write_manifest", crash_after_append)
+    with pytest.raises(OSError):
+        run(retention.run_once())
+    assert archived(retention, january) == ["old 0", "old 1"]
+    assert retention.read_manifest(january) == {"archived_max_id": 0, "rows": 0, "pending_size": 0}
+
+    monkeypatch.undo()
+    assert run(retention.run_once()) == 5
+    assert archived(retention, january) == ["old 0", "old 1", "old 2"]
+    assert "pending_size" not in retention.read_manifest(january)
+    assert retention.read_manifest(january)["rows"] == 3
+
+
+def test_archive_reader(client, run, tokens, retention, monkeypatch):
+    from application.retention import audit_retention
+
+    run(retention.run_once())
+    # An unreadable archive of a month outside the requested range must not be opened
+    with open(retention.archive_path(datetime(2019, 12, 1)), "wb") as archive_file:
+        archive_file.write(b"not gzip")
+    monkeypatch.setattr(audit_retention, "archive_dir", retention.archive_dir)
+
+    def read(**params):
+        response = run(client.get("/v1/activity/archive", params=params, headers={"token": tokens["superadmin"]}))
+        assert response.status_code == 200, response.text
+        assert response.headers["content-type"] == "application/x-ndjson"
+        return [json.loads(line)["details"] for line in response.text.splitlines()]
+
+    assert read(since="2020-01-15T00:00:00") == ["old 1", "old 2", "old 3", "old 4"]
+    # since is inclusive, until is exclusive, aware bounds are compared in UTC
+    assert read(since="2020-02-01T00:00:00", until="2020-02-10T08:00:00") == ["old 3"]
+    assert read(since="2020-02-01T02:00:00+02:00", until="2020-02-10T10:00:01+02:00") == ["old 3", "old 4"]
+    assert read(since="2020-01-01T00:00:00", user_id=1) == ["old 1", "old 3"]
+    assert read(since="2020-01-01T00:00:00", entity_id=4) == ["old 4"]
+    assert os.path.exists(retention.archive_path(datetime(2019, 12, 1)))
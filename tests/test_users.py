@@ -0,0 +1,48 @@
+'''
+Role changes through PATCH /v1/users
+'''
+from benchmarks import environment
+
+
+def test_unchanged_role_keeps_sessions(client, run, tokens, monkeypatch):
+    import application.user_management as user_management
+
+    published = []
+
+    async def publish_permission_change(**kwargs):
+        published.append(kwargs)
+
+    monkeypatch.setattr(user_management, "publish_permission_change", publish_permission_change)
+
+    # ModifyUser defaults role to "supervisor", resending the current role is not a role change
+    data = {"user_email": environment.SUPERVISOR_EMAIL, "user_name": "supervisor", "role": "supervisor", "password": None}
+    response = run(client.patch("/v1/users", json=data, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200, response.text
+    assert published == []
+
+    data["role"] = "branchadmin"
+    response = run(client.patch("/v1/users", json=data, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200, response.text
+    assert len(published) == 1
+
+    data["role"] = "supervisor"
+    response = run(client.patch("/v1/users", json=data, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200, response.text
+    assert len(published) == 2
+
+
+def test_failed_broadcast_after_commit_is_not_an_error(client, run, tokens, make_user, monkeypatch):
+    import application.user_management as user_management
+
+    async def publish_permission_change(**kwargs):
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(user_management, "publish_permission_change", publish_permission_change)
+    email = make_user("broadcast-failure")
+
+    data = {"user_email": email, "role": "branchadmin", "password": None}
+    response = run(client.patch("/v1/users", json=data, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200, response.text
+
+    response = run(client.request("DELETE", "/v1/users", json={"user_email": email}, headers={"token": tokens["superadmin"]}))
+    assert response.status_code == 200, response.text
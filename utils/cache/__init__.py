@@ -0,0 +1,2 @@
+from utils.cache.resource import RedisResource, get_redis, close_redis, use_redis
+from utils.cache.pubsub import subscriber, publish
\ No newline at end of file
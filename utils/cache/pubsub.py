@@ -0,0 +1,90 @@
+"""Redis pub/sub fan-out to in-process handlers."""
+
+import asyncio
+import inspect
+import json
+
+from logger import logger
+from utils.cache.resource import get_redis
+
+
+class Subscriber:
+    '''
+    Single pub/sub connection per worker which dispatches JSON messages to registered handlers
+    '''
+    def __init__(self):
+        self.handlers = {}
+        self.reset_handlers = []
+        self._task = None
+        # True while subscribed, state pushed over pub/sub is only trustworthy while this holds
+        self.connected = False
+
+    def register(self, channel, handler, on_reset=None):
+        '''
+        Register a handler for a channel
+        on_reset is called whenever the subscription is (re)established since messages may have been missed,
+        it may be a coroutine function
+        '''
+        self.handlers[channel] = handler
+        if on_reset is not None:
+            self.reset_handlers.append(on_reset)
+
+    def start(self):
+        if self._task is None and self.handlers:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        backoff = 1
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.subscribe(*self.handlers)
+                for on_reset in self.reset_handlers:
+                    result = on_reset()
+                    if inspect.isawaitable(result):
+                        await result
+                self.connected = True
+                backoff = 1
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None:
+                        continue
+                    handler = self.handlers.get(message["channel"])
+                    if handler is None:
+                        continue
+                    try:
+                        handler(json.loads(message["data"]))
+                    except Exception:
+                        logger.exception(f"Failed to handle message on {message['channel']}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Redis subscriber disconnected: {e}, retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                self.connected = False
+                await pubsub.aclose()
+
+
+async def publish(channel, message: dict):
+    '''
+    Publish a JSON message to every worker
+    Failures are only logged, subscribers fall back to their TTLs
+    '''
+    try:
+        await get_redis().publish(channel, json.dumps(message))
+    except Exception as e:
+        logger.warning(f"Failed to publish to {channel}: {e}")
+
+
+subscriber = Subscriber()
@@ -0,0 +1,88 @@
+"""Redis module."""
+
+import json
+import os
+
+import redis.asyncio as aioredis
+
+from utils.exceptions import *
+
+
+# Pool settings that can be tuned from REDIS_CONNECTION_STRING
+REDIS_DEFAULTS = {
+    "max_connections": 50,
+    "pool_timeout": 5.0,
+    "socket_timeout": 2.0,
+    "socket_connect_timeout": 2.0,
+    "health_check_interval": 30,
+}
+
+
+class RedisResource:
+    def __init__(self, config: dict, client: aioredis.Redis = None) -> None:
+        self.config = config
+        self.pool_options = {key: type(default)(config.get(key, default)) for key, default in REDIS_DEFAULTS.items()}
+        self._client = client
+
+    @property
+    def client(self) -> aioredis.Redis:
+        '''
+        Lazily create the pooled client on first use so it binds to the running event loop
+        '''
+        if self._client is None:
+            pool = aioredis.BlockingConnectionPool(
+                host=self.config['host'],
+                port=int(self.config.get('port', 6379)),
+                db=int(self.config.get('db', 0)),
+                password=self.config.get('password') or None,
+                max_connections=self.pool_options['max_connections'],
+                timeout=self.pool_options['pool_timeout'],
+                socket_timeout=self.pool_options['socket_timeout'],
+                socket_connect_timeout=self.pool_options['socket_connect_timeout'],
+                health_check_interval=self.pool_options['health_check_interval'],
+                decode_responses=True,
+            )
+            self._client = aioredis.Redis(connection_pool=pool)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_resource = None
+
+
+def get_redis_resource() -> RedisResource:
+    '''
+    Return the process wide RedisResource configured from REDIS_CONNECTION_STRING
+    '''
+    global _resource
+    if _resource is None:
+        redis_connection_string = os.getenv('REDIS_CONNECTION_STRING', None)
+        if not redis_connection_string:
+            raise Error(status_code=500, details="Redis connection string not found in environment variables!")
+        _resource = RedisResource(json.loads(redis_connection_string))
+    return _resource
+
+
+def use_redis(client: aioredis.Redis):
+    '''
+    Make the process use the given client instead of one configured from REDIS_CONNECTION_STRING
+    Used by the benchmarks to run against an in-process fake redis
+    '''
+    global _resource
+    _resource = RedisResource({}, client=client)
+
+
+def get_redis() -> aioredis.Redis:
+    '''
+    Shared pooled asyncio Redis client
+    '''
+    return get_redis_resource().client
+
+
+async def close_redis():
+    if _resource is not None:
+        await _resource.close()
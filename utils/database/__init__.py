@@ -1,2 +1,3 @@
-from utils.database.resource import DatabaseResource
-from utils.database.models import *
\ No newline at end of file
+from utils.database.resource import DatabaseResource, get_database, pool_status, dispose_all
+from utils.database.models import *
+from utils.database.queries import user_with_role, camera_assignment, role_permission_names
\ No newline at end of file
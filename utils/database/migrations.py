@@ -0,0 +1,159 @@
+"""Versioned schema migrations.
+
+Migrations live in migrations/versions as <version>_<name>.py modules with an up(conn) and a down(conn)
+function. The applied version is recorded in the schema_version table.
+
+Usage:
+    python -m utils.database.migrations upgrade [version]
+    python -m utils.database.migrations downgrade <version>
+    python -m utils.database.migrations current
+"""
+
+from datetime import datetime
+import importlib
+import pkgutil
+import sys
+import time
+
+from sqlalchemy import inspect, text
+
+from utils.database.resource import get_database
+
+
+MIGRATIONS_PACKAGE = "migrations.versions"
+
+
+def create_index(conn, table, name, columns, unique=False):
+    '''
+    Create an index unless one with the same name already exists
+    '''
+    if name in {index["name"] for index in inspect(conn).get_indexes(table)}:
+        return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    conn.execute(text(f"CREATE {kind} `{name}` ON `{table}` ({column_list})"))
+
+
+def drop_index(conn, table, name):
+    '''
+    Drop an index if it exists
+    '''
+    if name not in {index["name"] for index in inspect(conn).get_indexes(table)}:
+        return
+    if conn.dialect.name == "mysql":
+        conn.execute(text(f"DROP INDEX `{name}` ON `{table}`"))
+    else:
+        conn.execute(text(f"DROP INDEX `{name}`"))
+
+
+def add_column(conn, table, name, definition):
+    '''
+    Add a column unless the table already has it
+    '''
+    if name in {column["name"] for column in inspect(conn).get_columns(table)}:
+        return
+    conn.execute(text(f"ALTER TABLE `{table}` ADD COLUMN `{name}` {definition}"))
+
+
+def drop_column(conn, table, name):
+    '''
+    Drop a column if it exists
+    '''
+    if name not in {column["name"] for column in inspect(conn).get_columns(table)}:
+        return
+    conn.execute(text(f"ALTER TABLE `{table}` DROP COLUMN `{name}`"))
+
+
+def load_migrations():
+    '''
+    Return (version, module) pairs sorted by version
+    '''
+    package = importlib.import_module(MIGRATIONS_PACKAGE)
+    migrations = []
+    for module_info in pkgutil.iter_modules(package.__path__):
+        version, _, _ = module_info.name.partition("_")
+        if not version.isdigit():
+            continue
+        migrations.append((int(version), importlib.import_module(f"{MIGRATIONS_PACKAGE}.{module_info.name}")))
+    return sorted(migrations, key=lambda migration: migration[0])
+
+
+class MigrationRunner:
+    def __init__(self, db=None):
+        self.db = db or get_database()
+        self.engine = self.db.engine
+
+    def wait_for_database(self, timeout=60):
+        '''
+        The database container may still be starting up when the app container starts
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                return
+            except Exception as e:
+                if time.monotonic() > deadline:
+                    raise
+                print(f"Waiting for database: {e}")
+                time.sleep(2)
+
+    def current_version(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER NOT NULL PRIMARY KEY, "
+                "description VARCHAR(255) NOT NULL, "
+                "applied_on DATETIME NOT NULL)"
+            ))
+            version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+        return version or 0
+
+    def upgrade(self, target=None):
+        current = self.current_version()
+        for version, migration in load_migrations():
+            if version <= current or (target is not None and version > target):
+                continue
+            print(f"Applying migration {version}: {migration.__doc__.strip()}")
+            # MySQL commits DDL implicitly, the version is recorded once the migration went through
+            with self.engine.begin() as conn:
+                migration.up(conn)
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO schema_version (version, description, applied_on) VALUES (:version, :description, :applied_on)"),
+                    {"version": version, "description": migration.__doc__.strip()[:255], "applied_on": datetime.utcnow()}
+                )
+
+    def downgrade(self, target):
+        current = self.current_version()
+        for version, migration in reversed(load_migrations()):
+            if version > current or version <= target:
+                continue
+            print(f"Reverting migration {version}: {migration.__doc__.strip()}")
+            with self.engine.begin() as conn:
+                migration.down(conn)
+            with self.engine.begin() as conn:
+                conn.execute(text("DELETE FROM schema_version WHERE version = :version"), {"version": version})
+
+
+def main(argv):
+    if not argv or argv[0] not in ("upgrade", "downgrade", "current"):
+        print(__doc__)
+        return 1
+    runner = MigrationRunner()
+    runner.wait_for_database()
+    command = argv[0]
+    if command == "upgrade":
+        runner.upgrade(int(argv[1]) if len(argv) > 1 else None)
+    elif command == "downgrade":
+        if len(argv) < 2:
+            print("downgrade needs a target version")
+            return 1
+        runner.downgrade(int(argv[1]))
+    print(f"Schema version: {runner.current_version()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
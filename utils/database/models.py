@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -45,6 +45,10 @@ class User(Base):
     role_links = relationship('UserRoleMap', back_populates='user', cascade="all, delete-orphan")
     roles = relationship('Role', secondary='user_role_map', back_populates='users', viewonly=True)
 
+    __table_args__ = (
+        Index('uq_users_email', 'email', unique=True),
+    )
+
 
 class Role(Base):
     __tablename__ = 'roles'
@@ -62,6 +66,10 @@ class Role(Base):
     users = relationship('User', secondary='user_role_map', back_populates='roles', viewonly=True)
     permissions = relationship('Permission', secondary='role_permission_map', back_populates='roles', viewonly=True)
 
+    __table_args__ = (
+        Index('uq_roles_name', 'name', unique=True),
+    )
+
 
 class Permission(Base):
     __tablename__ = 'permissions'
@@ -75,6 +83,10 @@ class Permission(Base):
     role_links = relationship('RolePermissionMap', back_populates='permission', cascade="all, delete-orphan")
     roles = relationship('Role', secondary='role_permission_map', back_populates='permissions', viewonly=True)
 
+    __table_args__ = (
+        Index('uq_permissions_permission_name', 'permission_name', unique=True),
+    )
+
 
 class Camera(Base):
     __tablename__ = 'cameras'
@@ -86,6 +98,15 @@ class Camera(Base):
     created_on = Column(Date, nullable=False)
     updated_by = Column(String(255), nullable=False)
     updated_on = Column(String(255), nullable=False)  # Per schema
+    # Reachability probe, TCP connect to probe_port or HTTP GET of probe_path, defaults from CAMERA_STATUS when NULL
+    probe_port = Column(Integer, nullable=True)
+    probe_path = Column(String(255), nullable=True)
+
+    __table_args__ = (
+        Index('uq_cameras_device_name', 'device_name', unique=True),
+        Index('idx_cameras_location', 'device_location', 'id'),
+        Index('idx_cameras_ip', 'device_ip'),
+    )
     
 
 class CameraAssignmentMap(Base):
@@ -104,6 +125,12 @@ class CameraAssignmentMap(Base):
     user = relationship("User", foreign_keys=[user_id])
     assigner = relationship("User", foreign_keys=[assigned_by])
 
+    # Listing walks (user_id, camera_id), per camera checks walk (camera_id, user_id)
+    __table_args__ = (
+        Index('idx_camera_assignment_user', 'user_id', 'camera_id'),
+        Index('uq_camera_assignment_camera_user', 'camera_id', 'user_id', unique=True),
+    )
+
 class AuditLog(Base):
     __tablename__ = 'audit_logs'
 
@@ -113,6 +140,14 @@ class AuditLog(Base):
     entity_type = Column(String(100), nullable=False)
     entity_id = Column(Integer, nullable=True)
     details = Column(String(255), nullable=True)
-    timestamp = Column(Date, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+
+    user = relationship("User")
 
-    user = relationship("User")
\ No newline at end of file
+    # Every listing is ordered by (timestamp, id), filters lead the composite indexes
+    __table_args__ = (
+        Index('idx_audit_logs_timestamp', 'timestamp', 'id'),
+        Index('idx_audit_logs_user', 'user_id', 'timestamp', 'id'),
+        Index('idx_audit_logs_action', 'action', 'timestamp', 'id'),
+        Index('idx_audit_logs_entity', 'entity_type', 'entity_id', 'timestamp', 'id'),
+    )
\ No newline at end of file
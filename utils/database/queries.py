@@ -0,0 +1,54 @@
+"""Explicitly loaded queries for the hot paths.
+
+Relationships in models.py are lazy and the asyncio session can not load them on access,
+these helpers fetch everything their callers need in one statement each.
+"""
+
+from sqlalchemy import and_, select
+from sqlalchemy.orm import joinedload
+
+from utils.database.models import Camera, CameraAssignmentMap, Permission, Role, RolePermissionMap, User, UserRoleMap
+
+
+async def user_with_role(conn, email=None, user_id=None):
+    '''
+    User by email or id with user.roles loaded through a joined eager load, None if there is no such user
+    '''
+    query = select(User).options(joinedload(User.roles))
+    if email is not None:
+        query = query.filter(User.email == email)
+    if user_id is not None:
+        query = query.filter(User.id == user_id)
+    result = await conn.execute(query)
+    return result.unique().scalars().first()
+
+
+async def camera_assignment(conn, device_name, user_id):
+    '''
+    Camera by name together with its assignment to the user and the rank of whoever made that assignment
+    Returns a (camera, assignment, assigner_rank) row, assignment and assigner_rank are None when the
+    camera is not assigned to the user, the row is None when the camera does not exist.
+    assigner_rank is also None when whoever made the assignment has no role
+    '''
+    result = await conn.execute(select(
+        Camera,
+        CameraAssignmentMap,
+        Role.rank.label("assigner_rank")
+    ).outerjoin(
+        CameraAssignmentMap, and_(CameraAssignmentMap.camera_id == Camera.id, CameraAssignmentMap.user_id == user_id)
+    ).outerjoin(
+        UserRoleMap, UserRoleMap.user_id == CameraAssignmentMap.assigned_by
+    ).outerjoin(
+        Role, Role.id == UserRoleMap.role_id
+    ).filter(Camera.device_name == device_name))
+    return result.first()
+
+
+async def role_permission_names(conn, role_id):
+    '''
+    Names of the permissions granted to a role
+    '''
+    result = await conn.execute(select(Permission.permission_name).join(
+        RolePermissionMap, RolePermissionMap.permission_id == Permission.id
+    ).filter(RolePermissionMap.role_id == role_id))
+    return frozenset(result.scalars().all())
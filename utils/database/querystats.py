@@ -0,0 +1,178 @@
+"""SQL statement instrumentation.
+
+Engine event hooks time every statement. Statements are attributed to the asyncio task running them,
+which is the request while a track_queries() block is active, so statements issued from SQLAlchemy's
+asyncio greenlets are counted too.
+
+The block of a request ends when its handler returns. The body of a StreamingResponse (the activity log export)
+is iterated afterwards, in a task of its own, so its statements are not attributed to the request. They are
+still timed in db_query_duration_seconds and logged when slow.
+"""
+
+from contextlib import contextmanager
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+import weakref
+
+import greenlet
+from sqlalchemy import event
+
+from logger import logger
+from utils.metrics import DB_QUERY_LATENCY, DB_SLOW_QUERIES
+
+
+QUERY_STATS_DEFAULTS = {
+    "slow_query_ms": 200.0,
+    "n_plus_one_threshold": 5,
+    "debug_headers": False,
+}
+_config = json.loads(os.getenv('SQL_INSTRUMENTATION', '{}'))
+QUERY_STATS_OPTIONS = {key: type(default)(_config.get(key, default)) for key, default in QUERY_STATS_DEFAULTS.items()}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATABASE_PACKAGE = os.path.dirname(os.path.abspath(__file__))
+
+# Bound parameter lists of IN (...) and multi-row VALUES vary in length, they are one shape
+PARAMETER_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s)(?:\s*,\s*(?:\?|%s|%\(\w+\)s))*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    return PARAMETER_LIST.sub("(?)", WHITESPACE.sub(" ", statement).strip())
+
+
+def is_app_frame(frame):
+    filename = frame.f_code.co_filename
+    return filename.startswith(ROOT) and not filename.startswith(DATABASE_PACKAGE) and "site-packages" not in filename
+
+
+def frame_site(frame):
+    return f"{os.path.relpath(frame.f_code.co_filename, ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+
+def call_site():
+    '''
+    Innermost application frame which led to the statement
+    With the asyncio engine the statement runs in a greenlet whose stack does not reach the caller,
+    the caller is then found on the stack of the greenlet which spawned it (the running coroutines),
+    or else on the suspended coroutine chain of the current task
+    '''
+    stacks = [sys._getframe(1)]
+    spawner = greenlet.getcurrent().parent
+    while spawner is not None:
+        stacks.append(spawner.gr_frame)
+        spawner = spawner.parent
+    for frame in stacks:
+        while frame is not None:
+            if is_app_frame(frame):
+                return frame_site(frame)
+            frame = frame.f_back
+    task = current_task()
+    if task is None:
+        return "unknown"
+    site = "unknown"
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        if is_app_frame(frame):
+            site = frame_site(frame)
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return site
+
+
+def current_task():
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+class QueryStats:
+    '''
+    Statements run within one request
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.shapes = {}
+        self.repeated = {}
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.total_seconds += seconds
+        shape = statement_shape(statement)
+        seen = self.shapes.get(shape, 0) + 1
+        self.shapes[shape] = seen
+        if seen == QUERY_STATS_OPTIONS["n_plus_one_threshold"]:
+            # Only looked up once per shape, the first repetitions all come from the same place as a rule
+            self.repeated[shape] = call_site()
+
+    def n_plus_one(self):
+        '''
+        Shapes run at least n_plus_one_threshold times, probable lazy loads or queries in a loop
+        '''
+        return [{"statement": shape, "count": self.shapes[shape], "call_site": site} for shape, site in self.repeated.items()]
+
+
+_active = weakref.WeakKeyDictionary()
+
+
+@contextmanager
+def track_queries():
+    '''
+    Collect the statements run by the current task until the block ends
+    Blocks nest, e.g. a test tracking a request which the route class tracks as well, every block counts
+    '''
+    task = current_task()
+    stats = QueryStats()
+    if task is None:
+        yield stats
+        return
+    _active.setdefault(task, []).append(stats)
+    try:
+        yield stats
+    finally:
+        active = _active.get(task)
+        if active is not None:
+            active.remove(stats)
+            if not active:
+                del _active[task]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_start")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    DB_QUERY_LATENCY.observe(seconds)
+
+    if seconds * 1000 >= QUERY_STATS_OPTIONS["slow_query_ms"]:
+        DB_SLOW_QUERIES.inc()
+        logger.warning(f"Slow query ({seconds * 1000:.1f}ms) at {call_site()}: {WHITESPACE.sub(' ', statement)[:1000]}")
+
+    task = current_task()
+    for stats in (_active.get(task, ()) if task is not None else ()):
+        stats.record(statement, seconds)
+
+
+def _handle_error(exception_context):
+    # The statement failed, drop its start time so the stack stays balanced
+    started = exception_context.connection.info.get("query_start") if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -1,26 +1,116 @@
 """Database module."""
 
-from contextlib import contextmanager, AbstractContextManager
+from contextlib import contextmanager, asynccontextmanager, AbstractContextManager
 from typing import Callable
-import logging
+import json
+import os
+import threading
+import time
 
-from sqlalchemy import create_engine, orm
+from sqlalchemy import create_engine, exc, orm
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from utils.metrics import DB_POOL_WAIT, DB_POOL_TIMEOUTS
+from utils.database.querystats import instrument_engine
+
+
+# Pool settings that can be tuned from DB_CONNECTION_STRING
+POOL_DEFAULTS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_recycle": 1800,
+    "pool_timeout": 30,
+}
+
+# Driver used for the asyncio engine of each dialect, can be overridden with "async_driver"
+ASYNC_DRIVERS = {
+    "mysql": "aiomysql",
+    "sqlite": "aiosqlite",
+}
+
+
+class TimedPoolMixin:
+    '''
+    Pool mixin which keeps track of how long callers waited for a connection
+    '''
+    engine_kind = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            DB_POOL_TIMEOUTS.labels(self.engine_kind).inc()
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.wait_count += 1
+            self.wait_total += waited
+            DB_POOL_WAIT.labels(self.engine_kind).observe(waited)
+            if waited > self.wait_max:
+                self.wait_max = waited
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    engine_kind = "sync"
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    engine_kind = "async"
 
 
 class DatabaseResource:
     engine_url = '{}://{}:{}@{}:{}/{}'
+    sqlite_url = '{}:///{}'
     def __init__(self, config: dict) -> None:
-        db_url = self.engine_url.format(
-            config['dialect'],
-            config['username'],
-            config['password'], 
-            config['host'], 
-            config['port'], 
-            config['db_name']
+        dialect = config['dialect'].split('+')[0]
+        async_dialect = f"{dialect}+{config.get('async_driver', ASYNC_DRIVERS.get(dialect))}"
+        connect_args = {}
+        if dialect == 'sqlite':
+            # db_name is the path of the database file
+            db_url = self.sqlite_url.format(config['dialect'], config['db_name'])
+            async_db_url = self.sqlite_url.format(async_dialect, config['db_name'])
+            connect_args = {"check_same_thread": False}
+            self.name = f"sqlite/{config['db_name']}"
+        else:
+            db_url = self.engine_url.format(
+                config['dialect'],
+                config['username'],
+                config['password'],
+                config['host'],
+                config['port'],
+                config['db_name']
+            )
+            async_db_url = self.engine_url.format(
+                async_dialect,
+                config['username'],
+                config['password'],
+                config['host'],
+                config['port'],
+                config['db_name']
+            )
+            self.name = f"{config['host']}/{config['db_name']}"
+        self.pool_options = {key: int(config.get(key, default)) for key, default in POOL_DEFAULTS.items()}
+        self._engine = create_engine(
+            db_url,
+            echo=False,
+            pool_pre_ping=True,
+            poolclass=TimedQueuePool,
+            connect_args=connect_args,
+            **self.pool_options
         )
-        self._engine = create_engine(db_url, echo=False,pool_pre_ping=True)
+        instrument_engine(self._engine)
         self._session_factory = orm.scoped_session(
             orm.sessionmaker(
                 autocommit=False,
@@ -28,7 +118,26 @@ class DatabaseResource:
                 bind=self._engine,
             ),
         )
+        self._async_engine = create_async_engine(
+            async_db_url,
+            echo=False,
+            pool_pre_ping=True,
+            poolclass=TimedAsyncQueuePool,
+            **self.pool_options
+        )
+        instrument_engine(self._async_engine.sync_engine)
+        # Objects stay usable after commit since async sessions can not lazy load expired attributes
+        self._async_session_factory = orm.sessionmaker(
+            autoflush=False,
+            expire_on_commit=False,
+            bind=self._async_engine,
+            class_=AsyncSession,
+        )
+
 
+    @property
+    def engine(self):
+        return self._engine
 
     @contextmanager
     def session(self):
@@ -39,4 +148,76 @@ class DatabaseResource:
             session.rollback()
             raise
         finally:
-            session.close()
\ No newline at end of file
+            session.close()
+
+    @asynccontextmanager
+    async def async_session(self):
+        session: AsyncSession = self._async_session_factory()
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+    async def dispose(self):
+        await self._async_engine.dispose()
+        self._engine.dispose()
+
+    def pool_status(self):
+        '''
+        Report the current usage of the sync and async connection pools
+        '''
+        return [
+            self._pool_stats("sync", self._engine.pool),
+            self._pool_stats("async", self._async_engine.sync_engine.pool),
+        ]
+
+    def _pool_stats(self, engine, pool):
+        return {
+            "name": self.name,
+            "engine": engine,
+            "pool_size": pool.size(),
+            "max_overflow": self.pool_options["max_overflow"],
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "wait_count": pool.wait_count,
+            "wait_total_seconds": pool.wait_total,
+            "wait_max_seconds": pool.wait_max,
+            "timeouts": pool.timeouts,
+        }
+
+
+# One DatabaseResource per distinct config, shared by every module in the process
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_database(config: dict = None) -> DatabaseResource:
+    '''
+    Return the process wide DatabaseResource for the given config
+    Falls back to DB_CONNECTION_STRING when no config is passed
+    '''
+    if config is None:
+        config = json.loads(os.getenv('DB_CONNECTION_STRING', '{}'))
+    key = json.dumps(config, sort_keys=True)
+    with _registry_lock:
+        resource = _registry.get(key)
+        if resource is None:
+            resource = DatabaseResource(config)
+            _registry[key] = resource
+    return resource
+
+
+def pool_status():
+    '''
+    Report pool usage for every engine created in this process
+    '''
+    return [stats for resource in list(_registry.values()) for stats in resource.pool_status()]
+
+
+async def dispose_all():
+    for resource in list(_registry.values()):
+        await resource.dispose()
@@ -0,0 +1,119 @@
+"""Password hashing module."""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+from utils.exceptions import *
+from utils.metrics import HASHING_LATENCY, HASHING_REJECTED, HASHING_WAIT, HASHING_WAITING, mark_process_dead
+
+
+context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash(plain_password):
+    return context.hash(plain_password)
+
+
+def _verify(password_hashed, plain_password):
+    return context.verify(plain_password, password_hashed)
+
+
+# Pool settings that can be tuned from HASHING_POOL
+HASHING_DEFAULTS = {
+    "workers": 2,
+    "max_concurrency": 2,
+    "max_queue": 32,
+}
+
+
+class HashingPool:
+    '''
+    Runs bcrypt in worker processes so hashing never blocks the event loop
+    At most max_concurrency jobs run at once and at most max_queue callers may wait for a slot,
+    anything beyond that is rejected with a 503
+    '''
+    def __init__(self, config: dict) -> None:
+        self.options = {key: int(config.get(key, default)) for key, default in HASHING_DEFAULTS.items()}
+        self._executor = None
+        self._semaphore = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self.timings = {}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.options["workers"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def run(self, operation, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.options["max_concurrency"])
+        if self.waiting >= self.options["max_queue"]:
+            self.rejected += 1
+            HASHING_REJECTED.inc()
+            raise Error(status_code=503, details="Server is busy, please try again shortly!")
+
+        self.waiting += 1
+        HASHING_WAITING.set(self.waiting)
+        queued = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            HASHING_WAITING.set(self.waiting)
+            HASHING_WAIT.labels(operation).observe(time.perf_counter() - queued)
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self._record(operation, time.perf_counter() - start)
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def _record(self, operation, duration):
+        timing = self.timings.setdefault(operation, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        HASHING_LATENCY.labels(operation).observe(duration)
+        timing["count"] += 1
+        timing["total_seconds"] += duration
+        if duration > timing["max_seconds"]:
+            timing["max_seconds"] = duration
+
+    async def hash(self, plain_password):
+        return await self.run("hash", _hash, plain_password)
+
+    async def verify(self, password_hashed, plain_password):
+        return await self.run("verify", _verify, password_hashed, plain_password)
+
+    def stats(self):
+        return {
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "timings": {operation: dict(timing) for operation, timing in self.timings.items()},
+            **self.options,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            # The children may be stopped before their own exit handlers run, their gauges are dropped here
+            pids = list(self._executor._processes or {})
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            for pid in pids:
+                mark_process_dead(pid)
+
+
+hashing_pool = HashingPool(json.loads(os.getenv('HASHING_POOL', '{}')))
@@ -0,0 +1,203 @@
+"""Prometheus metrics module.
+
+With PROMETHEUS_MULTIPROC_DIR set every uvicorn worker writes its samples to that directory and /metrics
+aggregates the files of all workers, the directory must be emptied before the workers start (see start.sh).
+Every process importing this module (workers, hashing pool children, CLIs) removes its live gauges on exit.
+"""
+
+import asyncio
+import atexit
+import os
+import time
+
+from fastapi import Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.exceptions import HTTPException
+
+from logger import logger, log_handler
+from utils.exceptions import *
+
+
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+SAMPLE_INTERVAL = float(os.getenv('METRICS_SAMPLE_INTERVAL', 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BCRYPT_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+
+REQUESTS = Counter("http_requests_total", "Requests handled by the API", ["method", "route", "status"])
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Request latency of the API", ["method", "route"], buckets=LATENCY_BUCKETS)
+ERRORS = Counter("app_errors_total", "Errors returned to clients by status code", ["status_code"])
+
+DB_POOL_WAIT = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled DB connection", ["engine"], buckets=FAST_BUCKETS)
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts which timed out waiting for a DB connection", ["engine"])
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "Duration of single SQL statements", buckets=FAST_BUCKETS)
+DB_SLOW_QUERIES = Counter("db_slow_queries_total", "SQL statements slower than slow_query_ms")
+DB_QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQL statements run by one request", ["route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+DB_TIME_PER_REQUEST = Histogram("db_time_per_request_seconds", "Time one request spent in SQL statements", ["route"], buckets=LATENCY_BUCKETS)
+DB_N_PLUS_ONE = Counter("db_n_plus_one_total", "Requests which repeated a statement shape n_plus_one_threshold times", ["route"])
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "DB connections in use", ["name", "engine"], multiprocess_mode="livesum")
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "DB connections opened beyond pool_size", ["name", "engine"], multiprocess_mode="livesum")
+DB_POOL_IDLE = Gauge("db_pool_idle", "Idle DB connections", ["name", "engine"], multiprocess_mode="livesum")
+
+AUTH_LATENCY = Histogram("auth_duration_seconds", "Time spent authenticating and authorizing requests", ["stage", "outcome"], buckets=FAST_BUCKETS)
+REDIS_LATENCY = Histogram("redis_command_duration_seconds", "Redis round trip latency", ["operation"], buckets=FAST_BUCKETS)
+
+HASHING_LATENCY = Histogram("password_hashing_duration_seconds", "bcrypt hash and verify durations in the hashing pool", ["operation"], buckets=BCRYPT_BUCKETS)
+HASHING_WAIT = Histogram("password_hashing_wait_seconds", "Time bcrypt jobs waited for a hashing slot", ["operation"], buckets=FAST_BUCKETS + (2.5, 5.0))
+HASHING_REJECTED = Counter("password_hashing_rejected_total", "bcrypt jobs rejected because the queue was full")
+HASHING_WAITING = Gauge("password_hashing_waiting", "Callers waiting for a bcrypt slot", multiprocess_mode="livesum")
+
+AUDIT_QUEUE_DEPTH = Gauge("audit_writer_queue_depth", "Audit rows waiting to be written", multiprocess_mode="livesum")
+AUDIT_FLUSH_LATENCY = Histogram("audit_writer_flush_duration_seconds", "Duration of one multi-row audit insert incl. commit", ["outcome"], buckets=LATENCY_BUCKETS)
+AUDIT_BATCH_SIZE = Histogram("audit_writer_batch_size", "Rows written by one audit flush", buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000))
+
+LOG_QUEUE_DEPTH = Gauge("log_queue_depth", "Log records waiting to be written", multiprocess_mode="livesum")
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+class MetricsRoute(APIRoute):
+    '''
+    Route class which counts requests and observes their latency, labelled with the route template
+    The SQL statements of the request are counted too, see utils.database.querystats
+    '''
+    def get_route_handler(self):
+        # Imported here since the database module imports this one
+        from utils.database.querystats import track_queries, QUERY_STATS_OPTIONS
+
+        handler = super().get_route_handler()
+        route = self.path_format
+
+        async def instrumented_handler(request: Request) -> Response:
+            start = time.perf_counter()
+            status = 500
+            with track_queries() as queries:
+                try:
+                    response = await handler(request)
+                    status = response.status_code
+                    if QUERY_STATS_OPTIONS["debug_headers"]:
+                        response.headers["X-DB-Queries"] = str(queries.count)
+                        response.headers["X-DB-Time-Ms"] = f"{queries.total_seconds * 1000:.1f}"
+                        response.headers["X-DB-Repeated-Statements"] = str(len(queries.repeated))
+                    return response
+                except (Error, HTTPException) as e:
+                    status = e.status_code
+                    raise
+                except RequestValidationError:
+                    status = 422
+                    raise
+                finally:
+                    REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - start)
+                    REQUESTS.labels(request.method, route, str(status)).inc()
+                    record_queries(request.method, route, queries)
+
+        return instrumented_handler
+
+
+def record_queries(method, route, queries):
+    DB_QUERIES_PER_REQUEST.labels(route).observe(queries.count)
+    DB_TIME_PER_REQUEST.labels(route).observe(queries.total_seconds)
+    repeated = queries.n_plus_one()
+    if repeated:
+        DB_N_PLUS_ONE.labels(route).inc()
+        for statement in repeated:
+            logger.warning(f"Probable N+1 in {method} {route}: {statement['count']} x {statement['statement'][:300]} at {statement['call_site']}")
+
+
+def sample_logging():
+    LOG_QUEUE_DEPTH.set(log_handler.queue.qsize())
+    dropped, log_handler.dropped = log_handler.dropped, 0
+    if dropped:
+        LOG_RECORDS_DROPPED.inc(dropped)
+
+
+def sample_pools():
+    # Imported here since the database module imports this one
+    from utils.database import pool_status
+
+    for stats in pool_status():
+        labels = (stats["name"], stats["engine"])
+        DB_POOL_CHECKED_OUT.labels(*labels).set(stats["checked_out"])
+        DB_POOL_OVERFLOW.labels(*labels).set(stats["overflow"])
+        DB_POOL_IDLE.labels(*labels).set(stats["idle"])
+
+
+class MetricsSampler:
+    '''
+    Periodically copies point in time state (pool usage, queue depths) of this worker into gauges
+    Gauges can not be filled at scrape time since only one of the workers serves the scrape
+    '''
+    def __init__(self, interval):
+        self.interval = interval
+        self.samplers = [sample_pools, sample_logging]
+        self._task = None
+
+    def register(self, sampler):
+        self.samplers.append(sampler)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Live gauges of this worker must not be reported anymore
+        mark_process_dead(os.getpid())
+
+    def sample(self):
+        for sampler in self.samplers:
+            sampler()
+
+    async def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Failed to sample metrics")
+            await asyncio.sleep(self.interval)
+
+
+metrics_sampler = MetricsSampler(SAMPLE_INTERVAL)
+
+
+def mark_process_dead(pid):
+    '''
+    Drop the live gauge files of a process which exited
+    '''
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+if MULTIPROCESS:
+    atexit.register(mark_process_dead, os.getpid())
+
+
+def render_metrics():
+    '''
+    Metrics of every worker in the text exposition format
+    '''
+    metrics_sampler.sample()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)